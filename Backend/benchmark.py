@@ -0,0 +1,357 @@
+"""
+Optimizer benchmark: a corpus of frozen planning instances, a runner and a regression check.
+
+An instance is one Optimizer.generate_plan call frozen as JSON. It holds the section and layout,
+the simulation time, the AI priorities, the FAULTY / BAD-weather segments and the trains the call
+saw, stripped to the fields the optimizer reads. Running one only needs the layout, so the corpus
+stays valid while the simulation itself changes. `capture` rebuilds the corpus:
+- the largest and the busiest planning calls of headless runs on the DLI and Ghaziabad layouts
+  (Ghaziabad's own three-train schedule never needs CP-SAT, so it runs the intelligent schedule)
+- synthetic DLI boards of 5 / 20 / 50 / 100 waiting trains drawn from its schedule (fixed seed)
+
+`run` plans every instance on a fresh Optimizer (no plan cache, presolve timed) and
+reports model size, presolve time, time to first feasible, objective and status. `compare` checks a
+result file against the stored baseline and exits non-zero on a regression. Timings are only
+comparable on the machine and thread count the baseline was taken with; re-save it after moving.
+
+    python benchmark.py capture
+    python benchmark.py run --save-baseline
+    python benchmark.py run --compare
+    python benchmark.py compare results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import time
+
+import pandas as pd
+
+from eventlog import EventLog, OFF
+from headless import DEFAULT_PRIORITIES, run_headless
+from optimizer import GREEDY_MAX_TRAINS, STATUS_ORDER, Optimizer
+from plan_cache import PlanCache
+from simulation import Simulation
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+BASELINE_NAME = 'baseline.json'
+CAPTURED_RUNS = (('DLI', None), ('GZB', 'data/intelligent_schedule.csv'))  # (section, schedule)
+SYNTHETIC_SECTION = 'DLI'
+SYNTHETIC_SIZES = (5, 20, 50, 100)
+SYNTHETIC_TIME = 3600
+SYNTHETIC_SEED = 2025
+# what the Optimizer reads from a train dict
+TRAIN_FIELDS = ('id', 'type', 'state', 'start_node', 'end_node', 'scheduled_arrival', 'dynamic_priority',
+                'route', 'currentSegmentId', 'positionOnSegment')
+
+# a result regresses when it is slower than baseline * TIME_RATIO + TIME_SLACK, has a model more than
+# SIZE_RATIO times larger, or a worse objective: any worse when both runs proved optimality, else worse
+# by more than OBJECTIVE_TOLERANCE (time-limited multi-threaded searches do not end on the same plan),
+# a worse status or CP-SAT status, or more groups falling back to greedy. Timings only count between
+# runs with the same solver thread count
+TIME_RATIO = 1.25
+TIME_SLACK = 0.05
+SIZE_RATIO = 1.05
+OBJECTIVE_TOLERANCE = 0.01
+TIMED = ('presolve_seconds', 'first_feasible_seconds', 'wall_seconds')
+SIZED = ('variables', 'constraints')
+
+
+def freeze(sim, trains_to_plan, state, name, source):
+    """An instance from a planning call: the trains to plan and the state the optimizer gets."""
+    return {
+        'name': name,
+        'source': source,
+        'section': sim.section_code,
+        'layout': sim.layout_path,
+        'time': state['timestamp'],
+        'priorities': dict(sim.current_ai_priorities),
+        'faulty': sorted(sid for sid, s in sim.segments_map.items() if s.get('status') == 'FAULTY'),
+        'bad_weather': sorted(sid for sid, s in sim.segments_map.items() if s.get('weather') == 'BAD'),
+        'waiting': [t['id'] for t in trains_to_plan],
+        # the optimizer plans the waiting trains around the running ones; nobody else matters
+        'trains': [{k: _plain(t[k]) for k in TRAIN_FIELDS if k in t} for t in state['trains']
+                   if t['state'] == 'RUNNING' or t in trains_to_plan],
+    }
+
+
+def _plain(value):
+    # train dicts hold live lists and numpy scalars (kinematics); the corpus holds JSON copies
+    if isinstance(value, list):
+        return list(value)
+    return value.item() if hasattr(value, 'item') else value
+
+
+def capture_section(section_code, schedule_path=None):
+    """
+    Two planning calls of a headless run. Largest: the most waiting trains, the earliest such call.
+    Busiest: the most running trains among the calls CP-SAT would see, the latest such call.
+    """
+    calls = []
+
+    def on_plan(sim, trains, state):
+        running = sum(1 for t in state['trains'] if t['state'] == 'RUNNING')
+        calls.append((len(trains), running, freeze(sim, trains, state, None, None)))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_headless(section_code, schedule_path=schedule_path, log_level='off', seed=SYNTHETIC_SEED, on_plan=on_plan)
+    if not calls:
+        return []
+    prefix = section_code.lower()
+    largest = max(range(len(calls)), key=lambda i: (calls[i][0], calls[i][1], -i))
+    picked = [(largest, 'largest', 'most waiting trains')]
+    solver_sized = [i for i in range(len(calls)) if calls[i][0] > GREEDY_MAX_TRAINS]
+    busiest = max(solver_sized, key=lambda i: (calls[i][1], i), default=largest)
+    if busiest != largest:
+        picked.append((busiest, 'busiest', 'most running trains'))
+    instances = []
+    for index, label, why in picked:
+        waiting, running, instance = calls[index]
+        instance['name'] = f"{prefix}-{label}"
+        instance['source'] = (f"headless {section_code} run ({schedule_path or 'default schedule'}), "
+                              f"planning call {index + 1}/{len(calls)} "
+                              f"({why}: {waiting} waiting, {running} running)")
+        instances.append(instance)
+    return instances
+
+
+def synthetic(section_code, waiting, at=SYNTHETIC_TIME, seed=SYNTHETIC_SEED):
+    """`waiting` trains drawn from the section's schedule, all waiting at `at`, up to 15 min late."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim = Simulation(section_code, engine_mode='event', event_log=EventLog(level=OFF))
+        sim.set_ai_priorities(DEFAULT_PRIORITIES)
+    rng = random.Random(seed + waiting)
+    rows = [r for r in sim.master_schedule if sim.find_all_possible_routes(r.get('Start Node'), r.get('End Node'))]
+    trains = []
+    for k in range(waiting):
+        row = rng.choice(rows)
+        trains.append({
+            'id': f"SYN{k:03d}", 'type': row.get('Type', 'Passenger'), 'state': 'WAITING_PLAN',
+            'start_node': row.get('Start Node'), 'end_node': row.get('End Node'),
+            'scheduled_arrival': at - rng.randrange(0, 900),
+            'route': [], 'currentSegmentId': None, 'positionOnSegment': 0.0,
+        })
+    name = f"{section_code.lower()}-synthetic-{waiting}"
+    return freeze(sim, trains, {'timestamp': at, 'trains': trains}, name,
+                  f"synthetic: {waiting} waiting trains from the {section_code} schedule, seed {seed + waiting}")
+
+
+def capture(directory=CORPUS_DIR):
+    """Rebuild the corpus files in `directory`. Returns the instance names."""
+    os.makedirs(directory, exist_ok=True)
+    instances = [i for section, schedule in CAPTURED_RUNS for i in capture_section(section, schedule)]
+    instances += [synthetic(SYNTHETIC_SECTION, n) for n in SYNTHETIC_SIZES]
+    for instance in instances:
+        with open(os.path.join(directory, f"{instance['name']}.json"), 'w', encoding='utf-8') as f:
+            json.dump(instance, f, indent=1)
+    return [i['name'] for i in instances]
+
+
+def load_corpus(directory=CORPUS_DIR, only=None):
+    instances = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.json') or filename == BASELINE_NAME:
+            continue
+        with open(os.path.join(directory, filename), encoding='utf-8') as f:
+            instance = json.load(f)
+        if not only or instance['name'] in only:
+            instances.append(instance)
+    return instances
+
+
+def run_instance(instance, num_workers=None):
+    """Plan one instance on a fresh Optimizer; returns its result row."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim = Simulation(instance['section'], engine_mode='event', event_log=EventLog(level=OFF),
+                         layout_path=instance['layout'])
+        sim.set_ai_priorities(instance['priorities'])
+        for segment_id in instance['faulty']:
+            sim.set_track_status(segment_id, 'FAULTY')
+        if instance['bad_weather']:
+            sim.set_bad_weather(instance['bad_weather'])
+        optimizer = Optimizer(sim, num_workers=num_workers)
+        optimizer.plan_cache = PlanCache(0)
+        optimizer.measure_presolve = True
+        waiting = set(instance['waiting'])
+        trains = [dict(t) for t in instance['trains']]
+        started = time.perf_counter()
+        plan = optimizer.generate_plan([t for t in trains if t['id'] in waiting],
+                                       {'timestamp': instance['time'], 'trains': trains}, instance['priorities'])
+        wall = time.perf_counter() - started
+    stats = optimizer.last_stats or {}
+    return {
+        'name': instance['name'],
+        'waiting': len(waiting),
+        'running': sum(1 for t in trains if t['state'] == 'RUNNING'),
+        'planned': len(plan),
+        'components': stats.get('components'),
+        'methods': stats.get('methods', {}),
+        'variables': stats.get('variables'),
+        'constraints': stats.get('constraints'),
+        'presolve_seconds': stats.get('presolve_seconds'),
+        'first_feasible_seconds': stats.get('first_feasible_seconds'),
+        'wall_seconds': round(wall, 4),
+        'objective': stats.get('objective'),
+        'status': stats.get('status'),
+        'cp_sat_status': stats.get('cp_sat_status'),
+    }
+
+
+def run_corpus(instances, num_workers=None, on_result=None):
+    results = []
+    for instance in instances:
+        row = run_instance(instance, num_workers)
+        results.append(row)
+        if on_result:
+            on_result(row, len(results), len(instances))
+    return {'created': time.time(), 'threads': num_workers or os.cpu_count(), 'results': results}
+
+
+def compare(report, baseline):
+    """
+    Findings of `report` against `baseline` (both run_corpus() outputs): a list of dicts with the
+    instance, metric, both values and 'regression' or 'improvement'. Instances missing on either side
+    are reported as 'missing' / 'new'. Timings are skipped when the two ran with different thread counts.
+    """
+    base = {row['name']: row for row in baseline['results']}
+    timed = TIMED if report.get('threads') == baseline.get('threads') else ()
+    findings = []
+
+    def note(name, metric, was, now, kind):
+        findings.append({'name': name, 'metric': metric, 'baseline': was, 'now': now, 'verdict': kind})
+
+    for row in report['results']:
+        name = row['name']
+        was = base.pop(name, None)
+        if was is None:
+            note(name, 'instance', None, None, 'new')
+            continue
+        rank = lambda status: STATUS_ORDER.index(status) if status in STATUS_ORDER else -1
+        for metric in ('status', 'cp_sat_status'):
+            # a CP-SAT status appearing or disappearing is a method change, judged below
+            if was.get(metric) is not None and row.get(metric) is not None and rank(row[metric]) != rank(was[metric]):
+                note(name, metric, was[metric], row[metric],
+                     'regression' if rank(row[metric]) < rank(was[metric]) else 'improvement')
+        # groups CP-SAT failed on and greedy had to plan
+        fallbacks = lambda r: r['methods'].get('greedy-fallback', 0)
+        if fallbacks(row) != fallbacks(was):
+            note(name, 'greedy-fallback groups', fallbacks(was), fallbacks(row),
+                 'regression' if fallbacks(row) > fallbacks(was) else 'improvement')
+        if was['objective'] is not None and row['objective'] is None:
+            note(name, 'objective', was['objective'], None, 'regression')
+        elif was['objective'] is not None:
+            both_optimal = row['status'] == was['status'] == 'OPTIMAL'
+            slack = 0 if both_optimal else OBJECTIVE_TOLERANCE * abs(was['objective'])
+            if row['objective'] > was['objective'] + slack:
+                note(name, 'objective', was['objective'], row['objective'], 'regression')
+            elif row['objective'] < was['objective'] - slack:
+                note(name, 'objective', was['objective'], row['objective'], 'improvement')
+        for metric in SIZED:
+            if was[metric] and row[metric] is not None:
+                if row[metric] > was[metric] * SIZE_RATIO:
+                    note(name, metric, was[metric], row[metric], 'regression')
+                elif row[metric] * SIZE_RATIO < was[metric]:
+                    note(name, metric, was[metric], row[metric], 'improvement')
+        for metric in timed:
+            if was[metric] is None or row[metric] is None:
+                continue
+            if row[metric] > was[metric] * TIME_RATIO + TIME_SLACK:
+                note(name, metric, was[metric], row[metric], 'regression')
+            elif row[metric] * TIME_RATIO + TIME_SLACK < was[metric]:
+                note(name, metric, was[metric], row[metric], 'improvement')
+    for name in base:
+        note(name, 'instance', None, None, 'missing')
+    return findings
+
+
+def format_results(report):
+    columns = ['name', 'waiting', 'running', 'components', 'variables', 'constraints', 'presolve_seconds',
+               'first_feasible_seconds', 'wall_seconds', 'objective', 'status', 'cp_sat_status', 'methods']
+    table = pd.DataFrame(report['results'])[columns]
+    table['methods'] = table['methods'].map(lambda methods: ' '.join(f"{m}:{n}" for m, n in methods.items()))
+    return table.to_string(index=False)
+
+
+def format_findings(findings):
+    if not findings:
+        return "✅ No differences beyond tolerance against the baseline."
+    icons = {'regression': '❌', 'improvement': '✅', 'new': '🆕', 'missing': '⚠️'}
+    return '\n'.join(f"   {icons[f['verdict']]} {f['name']}: {f['metric']} {f['baseline']} -> {f['now']} ({f['verdict']})"
+                     for f in findings)
+
+
+def _read_json(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_json(report, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+
+
+def _check(report, baseline_path):
+    baseline = _read_json(baseline_path)
+    findings = compare(report, baseline)
+    print(f"🔍 Against {baseline_path}:")
+    if report.get('threads') != baseline.get('threads'):
+        print(f"   ⚠️ baseline ran with {baseline.get('threads')} solver threads, these results with {report.get('threads')}; "
+              f"timings not compared")
+    print(format_findings(findings))
+    return sum(1 for f in findings if f['verdict'] == 'regression')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Optimizer.generate_plan on a corpus of frozen instances.")
+    parser.add_argument('--dir', default=CORPUS_DIR, help="Corpus directory (default: ./benchmarks)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('capture', help="Rebuild the corpus from headless runs and synthetic boards")
+    rp = sub.add_parser('run', help="Plan every instance and report model size, timings, objective and status")
+    rp.add_argument('--only', action='append', metavar='NAME', help="Run only this instance (repeatable)")
+    rp.add_argument('--threads', type=int, default=None, help="CP-SAT search threads (default: all cores)")
+    rp.add_argument('--out', default=None, help="Write the results to this JSON file")
+    rp.add_argument('--save-baseline', action='store_true', help="Store the results as the corpus baseline")
+    rp.add_argument('--compare', action='store_true', help="Check the results against the stored baseline")
+    cp = sub.add_parser('compare', help="Check a saved result file against the stored baseline")
+    cp.add_argument('results')
+    cp.add_argument('--baseline', default=None, help="Baseline file (default: <dir>/baseline.json)")
+    args = parser.parse_args(argv)
+    baseline_path = os.path.join(args.dir, BASELINE_NAME)
+
+    if args.command == 'capture':
+        names = capture(args.dir)
+        print(f"📦 Captured {len(names)} instance(s) into {args.dir}: {', '.join(names)}")
+        return names
+
+    if args.command == 'compare':
+        regressions = _check(_read_json(args.results), args.baseline or baseline_path)
+        if regressions:
+            raise SystemExit(f"❌ {regressions} regression(s)")
+        return regressions
+
+    instances = load_corpus(args.dir, args.only)
+    print(f"⏱️ Benchmark: {len(instances)} instance(s) from {args.dir}")
+
+    def progress(row, done, total):
+        print(f"  [{done}/{total}] {row['name']}: {row['status']} objective {row['objective']} "
+              f"in {row['wall_seconds']} s ({row['variables']} vars)")
+
+    report = run_corpus(instances, args.threads, on_result=progress)
+    print(format_results(report))
+    if args.out:
+        _write_json(report, args.out)
+        print(f"💾 Results written to {args.out}")
+    if args.save_baseline:
+        _write_json(report, baseline_path)
+        print(f"💾 Baseline saved to {baseline_path}")
+    if args.compare:
+        regressions = _check(report, baseline_path)
+        if regressions:
+            raise SystemExit(f"❌ {regressions} regression(s)")
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+try:
+    import msgpack
+except ImportError:  # binary codec is optional; everyone gets JSON without it
+    msgpack = None
+
+CODEC_VERSION = 1
+POSITION_SCALE = 65535  # positionOnSegment in [0, 1] is sent as a uint16
+
+# Frequent keys in state payloads -> small ints. Append only: clients decode with the table
+# they receive at negotiation time, so existing codes must never be renumbered.
+KEY_DICTIONARY = [
+    'timestamp', 'network', 'trains', 'nodes', 'trackSegments', 'routes',
+    'id', 'type', 'state', 'position', 'x', 'y',
+    'startNodeId', 'endNodeId', 'length', 'status', 'weather', 'isOccupied',
+    'start_node', 'end_node', 'route', 'node_path', 'currentSegmentId',
+    'positionOnSegment', 'speed_kph', 'waiting_since', 'boarding_timer_ends_at',
+    'scheduled_arrival', 'seq', 'full', 'removedTrains', 'segments',
+    'trainId', 'action', 'startTime',
+]
+KEY_CODES = {key: code for code, key in enumerate(KEY_DICTIONARY)}
+
+
+def binary_available():
+    return msgpack is not None
+
+
+def negotiate(requested):
+    """Pick the codec for a client from the list it offers; JSON unless it asks for msgpack and we have it."""
+    if isinstance(requested, str):
+        requested = [requested]
+    if 'msgpack' in (requested or []) and binary_available():
+        return 'msgpack'
+    return 'json'
+
+
+def describe():
+    """Everything a client needs to decode binary frames, sent back on negotiation."""
+    return {'codec': 'msgpack', 'version': CODEC_VERSION, 'keys': KEY_DICTIONARY, 'positionScale': POSITION_SCALE}
+
+
+def _compact(value, _codes=KEY_CODES, _dict=dict, _list=list, _tuple=tuple):
+    if isinstance(value, _dict):
+        out = {}
+        for key, item in value.items():
+            if isinstance(item, (_dict, _list, _tuple)):
+                item = _compact(item)
+            elif key == 'positionOnSegment' and item is not None:
+                item = int(min(max(item, 0.0), 1.0) * POSITION_SCALE + 0.5)
+            out[_codes.get(key, key)] = item
+        return out
+    if isinstance(value, (_list, _tuple)):
+        if value and not isinstance(value[0], (_dict, _list, _tuple)):
+            return _list(value)  # flat lists (routes, node paths) need no key mapping
+        return [_compact(item) for item in value]
+    return value
+
+
+def _expand(value):
+    if isinstance(value, dict):
+        out = {}
+        for key, item in value.items():
+            name = KEY_DICTIONARY[key] if isinstance(key, int) and 0 <= key < len(KEY_DICTIONARY) else key
+            if name == 'positionOnSegment' and isinstance(item, int):
+                item = item / POSITION_SCALE
+            else:
+                item = _expand(item)
+            out[name] = item
+        return out
+    if isinstance(value, list):
+        return [_expand(item) for item in value]
+    return value
+
+
+def encode(payload):
+    """Pack a state payload as [version, compacted payload]."""
+    return msgpack.packb([CODEC_VERSION, _compact(payload)], use_bin_type=True)
+
+
+def decode(data):
+    version, body = msgpack.unpackb(data, raw=False, strict_map_key=False)
+    if version != CODEC_VERSION:
+        raise ValueError(f"Unsupported codec version {version}")
+    return _expand(body)
@@ -0,0 +1,36 @@
+class StateStream:
+    """
+    Versioned state feed for one simulation. A full snapshot (static geometry included) is sent
+    on connect or resync; after that each tick produces a patch with a monotonically increasing
+    'seq' holding only changed trains, nodes and segments. A client that sees a gap in seq asks
+    for a resync and gets a fresh snapshot carrying the current seq.
+    """
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.seq = 0
+
+    def snapshot(self):
+        # a snapshot does not consume the change journal, so other subscribers' deltas stay intact;
+        # re-applying the next delta on top of it is idempotent
+        state = self.simulation.get_state()
+        return {
+            'seq': self.seq,
+            'full': True,
+            'timestamp': state['timestamp'],
+            'network': state['network'],
+            'trains': state['trains'],
+        }
+
+    def next_delta(self):
+        changes = self.simulation.collect_changes()
+        self.seq += 1
+        return {
+            'seq': self.seq,
+            'full': False,
+            'timestamp': self.simulation.current_time_seconds,
+            'trains': changes['trains'],
+            'removedTrains': changes['removedTrains'],
+            'nodes': changes['nodes'],
+            'segments': changes['segments'],
+        }
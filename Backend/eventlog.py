@@ -0,0 +1,180 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+OFF = 100
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'off': OFF}
+LEVEL_NAMES = {v: k for k, v in LEVELS.items()}
+
+# Console text for each typed event; the writer thread formats these, never the hot path.
+TEMPLATES = {
+    'spawn': "📅 Train {train} ({type}) needs plan. Scheduled arrival: {scheduled}",
+    'plan': "  -> ✅ Plan for {train} received. Is READY_TO_PROCEED.",
+    'replan': "  -> 🔄 Plan for {train} revised before departure.",
+    'dispatch': "  -> 🟢 DISPATCHED Train {train} ({type}) onto {segment}.",
+    'clear': "  -> 🟢 CLEARED Train {train} ({type}) to proceed onto {segment}.",
+    'reroute': "  -> 🔁 REROUTED & DISPATCHED Train {train} onto alternate route starting with {segment}.",
+    'block': "  -> ⛔ {train} blocked at {node} on {segment}: {reason}.",
+    'boarding': "  -> boarding Train {train} at {node}. Waiting for {seconds}s.",
+    'boarded': "  -> ✅ Boarding complete for {train}. Now awaiting clearance.",
+    'arrive': "  -> ➡️ Train {train} cleared {cleared} & {segment}, arrived at {node}.",
+    'exit': "✅ Train {train} has EXITED. Final node {node} released.",
+    'malformed': "  -> ⚠️ Train {train} has a malformed route: {reason}.",
+    'signal': "🔔 Signal {node} set to {state} in simulation.",
+    'signal_skipped': "🔒 {by} wanted to set {node} => {state}, skipped: {skipped}.",
+    'snapshot': "[tick {sim_time}] snapshot -> locked:{locked} | counts:{counts} | running:{running}",
+    'consider': "  -> Consider {train} -> next_seg:{segment} next_node:{node} dep_node:{dep_node} dep_state:{dep_state} seg_status:{seg_status} seg_locked:{seg_locked} node_locked:{node_locked}",
+    'loop': "[debug] {message}",
+}
+
+
+class EventLog:
+    """
+    Structured simulation event log. emit() is the only hot-path call: it drops the event
+    immediately when below the current level, otherwise appends a tuple to two deques
+    (an in-memory ring of recent events and the writer's pending queue). deque appends and
+    poplefts are atomic, so producers never take a lock. A daemon thread drains the pending
+    queue into an append-only JSON-lines journal and echoes events to the console. The pending
+    queue is bounded by `max_pending`: when the writer falls that far behind, new events only go
+    to the ring and are counted in `dropped`.
+    """
+
+    def __init__(self, level=INFO, journal_path=None, echo=True, ring_size=10000, flush_interval=0.25,
+                 max_pending=100000):
+        self.level = level
+        self.echo = echo
+        self.journal_path = journal_path
+        self.flush_interval = flush_interval
+        self.ring = deque(maxlen=ring_size)
+        self._pending = deque()
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._wake = threading.Event()
+        self._drained = threading.Event()  # set by the writer once the queue it saw empty is on disk
+        self._stopped = False
+        self._thread = None
+
+    # --- producer side (hot path) ---
+    def emit(self, level, kind, section, sim_time, **fields):
+        if level < self.level:
+            return
+        record = (time.time(), level, kind, section, sim_time, fields)
+        self.ring.append(record)
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+        else:
+            self._pending.append(record)
+        if self._thread is None:
+            self._start_writer()
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def set_level(self, level):
+        if isinstance(level, str):
+            level = LEVELS[level.lower()]
+        self.level = level
+        return LEVEL_NAMES.get(level, level)
+
+    def recent(self, n=100, kind=None):
+        events = list(self.ring)
+        if kind:
+            events = [e for e in events if e[2] == kind]
+        return [self._as_dict(e) for e in events[-n:]]
+
+    # --- writer side ---
+    def _start_writer(self):
+        self._thread = threading.Thread(target=self._run, name='event-log-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        journal = None
+        if self.journal_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+            journal = open(self.journal_path, 'a', encoding='utf-8')
+        try:
+            while not self._stopped:
+                self._wake.wait(self.flush_interval)
+                self._wake.clear()
+                self._drain(journal)
+                if not self._pending:
+                    self._drained.set()
+            self._drain(journal)
+            self._drained.set()
+        finally:
+            if journal:
+                journal.close()
+
+    def _drain(self, journal):
+        pending = self._pending
+        lines, echoes = [], []
+        while pending:
+            record = pending.popleft()
+            if journal:
+                lines.append(json.dumps(self._as_dict(record), separators=(',', ':'), default=str))
+            if self.echo:
+                echoes.append(self._format(record))
+        dropped = self.dropped - self._reported_dropped
+        if dropped:
+            self._reported_dropped += dropped
+            if journal:
+                lines.append(json.dumps({'ts': round(time.time(), 3), 'lvl': 'warning', 'kind': 'dropped', 'count': dropped}))
+            echoes.append(f"⚠️ Event log writer fell behind: {dropped} event(s) dropped.")
+        if lines:
+            journal.write('\n'.join(lines) + '\n')
+            journal.flush()
+        if echoes:
+            sys.stdout.write('\n'.join(echoes) + '\n')
+            sys.stdout.flush()
+
+    def flush(self, timeout=2.0):
+        """Block until everything emitted so far has been written (tests, shutdown, headless runs)."""
+        if self._thread is None:
+            return True
+        # records popped by a drain in progress are only on disk once that drain finishes; the writer
+        # sets _drained after it, never in between
+        self._drained.clear()
+        self._wake.set()
+        return self._drained.wait(timeout)
+
+    def close(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+
+    @staticmethod
+    def _as_dict(record):
+        ts, level, kind, section, sim_time, fields = record
+        return {'ts': round(ts, 3), 'lvl': LEVEL_NAMES.get(level, level), 'kind': kind,
+                'section': section, 'sim_time': sim_time, **fields}
+
+    @staticmethod
+    def _format(record):
+        _, _, kind, section, sim_time, fields = record
+        template = TEMPLATES.get(kind)
+        if template is None:
+            return f"[{section}] {kind} {fields}"
+        try:
+            return template.format(sim_time=sim_time, section=section, **fields)
+        except (KeyError, IndexError):
+            return f"[{section}] {kind} {fields}"
+
+
+_default_log = None
+
+
+def get_default_log():
+    """Process-wide log configured from FLOWSTATE_LOG_LEVEL / FLOWSTATE_EVENT_JOURNAL."""
+    global _default_log
+    if _default_log is None:
+        level = LEVELS.get(os.environ.get('FLOWSTATE_LOG_LEVEL', 'info').lower(), INFO)
+        _default_log = EventLog(level=level, journal_path=os.environ.get('FLOWSTATE_EVENT_JOURNAL') or None)
+    return _default_log
@@ -0,0 +1,141 @@
+import math
+import numpy as np
+
+
+def segment_cost(segment, nodes_map):
+    """Segment 'length' when the layout has it, else the straight-line distance between its ends."""
+    length = segment.get('length')
+    if length:
+        return float(length)
+    a = nodes_map.get(segment['startNodeId'], {}).get('position')
+    b = nodes_map.get(segment['endNodeId'], {}).get('position')
+    if a and b:
+        return max(1.0, math.hypot(a['x'] - b['x'], a['y'] - b['y']))
+    return 1.0
+
+
+class CompiledGraph:
+    """
+    Integer-indexed view of a layout. Node and segment string ids are interned to ints and
+    adjacency is stored in CSR form (offsets / neighbours / segments arrays), with an O(1)
+    (u, v) -> segment lookup and memoised segment-route -> node-path conversion.
+    Python list mirrors of the CSR rows are kept for the pathfinding inner loops.
+    """
+
+    def __init__(self, nodes, segments):
+        self.node_ids = [n['id'] for n in nodes]
+        self.node_index = {nid: i for i, nid in enumerate(self.node_ids)}
+        self.segment_ids = [s['id'] for s in segments]
+        self.segment_index = {sid: i for i, sid in enumerate(self.segment_ids)}
+        nodes_map = {n['id']: n for n in nodes}
+
+        n_nodes = len(self.node_ids)
+        self.seg_start = np.array([self.node_index[s['startNodeId']] for s in segments], dtype=np.int32)
+        self.seg_end = np.array([self.node_index[s['endNodeId']] for s in segments], dtype=np.int32)
+
+        # adjacency rows in layout order (both directions), same order the old dict adjacency used
+        rows = [[] for _ in range(n_nodes)]
+        for seg_idx in range(len(segments)):
+            u, v = int(self.seg_start[seg_idx]), int(self.seg_end[seg_idx])
+            rows[u].append((v, seg_idx))
+            rows[v].append((u, seg_idx))
+        self.adjacency = rows
+
+        degree = np.array([len(r) for r in rows], dtype=np.int32)
+        self.offsets = np.zeros(n_nodes + 1, dtype=np.int32)
+        np.cumsum(degree, out=self.offsets[1:])
+        self.neighbors = np.array([v for r in rows for v, _ in r], dtype=np.int32)
+        self.edge_segments = np.array([e for r in rows for _, e in r], dtype=np.int32)
+
+        # first segment listed between u and v wins, matching the old neighbour scan
+        self._edge = {}
+        for u, row in enumerate(rows):
+            for v, seg_idx in row:
+                self._edge.setdefault((u, v), seg_idx)
+
+        self.cost = [segment_cost(s, nodes_map) for s in segments]
+
+        pos = [nodes_map[nid].get('position') for nid in self.node_ids]
+        self.has_positions = all(p is not None for p in pos)
+        self.x = np.array([p['x'] if p else 0.0 for p in pos], dtype=np.float64)
+        self.y = np.array([p['y'] if p else 0.0 for p in pos], dtype=np.float64)
+        self.heuristic_scale = self._heuristic_scale() if self.has_positions else 0.0
+        self._heuristics = {}
+
+        self._node_path_memo = {}
+
+    def _heuristic_scale(self):
+        """
+        Largest factor k such that k * euclidean distance never exceeds a segment's cost, which
+        makes k * euclidean(u, goal) an admissible and consistent A* heuristic. 0 disables it.
+        """
+        if not self.segment_ids:
+            return 0.0
+        dist = np.hypot(self.x[self.seg_start] - self.x[self.seg_end], self.y[self.seg_start] - self.y[self.seg_end])
+        cost = np.array(self.cost)
+        positive = dist > 0
+        if not positive.any():
+            return 0.0
+        return float(np.min(cost[positive] / dist[positive]))
+
+    def heuristic_to(self, goal):
+        h = self._heuristics.get(goal)
+        if h is None:
+            if self.heuristic_scale:
+                h = (self.heuristic_scale * np.hypot(self.x - self.x[goal], self.y - self.y[goal])).tolist()
+            else:
+                h = [0.0] * len(self.node_ids)
+            self._heuristics[goal] = h
+        return h
+
+    def allowed_mask(self, blocked_segment_ids):
+        mask = bytearray(b'\x01') * len(self.segment_ids)
+        for sid in blocked_segment_ids:
+            idx = self.segment_index.get(sid)
+            if idx is not None:
+                mask[idx] = 0
+        return mask
+
+    def neighbors_of(self, node_id):
+        """[(neighbor_node_id, segment_id), ...] for a node id."""
+        u = self.node_index.get(node_id)
+        if u is None:
+            return []
+        return [(self.node_ids[v], self.segment_ids[e]) for v, e in self.adjacency[u]]
+
+    def segment_between(self, u_id, v_id):
+        seg_idx = self._edge.get((self.node_index.get(u_id), self.node_index.get(v_id)))
+        return self.segment_ids[seg_idx] if seg_idx is not None else None
+
+    def segment_path(self, node_path):
+        path = []
+        for i in range(len(node_path) - 1):
+            seg_id = self.segment_between(node_path[i], node_path[i + 1])
+            if seg_id is not None:
+                path.append(seg_id)
+        return path
+
+    def node_path(self, segment_path):
+        """
+        Node path for a segment route, memoised per route tuple. The route is assumed to leave
+        from its first segment's startNodeId. The returned list is shared: treat it as read-only.
+        """
+        if not segment_path:
+            return []
+        key = tuple(segment_path)
+        cached = self._node_path_memo.get(key)
+        if cached is not None:
+            return cached
+
+        seg_index = self.segment_index
+        first = seg_index[key[0]]
+        last = int(self.seg_start[first])
+        path = [last]
+        for seg_id in key:
+            idx = seg_index[seg_id]
+            start, end = int(self.seg_start[idx]), int(self.seg_end[idx])
+            last = end if start == last else start
+            path.append(last)
+        cached = [self.node_ids[i] for i in path]
+        self._node_path_memo[key] = cached
+        return cached
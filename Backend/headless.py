@@ -0,0 +1,260 @@
+"""
+Headless batch runner: plays a section's whole schedule as fast as the CPU allows (event engine,
+no sockets, no sleeps), planning with Optimizer.generate_plan and driving AI signals the same way
+main.simulation_loop does, then prints / writes a KPI summary.
+
+    python headless.py DLI
+    python headless.py GZB --until 43200 --schedule data/intelligent_schedule.csv --json kpi.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import time
+
+import numpy as np
+
+import checkpoint
+from eventlog import EventLog, LEVELS
+from journal import RunRecorder, apply_input, new_seed
+from optimizer import Optimizer
+from planning import apply_solved_plan
+from signal_control import SignalController
+from simulation import Simulation
+
+DEFAULT_PRIORITIES = {
+    'congestion': True,
+    'trainType': True,
+    'punctuality': True,
+    'trackCondition': True,
+    'weather': False
+}
+
+
+def _distribution(values):
+    if not values:
+        return {'count': 0, 'mean': None, 'p50': None, 'p95': None, 'max': None}
+    arr = np.asarray(values, dtype=np.float64)
+    return {
+        'count': int(arr.size),
+        'mean': round(float(arr.mean()), 2),
+        'p50': round(float(np.percentile(arr, 50)), 2),
+        'p95': round(float(np.percentile(arr, 95)), 2),
+        'max': round(float(arr.max()), 2),
+    }
+
+
+def run_headless(section_code='DLI', until=None, layout_path=None, schedule_path=None, priorities=None,
+                 faulty_tracks=(), bad_weather=None, ai_signals=True, log_level='warning', journal_path=None,
+                 num_workers=None, seed=None, record_path=None, resume_from=None, checkpoint_at=None,
+                 checkpoint_path=None, on_plan=None):
+    """
+    Run one section to completion (or to `until` sim seconds) and return the KPI summary dict.
+    Loop order per event matches the live loop: advance, snapshot state, AI signal pass, plan if needed.
+    bad_weather pins the BAD-weather segments (else weather priority picks random ones, as live);
+    num_workers caps CP-SAT search threads. record_path writes a run journal (see journal.py) that
+    `python journal.py replay` reproduces exactly; recording without a seed picks and records one.
+    resume_from warm-starts from a checkpoint file; checkpoint_at / checkpoint_path save one once the
+    run reaches that simulation time (e.g. to capture a peak-hour state for later experiments).
+    on_plan(sim, trains, state), when given, sees every planning call before the optimizer does
+    (benchmark.py freezes instances with it).
+    """
+    if record_path and seed is None:
+        seed = new_seed()
+    log = EventLog(level=LEVELS[log_level], journal_path=journal_path)
+    if resume_from:
+        sim = checkpoint.restore(resume_from, engine_mode='event', event_log=log,
+                                 layout_path=layout_path, schedule_path=schedule_path)
+    else:
+        sim = Simulation(section_code, engine_mode='event', event_log=log,
+                         layout_path=layout_path, schedule_path=schedule_path, seed=seed)
+    recorder = RunRecorder(record_path, sim, checkpoint_path=resume_from) if record_path else None
+    priorities = dict(priorities or DEFAULT_PRIORITIES)
+    priorities['congestion'] = True
+    priorities['trackCondition'] = True
+
+    # the manual-override grace window runs on simulation time here
+    signals = SignalController(clock=lambda: sim.current_time_seconds)
+
+    # scenario set-up goes through the same input path a replay uses
+    setup = [('ai_control', {'enabled': ai_signals}),
+             ('priorities', {'priorities': priorities, 'apply_weather': bad_weather is None and priorities.get('weather')})]
+    if bad_weather is not None:
+        setup.append(('weather', {'segments': list(bad_weather)}))
+    setup += [('track_status', {'track': track_id, 'status': 'FAULTY'}) for track_id in faulty_tracks]
+    for action, fields in setup:
+        apply_input(sim, signals, action, fields)
+        if recorder:
+            recorder.input(action, **fields)
+
+    optimizer = Optimizer(simulation_instance=sim, num_workers=num_workers)
+
+    solver_times = []
+    solver_stats = []
+    signal_changes = 0
+    events = 0
+    wall_start = time.perf_counter()
+
+    while sim.advance_to_next_event(until=until) is not None:
+        events += 1
+        if recorder:
+            recorder.step = events
+        if checkpoint_at is not None and sim.current_time_seconds >= checkpoint_at:
+            checkpoint.write(checkpoint.capture(sim), checkpoint_path or checkpoint.latest_path('checkpoints', sim.section_code))
+            checkpoint_at = None
+        current_state = sim.get_state()
+
+        if signals.ai_control_enabled:
+            greens, reds = signals.clear_waiting_trains(sim)
+            if greens + reds:
+                signal_changes += greens + reds
+                sim.plan_needed = True
+
+        trains_needing_plan = sim.trains.in_state('WAITING_PLAN')
+        if trains_needing_plan and sim.plan_needed:
+            sim.plan_needed = False
+            version = sim.state_version
+            if recorder:
+                recorder.request(version)
+            if on_plan is not None:
+                on_plan(sim, trains_needing_plan, current_state)
+            t0 = time.perf_counter()
+            plan = optimizer.generate_plan(trains_needing_plan, current_state, priorities)
+            solver_times.append(time.perf_counter() - t0)
+            if optimizer.last_stats is not None:
+                solver_stats.append(optimizer.last_stats)
+            if recorder:
+                recorder.plan(plan, requested=events, version=version)
+            apply_solved_plan(sim, signals, plan, version)
+
+    wall = time.perf_counter() - wall_start
+    if recorder:
+        recorder.close()
+    log.close()
+    return summarise(sim, wall, events, solver_times, signal_changes, solver_stats, optimizer.plan_cache.stats())
+
+
+def summarise(sim, wall_seconds, events, solver_times, signal_changes=0, solver_stats=(), plan_cache=None):
+    exits = sim.exit_log
+    sim_seconds = sim.current_time_seconds
+    delays = [e['exited_at'] - e['scheduled_arrival'] - e['ideal_seconds'] for e in exits if e['scheduled_arrival'] is not None]
+    departure_delays = [e['departed_at'] - e['scheduled_arrival'] for e in exits
+                        if e['departed_at'] is not None and e['scheduled_arrival'] is not None]
+    journeys = [e['exited_at'] - e['departed_at'] for e in exits if e['departed_at'] is not None]
+    by_type = {}
+    for e, d in zip(exits, delays):
+        by_type.setdefault(e['type'], []).append(d)
+
+    return {
+        'section': sim.section_code,
+        'schedule': sim.schedule_path,
+        'sim_seconds': sim_seconds,
+        'wall_seconds': round(wall_seconds, 3),
+        'events': events,
+        'events_per_second': round(events / wall_seconds, 1) if wall_seconds else None,
+        # the event engine skips idle seconds; this is the 1 s tick rate it is equivalent to
+        'ticks_per_second': round(sim_seconds / wall_seconds, 1) if wall_seconds else None,
+        'trains': {
+            'scheduled': len(sim.master_schedule),
+            'spawned': len(sim.processed_train_ids),
+            'exited': len(exits),
+            'still_active': len(sim.trains),
+            'still_active_by_state': sim.trains.counts(),
+        },
+        'throughput_per_hour': round(len(exits) * 3600 / sim_seconds, 2) if sim_seconds else 0.0,
+        'delay_seconds': _distribution(delays),
+        'delay_seconds_by_type': {t: _distribution(v) for t, v in sorted(by_type.items())},
+        'departure_delay_seconds': _distribution(departure_delays),
+        'journey_seconds': _distribution(journeys),
+        'solver': {
+            'calls': len(solver_times),
+            'total_seconds': round(sum(solver_times), 3),
+            'mean_seconds': round(sum(solver_times) / len(solver_times), 4) if solver_times else None,
+            'max_seconds': round(max(solver_times), 4) if solver_times else None,
+            'first_feasible_seconds': _distribution([s['first_feasible_seconds'] for s in solver_stats if s['first_feasible_seconds'] is not None]),
+            'optimal_seconds': _distribution([s['optimal_seconds'] for s in solver_stats if s['optimal_seconds'] is not None]),
+            'statuses': {status: sum(1 for s in solver_stats if s['status'] == status) for status in sorted({s['status'] for s in solver_stats})},
+            'planned_by': {m: sum(s['methods'].get(m, 0) for s in solver_stats)
+                           for m in sorted({m for s in solver_stats for m in s['methods']})},
+            'hinted_trains': sum(s['hinted'] for s in solver_stats),
+            'planned_trains': sum(s['trains'] for s in solver_stats),
+        },
+        'ai_signal_changes': signal_changes,
+        'route_cache': sim.route_cache.stats(),
+        'plan_cache': plan_cache,
+    }
+
+
+def format_summary(summary):
+    trains = summary['trains']
+    delay = summary['delay_seconds']
+    solver = summary['solver']
+    lines = [
+        f"📊 [{summary['section']}] {summary['sim_seconds']} sim s in {summary['wall_seconds']} s wall "
+        f"({summary['events']} events, {summary['events_per_second']} events/s, ~{summary['ticks_per_second']} ticks/s)",
+        f"   trains: {trains['exited']}/{trains['scheduled']} exited, {trains['spawned']} spawned, "
+        f"{trains['still_active']} still active {trains['still_active_by_state']}",
+        f"   throughput: {summary['throughput_per_hour']} trains/h",
+        f"   delay vs unimpeded run (s): mean {delay['mean']} p50 {delay['p50']} p95 {delay['p95']} max {delay['max']}",
+        f"   solver: {solver['calls']} calls, {solver['total_seconds']} s total, "
+        f"mean {solver['mean_seconds']} s, max {solver['max_seconds']} s",
+        f"   solver search: first feasible p50 {solver['first_feasible_seconds']['p50']} s, "
+        f"optimal p50 {solver['optimal_seconds']['p50']} s, {solver['statuses']}, groups by {solver['planned_by']}, "
+        f"{solver['hinted_trains']}/{solver['planned_trains']} trains seeded from the greedy plan",
+    ]
+    cache = summary.get('plan_cache')
+    if cache:
+        lines.append(f"   plan cache: {cache['hits']} hits / {cache['hits'] + cache['misses']} lookups "
+                     f"(hit rate {cache['hit_rate']}), {cache['entries']} entries, {cache['rejected']} rejected on re-validation")
+    return '\n'.join(lines)
+
+
+def _parse_priorities(items):
+    priorities = dict(DEFAULT_PRIORITIES)
+    for item in items or []:
+        key, _, value = item.partition('=')
+        priorities[key] = value.lower() in ('1', 'true', 'yes', 'on')
+    return priorities
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a section's schedule headless and report KPIs.")
+    parser.add_argument('section', help="Section code: DLI, GZB (Ghaziabad), ANVR (Anand Vihar), SBB (Shahibabad)")
+    parser.add_argument('--until', type=int, default=None, help="Stop at this simulation time (seconds); default runs until idle")
+    parser.add_argument('--layout', default=None, help="Layout JSON path (default: ./data/<section>_layout.json)")
+    parser.add_argument('--schedule', default=None, help="Schedule CSV path (default: ./data/<section>_schedule.csv)")
+    parser.add_argument('--priority', action='append', metavar='NAME=BOOL', help="Override an AI priority, e.g. weather=1")
+    parser.add_argument('--faulty', action='append', default=[], metavar='TRACK_ID', help="Mark a track FAULTY before the run")
+    parser.add_argument('--no-ai-signals', action='store_true', help="Disable automatic AI signal control")
+    parser.add_argument('--log-level', default='warning', choices=sorted(LEVELS), help="Event log level (default: warning)")
+    parser.add_argument('--journal', default=None, help="Append the structured event log to this JSON-lines file")
+    parser.add_argument('--json', default=None, help="Write the KPI summary to this JSON file")
+    parser.add_argument('--seed', type=int, default=None, help="Seed for the simulation's random choices (weather)")
+    parser.add_argument('--record', default=None, metavar='JOURNAL', help="Record a replayable run journal to this file")
+    parser.add_argument('--resume-from', default=None, metavar='CHECKPOINT', help="Warm-start from a checkpoint file")
+    parser.add_argument('--checkpoint-at', type=int, default=None, metavar='SECONDS', help="Save a checkpoint when the run reaches this sim time")
+    parser.add_argument('--checkpoint-out', default=None, metavar='PATH', help="Checkpoint file for --checkpoint-at (default: checkpoints/<section>_latest.ckpt)")
+    parser.add_argument('--quiet', action='store_true', help="Suppress engine/optimizer console output")
+    args = parser.parse_args(argv)
+
+    run = lambda: run_headless(args.section, until=args.until, layout_path=args.layout, schedule_path=args.schedule,
+                               priorities=_parse_priorities(args.priority), faulty_tracks=args.faulty,
+                               ai_signals=not args.no_ai_signals, log_level=args.log_level, journal_path=args.journal,
+                               seed=args.seed, record_path=args.record, resume_from=args.resume_from,
+                               checkpoint_at=args.checkpoint_at, checkpoint_path=args.checkpoint_out)
+    if args.quiet:
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = run()
+    else:
+        summary = run()
+
+    print(format_summary(summary))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"💾 KPI summary written to {args.json}")
+    return summary
+
+
+if __name__ == '__main__':
+    main()
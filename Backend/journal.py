@@ -0,0 +1,267 @@
+"""
+Deterministic record-and-replay for simulation runs.
+
+A recording is a JSON-lines file: a header (section, files, seed, engine mode), then every external
+input (controller commands, start-up overrides) and the planning timeline, each stamped with the
+loop iteration ('step') and simulation time it happened at, and finally an 'end' record carrying a
+digest of the final state. The simulation's only randomness is its seeded rng; the optimizer and
+the moment its result arrives are the only other non-deterministic parts, so replaying the inputs
+and substituting the recorded plans reproduces the run exactly, with no sleeps and no solver calls.
+
+The planning timeline: 'request' (a solve was started; the state version it saw), 'plan' (a result
+was applied: the raw plan, the version and the step it was requested at, which is the same step
+for synchronous planners; final=false for a provisional anytime plan, whose solve carries on) and
+'cancel' (an off-loop request superseded before a solver took it). Each iteration runs: advance,
+AI signal pass, cancel, apply a finished or provisional plan, request, apply a same-step plan;
+inputs are applied after the iteration, where the live loop yields to socket handlers.
+
+    python journal.py replay recordings/dli_20250101-120000.jsonl
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import time
+from collections import defaultdict
+
+import checkpoint
+from eventlog import EventLog, OFF
+from planning import apply_solved_plan
+from signal_control import SignalController
+from simulation import Simulation
+
+JOURNAL_VERSION = 2
+
+
+class ReplayDivergence(Exception):
+    """The replayed run asked for a plan, or ended, somewhere the recording did not."""
+
+
+def new_seed():
+    return random.SystemRandom().randrange(2 ** 32)
+
+
+def state_digest(sim):
+    state = sim.get_state()
+    blob = json.dumps(state, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+def apply_input(sim, signals, action, fields):
+    """Apply one external input the way the corresponding controller handler does."""
+    if action == 'signal':
+        signals.apply(sim, fields['signal'], fields['state'], by='manual')
+    elif action == 'all_signals_red':
+        for node in sim.network.get('nodes', []):
+            if node.get('type') == 'SIGNAL':
+                signals.apply(sim, node['id'], 'RED', by='manual')
+    elif action == 'track_status':
+        sim.set_track_status(fields['track'], fields['status'])
+    elif action == 'priorities':
+        sim.set_ai_priorities(fields['priorities'])
+        if fields.get('apply_weather'):
+            if fields['priorities'].get('weather'):
+                sim.assign_random_weather(choose_count=3)
+            else:
+                sim.clear_weather()
+    elif action == 'weather':
+        sim.set_bad_weather(fields['segments'])
+    elif action == 'ai_control':
+        signals.ai_control_enabled = fields['enabled']
+    elif action == 'sim_speed':
+        sim.sim_speed = fields['speed']
+    elif action == 'request_plan':
+        sim.plan_needed = True
+    else:
+        raise ValueError(f"Unknown journal input action {action!r}")
+
+
+class RunRecorder:
+    """
+    Writes the journal for one simulation run. The driving loop bumps `step` once per iteration;
+    input() / request() / plan() / cancel() stamp records with it.
+    """
+
+    def __init__(self, path, sim, checkpoint_path=None):
+        self.path = path
+        self.sim = sim
+        self.step = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'w', encoding='utf-8')
+        self._write({
+            'kind': 'header', 'version': JOURNAL_VERSION, 'created': time.time(),
+            'section': sim.section_code, 'layout': sim.layout_path, 'schedule': sim.schedule_path,
+            'seed': sim.seed, 'engine_mode': sim.engine_mode,
+            # a run resumed from a checkpoint replays from that checkpoint
+            'checkpoint': checkpoint_path,
+        })
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, separators=(',', ':'), default=str) + '\n')
+
+    def _stamp(self, kind):
+        return {'kind': kind, 'step': self.step, 't': self.sim.current_time_seconds}
+
+    def input(self, action, **fields):
+        self._write({**self._stamp('input'), 'action': action, **fields})
+
+    def request(self, version):
+        self._write({**self._stamp('request'), 'version': version})
+
+    def plan(self, plan, requested, version, final=True):
+        self._write({**self._stamp('plan'), 'requested': requested, 'version': version, 'final': final, 'plan': plan})
+
+    def cancel(self, requested):
+        self._write({**self._stamp('cancel'), 'requested': requested})
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._write({**self._stamp('end'), 'digest': state_digest(self.sim)})
+        self._file.close()
+        print(f"💾 Run journal written to {self.path}")
+
+
+def load_journal(path):
+    with open(path, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if not records or records[0].get('kind') != 'header':
+        raise ValueError(f"{path} is not a run journal (missing header)")
+    header = records[0]
+    if header.get('version') != JOURNAL_VERSION:
+        raise ValueError(f"Unsupported journal version {header.get('version')}")
+    inputs = defaultdict(list)   # step -> [record]
+    requests = {}                # step -> request record
+    plans = {}                   # step -> plan record
+    cancels = {}                 # step -> cancel record
+    end = None
+    for record in records[1:]:
+        kind = record['kind']
+        if kind == 'input':
+            inputs[record['step']].append(record)
+        elif kind == 'request':
+            requests[record['step']] = record
+        elif kind == 'plan':
+            plans[record['step']] = record
+        elif kind == 'cancel':
+            cancels[record['step']] = record
+        elif kind == 'end':
+            end = record
+    return header, inputs, requests, plans, cancels, end
+
+
+def replay(path, layout_path=None, schedule_path=None):
+    """
+    Re-run a recorded journal at maximum speed. Returns a report with the replayed digest and
+    whether it matches the recorded one; raises ReplayDivergence if planning points disagree.
+    """
+    header, inputs, requests, plans, cancels, end = load_journal(path)
+    if end is None:
+        raise ValueError(f"{path} has no 'end' record; the recorded run did not shut down cleanly")
+    snapshot = checkpoint.read(header['checkpoint']) if header.get('checkpoint') else None
+    if snapshot is not None:
+        sim = checkpoint.restore(snapshot, engine_mode=header['engine_mode'], event_log=EventLog(level=OFF),
+                                 layout_path=layout_path, schedule_path=schedule_path)
+    else:
+        sim = Simulation(header['section'], engine_mode=header['engine_mode'], event_log=EventLog(level=OFF),
+                         layout_path=layout_path or header['layout'], schedule_path=schedule_path or header['schedule'],
+                         seed=header['seed'])
+    signals = SignalController(clock=lambda: sim.current_time_seconds)
+    if snapshot is not None:
+        signals.manual_override_timestamps = dict(snapshot['extra'].get('manual_override_timestamps', {}))
+    in_flight = None  # step of the outstanding request
+    applied = 0
+
+    def apply_inputs(step):
+        for record in inputs.get(step, ()):
+            fields = {k: v for k, v in record.items() if k not in ('kind', 'step', 't', 'action')}
+            apply_input(sim, signals, record['action'], fields)
+
+    def apply_plan_at(step, same_step):
+        nonlocal in_flight, applied
+        record = plans.get(step)
+        if record is None or (record['requested'] == step) != same_step:
+            return
+        if in_flight != record['requested']:
+            raise ReplayDivergence(f"recording applied the plan requested at step {record['requested']} at step {step}; "
+                                   f"replay's outstanding request is from step {in_flight}")
+        apply_solved_plan(sim, signals, record['plan'], record['version'])
+        if record.get('final', True):
+            in_flight = None
+        applied += 1
+
+    started = time.perf_counter()
+    step = 0
+    apply_inputs(0)
+    while step < end['step']:
+        if sim.engine_mode == 'event':
+            if sim.advance_to_next_event() is None:
+                break
+        else:
+            sim.tick()
+        step += 1
+        sim.get_state()
+
+        if signals.ai_control_enabled:
+            greens, reds = signals.clear_waiting_trains(sim)
+            if greens + reds:
+                sim.plan_needed = True
+
+        if step in cancels:
+            if in_flight != cancels[step]['requested']:
+                raise ReplayDivergence(f"recording cancelled the request from step {cancels[step]['requested']} at step {step}; "
+                                       f"replay's outstanding request is from step {in_flight}")
+            in_flight = None
+            sim.plan_needed = True
+        apply_plan_at(step, same_step=False)
+
+        if in_flight is None and sim.trains.in_state('WAITING_PLAN') and sim.plan_needed:
+            if step not in requests:
+                raise ReplayDivergence(f"replay requested a plan at step {step} (t={sim.current_time_seconds}); the recording did not")
+            if requests[step]['version'] != sim.state_version:
+                raise ReplayDivergence(f"plan request at step {step} saw state v{requests[step]['version']} when recorded, "
+                                       f"v{sim.state_version} in replay")
+            sim.plan_needed = False
+            in_flight = step
+        elif step in requests:
+            raise ReplayDivergence(f"recording requested a plan at step {step} but replay did not")
+        apply_plan_at(step, same_step=True)
+
+        apply_inputs(step)
+
+    if step != end['step'] or applied != len(plans):
+        raise ReplayDivergence(f"replay stopped at step {step} having applied {applied}/{len(plans)} plan(s); "
+                               f"recording ended at step {end['step']}")
+    digest = state_digest(sim)
+    return {
+        'section': sim.section_code,
+        'steps': step,
+        'sim_seconds': sim.current_time_seconds,
+        'wall_seconds': round(time.perf_counter() - started, 3),
+        'digest': digest,
+        'expected_digest': end['digest'],
+        'match': digest == end['digest'],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded simulation run journal.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    rp = sub.add_parser('replay', help="Replay a journal at maximum speed and verify the final state digest")
+    rp.add_argument('journal')
+    rp.add_argument('--layout', default=None, help="Override the recorded layout path")
+    rp.add_argument('--schedule', default=None, help="Override the recorded schedule path")
+    args = parser.parse_args(argv)
+
+    report = replay(args.journal, layout_path=args.layout, schedule_path=args.schedule)
+    verdict = "✅ identical" if report['match'] else "❌ DIVERGED"
+    print(f"🔁 Replayed {report['steps']} steps ({report['sim_seconds']} sim s) in {report['wall_seconds']} s: {verdict}")
+    print(f"   digest {report['digest']}")
+    if not report['match']:
+        print(f"   recorded {report['expected_digest']}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import numpy as np
+
+# integer codes mirrored from the train dict 'state' strings
+STATE_CODES = {
+    'EMPTY': 0,
+    'WAITING_PLAN': 1,
+    'READY_TO_PROCEED': 2,
+    'RUNNING': 3,
+    'STOPPED_AWAITING_CLEARANCE': 4,
+    'BOARDING_PASSENGERS': 5,
+    'EXITED': 6,
+}
+EMPTY = STATE_CODES['EMPTY']
+RUNNING = STATE_CODES['RUNNING']
+
+SEGMENT_TRAVEL_TIME = 30  # seconds to traverse any segment (optimizer assumes the same)
+ARRIVAL_EPSILON = 1e-9
+
+
+class TrainKinematics:
+    """
+    Struct-of-arrays store for train motion. Each active train owns a slot; position,
+    speed, segment index and state code live in contiguous numpy arrays so all RUNNING
+    trains are stepped in one batched update. The train dicts stay the source of truth
+    for everything else and only get positionOnSegment written back on materialise().
+    """
+
+    def __init__(self, segment_ids, capacity=64):
+        self.segment_ids = list(segment_ids)
+        self.segment_index = {sid: i for i, sid in enumerate(self.segment_ids)}
+
+        self.position = np.zeros(capacity, dtype=np.float64)
+        self.speed = np.zeros(capacity, dtype=np.float64)
+        self.rate = np.full(capacity, 1.0 / SEGMENT_TRAVEL_TIME, dtype=np.float64)
+        self.segment = np.full(capacity, -1, dtype=np.int32)
+        self.state = np.zeros(capacity, dtype=np.int8)
+
+        self.slot_of = {}                   # train_id -> slot
+        self.train_at = [None] * capacity   # slot -> train dict
+        self._free = list(range(capacity - 1, -1, -1))
+        self._stale = False                 # positions stepped since last materialise()
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def _grow(self):
+        old = len(self.train_at)
+        new = old * 2
+        for name in ('position', 'speed', 'rate', 'segment', 'state'):
+            arr = getattr(self, name)
+            grown = np.empty(new, dtype=arr.dtype)
+            grown[:old] = arr
+            setattr(self, name, grown)
+        self.position[old:] = 0.0
+        self.speed[old:] = 0.0
+        self.rate[old:] = 1.0 / SEGMENT_TRAVEL_TIME
+        self.segment[old:] = -1
+        self.state[old:] = EMPTY
+        self.train_at.extend([None] * old)
+        self._free.extend(range(new - 1, old - 1, -1))
+
+    def add(self, train):
+        if train['id'] in self.slot_of:
+            return self.slot_of[train['id']]
+        if not self._free:
+            self._grow()
+        slot = self._free.pop()
+        self.slot_of[train['id']] = slot
+        self.train_at[slot] = train
+        self.position[slot] = train.get('positionOnSegment', 0.0)
+        self.speed[slot] = train.get('speed_kph', 0)
+        self.rate[slot] = 1.0 / SEGMENT_TRAVEL_TIME
+        seg = train.get('currentSegmentId')
+        self.segment[slot] = self.segment_index.get(seg, -1) if seg else -1
+        self.state[slot] = STATE_CODES.get(train.get('state'), EMPTY)
+        return slot
+
+    def remove(self, train_id):
+        slot = self.slot_of.pop(train_id, None)
+        if slot is None:
+            return
+        self.train_at[slot] = None
+        self.state[slot] = EMPTY
+        self.segment[slot] = -1
+        self.position[slot] = 0.0
+        self.speed[slot] = 0.0
+        self._free.append(slot)
+
+    def set_state(self, train_id, state):
+        slot = self.slot_of.get(train_id)
+        if slot is not None:
+            self.state[slot] = STATE_CODES.get(state, EMPTY)
+            if state != 'RUNNING':
+                self.speed[slot] = 0.0
+
+    def enter_segment(self, train_id, segment_id, speed_kph, travel_time=SEGMENT_TRAVEL_TIME):
+        slot = self.slot_of[train_id]
+        self.segment[slot] = self.segment_index.get(segment_id, -1)
+        self.position[slot] = 0.0
+        self.speed[slot] = speed_kph
+        self.rate[slot] = 1.0 / travel_time
+        self.state[slot] = RUNNING
+
+    def position_of(self, train_id):
+        slot = self.slot_of.get(train_id)
+        return float(self.position[slot]) if slot is not None else 0.0
+
+    def running_count(self):
+        return int(np.count_nonzero(self.state == RUNNING))
+
+    def step(self, dt):
+        """Advance every RUNNING train by dt seconds; return the train dicts that reached segment end."""
+        running = self.state == RUNNING
+        if not running.any():
+            return []
+        self.position[running] += self.rate[running] * dt
+        self._stale = True
+
+        arrived = np.flatnonzero(running & (self.position >= 1.0 - ARRIVAL_EPSILON))
+        if arrived.size == 0:
+            return []
+        self.position[arrived] = 1.0
+        trains = [self.train_at[slot] for slot in arrived]
+        for train in trains:
+            train['positionOnSegment'] = 1.0
+        return trains
+
+    def materialise(self):
+        """Write array positions back into the train dicts (only when something moved)."""
+        if not self._stale:
+            return
+        for slot in np.flatnonzero(self.state == RUNNING):
+            self.train_at[slot]['positionOnSegment'] = float(self.position[slot])
+        self._stale = False
+
+    def slot_layout(self):
+        """Slot assignment and free list, so a checkpoint restore puts every train back in its old slot."""
+        return {'capacity': len(self.train_at), 'slot_of': dict(self.slot_of), 'free': list(self._free)}
+
+    def restore_layout(self, layout, trains_by_id):
+        """Inverse of slot_layout(): re-add trains (already carrying their dict state) at their old slots."""
+        while len(self.train_at) < layout['capacity']:
+            self._grow()
+        for train_id, slot in sorted(layout['slot_of'].items(), key=lambda item: item[1]):
+            self._free = [slot]
+            self.add(trains_by_id[train_id])
+        self._free = list(layout['free'])
@@ -2,7 +2,18 @@ import asyncio
 import socketio
 from fastapi import FastAPI
 from simulation import Simulation
-from optimizer import Optimizer
+from delta import StateStream
+from sessions import SessionManager
+from journal import RunRecorder, new_seed
+import planning
+from planning import PlanJob, PlanningContext, apply_solved_plan
+import checkpoint
+from checkpoint import CheckpointWriter
+import codec
+import whatif
+from eventlog import DEBUG, LEVELS, get_default_log
+import os
+import shutil
 import time
 import traceback
 
@@ -10,496 +21,549 @@ sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins="*")
 app = FastAPI()
 socket_app = socketio.ASGIApp(sio, app)
 
-simulation_task = None
-current_simulation = None
-pause_event = asyncio.Event()
-is_optimizing = False
-
-# AI/manual signal control globals
-ai_control_enabled = True  # when True AI can set signals automatically; when False UI/manual control is authoritative
-# timestamps of last manual override: signal_id -> unix_timestamp
-manual_override_timestamps = {}
-# signals set while no sim is running: signal_id -> state
-pending_signal_overrides = {}
-MANUAL_OVERRIDE_GRACE_SECONDS = 15  # AI will not override a signal that was manually toggled within this window
-
-# Server-side authoritative priorities — network congestion & trackCondition are ALWAYS True.
-current_ai_priorities = {
-    'congestion': True,       # forced ON
-    'trainType': True,
-    'punctuality': True,
-    'trackCondition': True,   # forced ON
-    'weather': False
-}
+# start payload {'record': true} or this env var turns on run journals (see journal.py)
+RECORD_DIR = os.environ.get('FLOWSTATE_RECORD_DIR')
+# periodic background checkpoints of each running section; start payload {'resume': true}
+# (or FLOWSTATE_RESUME=1) restores the section's latest one instead of starting from scratch
+CHECKPOINT_DIR = os.environ.get('FLOWSTATE_CHECKPOINT_DIR', 'checkpoints')
+CHECKPOINT_INTERVAL = float(os.environ.get('FLOWSTATE_CHECKPOINT_INTERVAL', '30'))
+# stream improving CP-SAT solutions while a solve runs and act on the first good-enough one (planning.py)
+ANYTIME_PLANS = os.environ.get('FLOWSTATE_ANYTIME', '1') != '0'
+
+# Clients start on the full-state feed ('network-update'); client_subscribe_deltas moves them
+# to the sequenced patch feed ('network-delta' + 'state:snapshot').
+FULL_STATE_ROOM = 'feed:full'
+DELTA_ROOM = 'feed:delta'
+# Clients that negotiated the binary codec sit in '<room>#msgpack' instead of '<room>'.
+BINARY_SUFFIX = '#msgpack'
+BINARY_ROOM = 'codec:msgpack'
+client_codecs = {}  # sid -> 'json' | 'msgpack'
+client_feeds = {}   # sid -> FULL_STATE_ROOM | DELTA_ROOM
+client_rooms = {}   # sid -> section rooms the client is in
+
+
+def _announce_signal_change(sim: Simulation, signal_id: str, state: str, by: str):
+    # broadcast update (fire-and-forget)
+    session = sessions.for_simulation(sim)
+    if session is None:
+        return
+    try:
+        if by != 'manual':
+            asyncio.create_task(sio.emit('ai:signal-set', {'section': session.section_code, 'signal': signal_id, 'state': state}, room=session.room))
+        asyncio.create_task(broadcast_state(sim))
+    except Exception:
+        pass
 
-# Tracks that UI set while no simulation is running; applied when sim starts.
-pending_faulty_tracks = set()
 
+# one Session per section (simulation, plan job, loop task, overrides, room); see sessions.py
+sessions = SessionManager(on_signal_change=_announce_signal_change)
+scheduler = sessions.scheduler
 
-def _signal_overridden_recently(signal_id: str) -> bool:
-    ts = manual_override_timestamps.get(signal_id)
-    if not ts:
-        return False
-    return (time.time() - ts) < MANUAL_OVERRIDE_GRACE_SECONDS
 
+async def _enter_rooms(sid):
+    """
+    Put a client in its section's rooms: the section room (plain events), the section state room
+    and its feed room (the state rooms in their '#msgpack' variant for binary clients).
+    """
+    for room in client_rooms.pop(sid, ()):
+        await sio.leave_room(sid, room)
+    session = sessions.for_client(sid)
+    suffix = BINARY_SUFFIX if client_codecs.get(sid) == 'msgpack' else ''
+    rooms = [session.room, session.state_room + suffix, session.feed_room(client_feeds.get(sid, FULL_STATE_ROOM)) + suffix]
+    for room in rooms:
+        await sio.enter_room(sid, room)
+    client_rooms[sid] = rooms
 
-def apply_track_status_to_sim(sim: Simulation, track_id: str, status: str):
-    updated = False
-    for seg in sim.network['trackSegments']:
-        if seg['id'] == track_id:
-            seg['status'] = status
-            if track_id in sim.segments_map:
-                sim.segments_map[track_id]['status'] = status
-            updated = True
-            break
-    if status == 'FAULTY':
-        sim.locked_resources.add(track_id)
-    else:
-        sim.locked_resources.discard(track_id)
 
-    if updated:
-        sim.plan_needed = True
-        print(f"🔧 Applied status={status} to track {track_id} in simulation {sim.section_code}.")
+async def _join_feed(sid, feed):
+    client_feeds[sid] = feed
+    await _enter_rooms(sid)
 
 
-def apply_signal_state(sim: Simulation, signal_id: str, state: str, by: str = 'ai'):
+async def emit_state(event, payload, room=None, to=None):
     """
-    Set signal state on a simulation instance.
-    - If by=='manual': record manual override timestamp (so AI will avoid overriding for grace window)
-    - If by=='ai': apply only if allowed (no recent manual override AND ai_control_enabled)
-    Returns True if state applied, False if skipped.
+    Emit a state payload (initial-state, network-update, network-delta, state:snapshot,
+    ai:plan-update): JSON to ordinary clients, packed bytes to msgpack clients.
     """
-    global manual_override_timestamps
-
-    state = (state or 'RED').upper()
-    signal_id = signal_id.strip().upper()
-
-    if by == 'manual':
-        manual_override_timestamps[signal_id] = time.time()
-        # update simulation node map
-        if signal_id in sim.nodes_map:
-            sim.nodes_map[signal_id]['state'] = state
-        # reflect into network dict for UI
-        for n in sim.network['nodes']:
-            if n['id'] == signal_id:
-                n['state'] = state
-        sim.plan_needed = True
-        print(f"✋ Manual override applied: signal {signal_id} => {state}")
-        # broadcast update (fire-and-forget)
-        try:
-            asyncio.create_task(sio.emit('network-update', sim.get_state()))
-        except Exception:
-            pass
-        return True
+    if to is not None:
+        data = codec.encode(payload) if client_codecs.get(to) == 'msgpack' else payload
+        await sio.emit(event, data, to=to)
+        return
+    binary_sids = [sid for sid, c in client_codecs.items() if c == 'msgpack']
+    if room is None:
+        await sio.emit(event, payload, skip_sid=binary_sids or None)
+        if binary_sids:
+            await sio.emit(event, codec.encode(payload), room=BINARY_ROOM)
     else:
-        # AI attempt
-        if not ai_control_enabled:
-            print(f"🔒 AI tried to set {signal_id} => {state}, but AI control is disabled.")
-            return False
-        if _signal_overridden_recently(signal_id):
-            print(f"🔒 AI wanted to set {signal_id} => {state}, but it was recently manually overridden.")
-            return False
-        if signal_id in sim.nodes_map:
-            sim.nodes_map[signal_id]['state'] = state
-        for n in sim.network['nodes']:
-            if n['id'] == signal_id:
-                n['state'] = state
-        sim.plan_needed = True
-        print(f"🤖 AI set signal {signal_id} => {state}")
-        try:
-            asyncio.create_task(sio.emit('ai:signal-set', {'signal': signal_id, 'state': state}))
-            asyncio.create_task(sio.emit('network-update', sim.get_state()))
-        except Exception:
-            pass
-        return True
-
-
-def ai_try_clear_waiting_trains(sim: Simulation):
-    """
-    Proactively try to set departure signals GREEN for trains that are READY_TO_PROCEED
-    or STOPPED_AWAITING_CLEARANCE when their next segment/node appears free.
-    Additionally: set signals RED when AI decides they are not needed (idle/unused),
-    while respecting manual overrides and safety checks.
-
-    Returns a tuple (greens_applied, reds_applied).
-    """
-    # Fast guard
-    if not ai_control_enabled:
-        return (0, 0)
-
-    greens_applied = 0
-    # set of signal node IDs AI intends to keep GREEN for imminent departures
-    desired_green_signals = set()
-
-    # FIRST PASS: determine which signals should be GREEN (for trains that can proceed)
-    for train in sim.active_trains:
-        state = train.get('state')
-        if state not in ('READY_TO_PROCEED', 'STOPPED_AWAITING_CLEARANCE'):
-            continue
-        route = train.get('route') or []
-        node_path = train.get('node_path') or []
-        if not route or not node_path:
-            continue
-
-        # Decide departure node and next segment
-        if state == 'READY_TO_PROCEED':
-            departure_node = node_path[0]
-            next_segment = route[0]
-        else:
-            # STOPPED_AWAITING_CLEARANCE
-            try:
-                idx = route.index(train.get('currentSegmentId'))
-                if (idx + 1) < len(node_path):
-                    departure_node = node_path[idx + 1]
-                else:
-                    departure_node = node_path[0]
-                next_segment = route[idx + 1] if (idx + 1) < len(route) else None
-            except Exception:
-                departure_node = node_path[0]
-                next_segment = route[0]
-        if not next_segment:
-            continue
-
-        # safety checks: segment not faulty, weather priorities, resources not locked
-        seg = sim.segments_map.get(next_segment, {})
-        if seg.get('status') == 'FAULTY':
-            continue
-        if sim.current_ai_priorities.get('weather') and seg.get('weather') == 'BAD':
-            continue
-        if next_segment in sim.locked_resources:
-            continue
-        # check node after segment if possible
-        try:
-            np_node_path = sim._convert_segment_path_to_node_path([next_segment])
-            next_node_after = np_node_path[1] if len(np_node_path) > 1 else None
-        except Exception:
-            next_node_after = None
-        if next_node_after and next_node_after in sim.locked_resources:
-            continue
-
-        # Respect manual override recency
-        if _signal_overridden_recently(departure_node):
-            continue
-
-        # Mark as desired green
-        desired_green_signals.add(departure_node.upper())
-
-    # SECOND PASS: apply GREEN to desired signals (attempt)
-    for sig in desired_green_signals:
-        applied_ok = apply_signal_state(sim, sig, 'GREEN', by='ai')
-        if applied_ok:
-            greens_applied += 1
-
-    # THIRD PASS: decide which GREEN signals should be set RED.
-    # We will turn RED any signal currently GREEN that is NOT in desired_green_signals,
-    # is safe to change, and wasn't manually overridden recently.
-    reds_applied = 0
-
-    # Build a map of node_id -> node object for quick lookup (normalized)
-    node_map = {n['id'].upper(): n for n in sim.network.get('nodes', [])}
-
-    for node_id, node in node_map.items():
-        if node.get('type') != 'SIGNAL':
-            continue
-        current_state = (node.get('state') or '').upper()
-        if current_state != 'GREEN':
-            continue  # only consider currently green signals for red'ing
-
-        # If AI wants this green, skip
-        if node_id in desired_green_signals:
-            continue
-
-        # Respect manual override
-        if _signal_overridden_recently(node_id):
-            continue
-
-        # Safety: avoid setting RED if doing so would block a RUNNING train that expects this signal
-        # Heuristic: if there's a RUNNING train whose next segment or node depends on this signal, don't flip.
-        # We'll conservatively check running trains' currentSegmentId and node_path.
-        block_safe = True
-        for t in sim.active_trains:
-            if t.get('state') != 'RUNNING':
-                continue
-            # If this signal node appears in the node_path of a running train and is
-            # the immediate departure node for next segment, avoid changing it.
-            t_node_path = t.get('node_path') or []
-            if node_id in [n.upper() for n in t_node_path]:
-                # Determine if signal node is the departure node for upcoming movement — if so, avoid toggling
-                # Conservative: if node is in node_path near the train's currentSegmentId, skip.
-                try:
-                    idx = t_node_path.index(node_id)
-                    # if this node is the next node after currentSegmentId, it's important
-                    current_seg = t.get('currentSegmentId')
-                    if current_seg:
-                        # find index of current segment in route and compare
-                        t_route = t.get('route') or []
-                        # convert route to node_path to be safe
-                        # If node appears after a segment in route, it's relevant -> skip toggling
-                        node_after_segments = sim._convert_segment_path_to_node_path(t_route)
-                        if node_id in node_after_segments:
-                            block_safe = False
-                            break
-                except Exception:
-                    pass
+        await sio.emit(event, payload, room=room)
+        if binary_sids:
+            await sio.emit(event, codec.encode(payload), room=room + BINARY_SUFFIX)
 
-        if not block_safe:
-            continue
 
-        # Additional safety: if the node controls entry into a locked resource, don't flip it red
-        # We'll check segments adjacent to this signal's node: if any adjacent segment is locked and
-        # would be needed for a train to exit, avoid flipping red.
-        # Build adjacency check via sim.adjacency_list if possible
-        try:
-            neighbors = sim.adjacency_list.get(node_id, [])
-            # if any adjacent segment is locked AND that segment's other node is occupied/locked, be conservative
-            unsafe = False
-            for nb in neighbors:
-                seg_id = nb.get('segment_id')
-                if seg_id and seg_id in sim.locked_resources:
-                    unsafe = True
-                    break
-            if unsafe:
-                continue
-        except Exception:
-            # if adjacency not available, continue with caution (don't flip)
-            continue
+async def broadcast_state(sim: Simulation):
+    """Full state to legacy clients, the next sequenced patch to delta subscribers."""
+    session = sessions.for_simulation(sim)
+    if session is None:
+        return
+    await emit_state('network-update', sim.get_state(), room=session.feed_room(FULL_STATE_ROOM))
+    if session.stream is not None:
+        await emit_state('network-delta', session.stream.next_delta(), room=session.feed_room(DELTA_ROOM))
 
-        # If we reached here, it's considered safe to set this signal RED
-        applied_ok = apply_signal_state(sim, node_id, 'RED', by='ai')
-        if applied_ok:
-            reds_applied += 1
 
-    return (greens_applied, reds_applied)
+def apply_track_status_to_sim(sim: Simulation, track_id: str, status: str):
+    # Simulation.set_track_status keeps locks, plan_needed and the route cache consistent
+    updated = sim.set_track_status(track_id, status)
+    if updated:
+        print(f"🔧 Applied status={status} to track {track_id} in simulation {sim.section_code}.")
 
 
-async def simulation_loop(simulation_instance, optimizer_instance):
-    global is_optimizing
-    print(f"🏁 Simulation loop started for {simulation_instance.section_code}.")
+async def simulation_loop(session):
+    simulation_instance = session.simulation
+    signal_control = session.signals
+    section = session.section_code
+    print(f"🏁 Simulation loop started for {section}.")
     first_iteration = True
     try:
         while True:
             try:
-                # debug: show pause_event current state
-                print(f"[debug] pause_event.is_set() => {pause_event.is_set()}")
-
-                # On first iteration, print type & available attrs to help diagnose missing methods
-                if first_iteration:
-                    first_iteration = False
-                    try:
-                        print(f"[debug] simulation_instance type: {type(simulation_instance)}")
-                        print(f"[debug] simulation_instance dir: {sorted([a for a in dir(simulation_instance) if not a.startswith('_')])}")
-                    except Exception:
-                        print("[debug] Failed to print simulation_instance introspection.")
-                        traceback.print_exc()
+                log = simulation_instance.log
+                if log.enabled(DEBUG):
+                    log.emit(DEBUG, 'loop', section, simulation_instance.current_time_seconds,
+                             message=f"pause_event.is_set() => {session.pause_event.is_set()}")
+
+                    # On first iteration, log type & available attrs to help diagnose missing methods
+                    if first_iteration:
+                        first_iteration = False
+                        attrs = sorted(a for a in dir(simulation_instance) if not a.startswith('_'))
+                        log.emit(DEBUG, 'loop', section, simulation_instance.current_time_seconds,
+                                 message=f"simulation_instance type: {type(simulation_instance)} dir: {attrs}")
 
                 # wait for play
-                await pause_event.wait()
-
-                # --- TICK (preferred) or fallback if missing ---
-                try:
-                    if hasattr(simulation_instance, 'tick') and callable(getattr(simulation_instance, 'tick')):
-                        simulation_instance.tick()
-                    else:
-                        # Fallback: if tick not present, attempt to call internals if available
-                        print("⚠️ Warning: simulation_instance has no 'tick'. Attempting fallback internal step.")
-                        # conservative time increment if available
-                        if hasattr(simulation_instance, 'current_time_seconds') and hasattr(simulation_instance, 'tick_rate'):
-                            simulation_instance.current_time_seconds += simulation_instance.tick_rate * max(1, getattr(simulation_instance, 'sim_speed', 1))
-                        if hasattr(simulation_instance, '_spawn_trains'):
-                            try:
-                                simulation_instance._spawn_trains()
-                            except Exception:
-                                print("⚠️ fallback: _spawn_trains failed")
-                                traceback.print_exc()
-                        if hasattr(simulation_instance, '_check_and_dispatch_trains'):
-                            try:
-                                simulation_instance._check_and_dispatch_trains()
-                            except Exception:
-                                print("⚠️ fallback: _check_and_dispatch_trains failed")
-                                traceback.print_exc()
-                        if hasattr(simulation_instance, '_update_train_positions'):
-                            try:
-                                simulation_instance._update_train_positions()
-                            except Exception:
-                                print("⚠️ fallback: _update_train_positions failed")
-                                traceback.print_exc()
-                        if hasattr(simulation_instance, '_update_network_state'):
-                            try:
-                                simulation_instance._update_network_state()
-                            except Exception:
-                                print("⚠️ fallback: _update_network_state failed")
-                                traceback.print_exc()
-
-                except Exception as e:
-                    print("❌ Exception during simulation tick/fallback:")
-                    traceback.print_exc()
-                    await sio.emit('simulation:error', {'message': 'Simulation tick error: ' + str(e)})
-                    # continue to next loop iteration after short pause
-                    await asyncio.sleep(0.5)
-                    continue
-
-                # current state snapshot
-                try:
-                    current_state = simulation_instance.get_state()
-                except Exception as e:
-                    print("❌ Exception while getting simulation state:")
-                    traceback.print_exc()
-                    current_state = {"timestamp": getattr(simulation_instance, 'current_time_seconds', 0), "network": getattr(simulation_instance, 'network', {}), "trains": getattr(simulation_instance, 'active_trains', [])}
+                await session.pause_event.wait()
 
-                # --- NEW: let AI proactively try to clear departure signals for waiting trains,
-                # and also set redundant/idle signals to RED when safe ---
-                try:
-                    if ai_control_enabled and not is_optimizing:
-                        greens, reds = ai_try_clear_waiting_trains(simulation_instance)
-                        if (greens + reds) > 0:
-                            print(f"🤖 AI proactively opened {greens} signal(s) and closed {reds} signal(s) this tick.")
-                            # if AI changed signals, request a re-plan in case that affects optimizer decisions
-                            simulation_instance.plan_needed = True
-                except Exception:
-                    print("⚠️ Exception while running ai_try_clear_waiting_trains:")
-                    traceback.print_exc()
-
-                # find trains that need a plan
-                trains_needing_plan = [t for t in current_state.get('trains', []) if t.get('state') == 'WAITING_PLAN']
-
-                if trains_needing_plan and not is_optimizing and getattr(simulation_instance, 'plan_needed', False):
-                    is_optimizing = True
-                    simulation_instance.plan_needed = False
-                    await sio.emit('ai:plan-thinking')
+                # tick, state sync and AI signal pass run as one turn; sections take turns fairly
+                tick_error = None
+                async with scheduler.turn(section):
+                    # --- TICK (preferred) or fallback if missing ---
                     try:
-                        plan = optimizer_instance.generate_plan(trains_needing_plan, current_state, current_ai_priorities)
-                    except Exception as e:
-                        print("❌ Exception during optimizer.generate_plan():")
-                        traceback.print_exc()
-                        await sio.emit('simulation:error', {'message': 'Optimizer error: ' + str(e)})
-                        plan = []
-
-                    if plan:
-                        # AI attempts to set departure signals to GREEN (won't override recent manual)
-                        if ai_control_enabled:
-                            for p in plan:
+                        if hasattr(simulation_instance, 'tick') and callable(getattr(simulation_instance, 'tick')):
+                            simulation_instance.tick()
+                            if session.recorder is not None:
+                                session.recorder.step += 1
+                        else:
+                            # Fallback: if tick not present, attempt to call internals if available
+                            print("⚠️ Warning: simulation_instance has no 'tick'. Attempting fallback internal step.")
+                            # conservative time increment if available
+                            if hasattr(simulation_instance, 'current_time_seconds') and hasattr(simulation_instance, 'tick_rate'):
+                                simulation_instance.current_time_seconds += simulation_instance.tick_rate * max(1, getattr(simulation_instance, 'sim_speed', 1))
+                            if hasattr(simulation_instance, '_spawn_trains'):
+                                try:
+                                    simulation_instance._spawn_trains()
+                                except Exception:
+                                    print("⚠️ fallback: _spawn_trains failed")
+                                    traceback.print_exc()
+                            if hasattr(simulation_instance, '_check_and_dispatch_trains'):
+                                try:
+                                    simulation_instance._check_and_dispatch_trains()
+                                except Exception:
+                                    print("⚠️ fallback: _check_and_dispatch_trains failed")
+                                    traceback.print_exc()
+                            if hasattr(simulation_instance, '_update_train_positions'):
+                                try:
+                                    simulation_instance._update_train_positions()
+                                except Exception:
+                                    print("⚠️ fallback: _update_train_positions failed")
+                                    traceback.print_exc()
+                            if hasattr(simulation_instance, '_update_network_state'):
                                 try:
-                                    if p.get('action') == 'PROCEED':
-                                        route = p.get('route', [])
-                                        if route:
-                                            node_path = simulation_instance._convert_segment_path_to_node_path(route)
-                                            if node_path:
-                                                first_node = node_path[0]
-                                                apply_signal_state(simulation_instance, first_node, 'GREEN', by='ai')
+                                    simulation_instance._update_network_state()
                                 except Exception:
-                                    print("⚠️ Warning while pre-setting AI signals for plan:")
+                                    print("⚠️ fallback: _update_network_state failed")
                                     traceback.print_exc()
 
+                    except Exception as e:
+                        print("❌ Exception during simulation tick/fallback:")
+                        traceback.print_exc()
+                        # reported and backed off after the turn: a failing section must not hold it
+                        tick_error = str(e)
+                    else:
+                        # current state snapshot
                         try:
-                            simulation_instance.apply_plan(plan)
-                            await sio.emit('ai:plan-update', plan)
+                            current_state = simulation_instance.get_state()
+                        except Exception as e:
+                            print("❌ Exception while getting simulation state:")
+                            traceback.print_exc()
+                            current_state = {"timestamp": getattr(simulation_instance, 'current_time_seconds', 0), "network": getattr(simulation_instance, 'network', {}), "trains": getattr(simulation_instance, 'active_trains', [])}
+
+                        # --- NEW: let AI proactively try to clear departure signals for waiting trains,
+                        # and also set redundant/idle signals to RED when safe ---
+                        try:
+                            if signal_control.ai_control_enabled:
+                                greens, reds = signal_control.clear_waiting_trains(simulation_instance)
+                                if (greens + reds) > 0:
+                                    print(f"🤖 [{section}] AI proactively opened {greens} signal(s) and closed {reds} signal(s) this tick.")
+                                    # if AI changed signals, request a re-plan in case that affects optimizer decisions
+                                    simulation_instance.plan_needed = True
                         except Exception:
-                            print("❌ Exception while applying plan:")
+                            print("⚠️ Exception while running ai_try_clear_waiting_trains:")
                             traceback.print_exc()
-                            await sio.emit('simulation:error', {'message': 'Apply plan error'})
-                    else:
-                        print("⚠️ Optimizer returned no plan.")
-                    is_optimizing = False
+
+                        # collect a finished plan / request a new one; the solve itself runs in a worker process
+                        applied_plan, provisional, requested, solve_error = _advance_planning(session)
+
+                if tick_error is not None:
+                    await sio.emit('simulation:error', {'section': section, 'message': 'Simulation tick error: ' + tick_error}, room=session.room)
+                    # continue to next loop iteration after short pause
+                    await asyncio.sleep(0.5)
+                    continue
+
+                if solve_error is not None:
+                    await sio.emit('simulation:error', {'section': section, 'message': 'Optimizer error: ' + solve_error}, room=session.room)
+                if provisional is not None:
+                    # every improvement while the solver runs; instructions carry provisional / objective / gap
+                    plan, objective, gap = provisional
+                    await emit_state('ai:plan-update', [dict(ins, provisional=True, objective=objective, gap=gap) for ins in plan],
+                                     room=session.state_room)
+                elif applied_plan:
+                    await emit_state('ai:plan-update', applied_plan, room=session.state_room)
+                if requested:
+                    await sio.emit('ai:plan-thinking', {'section': section}, room=session.room)
 
                 # Emit periodic network update
                 try:
-                    await sio.emit('network-update', simulation_instance.get_state())
+                    await broadcast_state(simulation_instance)
                 except Exception:
                     print("❌ Exception while emitting network-update:")
                     traceback.print_exc()
 
+                # background checkpoint (the capture is a cheap copy; pickling and I/O run off-loop)
+                try:
+                    session.checkpoint_writer.maybe_checkpoint(simulation_instance, session.checkpoint_extra())
+                except Exception:
+                    print("⚠️ Exception while capturing checkpoint:")
+                    traceback.print_exc()
+
                 # cadence (guard against zero or negative sim_speed)
                 await asyncio.sleep(1 / max(1, getattr(simulation_instance, 'sim_speed', 1)))
 
             except asyncio.CancelledError:
-                print(f"🛑 Simulation loop for {simulation_instance.section_code} was cancelled (inner).")
+                print(f"🛑 Simulation loop for {section} was cancelled (inner).")
                 raise
             except Exception as exc:
-                print(f"❗ Uncaught exception inside simulation loop for {simulation_instance.section_code}: {exc}")
+                print(f"❗ Uncaught exception inside simulation loop for {section}: {exc}")
                 traceback.print_exc()
                 try:
-                    await sio.emit('simulation:error', {'message': f'Internal simulation error: {str(exc)}'})
+                    await sio.emit('simulation:error', {'section': section, 'message': f'Internal simulation error: {str(exc)}'}, room=session.room)
                 except Exception:
                     pass
                 await asyncio.sleep(1)
 
     except asyncio.CancelledError:
-        print(f"🛑 Simulation loop for {simulation_instance.section_code} was cancelled (outer).")
+        print(f"🛑 Simulation loop for {section} was cancelled (outer).")
     finally:
-        print(f"Simulation loop for {simulation_instance.section_code} has ended.")
+        _cancel_plan_job(session)
+        if session.recorder is not None and session.recorder.sim is simulation_instance:
+            session.recorder.close()
+        print(f"Simulation loop for {section} has ended.")
+
+
+def _cancel_plan_job(session):
+    if session.plan_job is not None and session.plan_job.task is not None:
+        session.plan_job.task.cancel()
+    session.plan_job = None
+
+
+def _advance_planning(session):
+    """
+    One planning step of a loop iteration (no awaits, so it is deterministic w.r.t. the tick):
+    drop a queued solve the state has moved past, apply a finished one (or the running one's newest
+    good-enough provisional plan), request a new one. Returns (plan applied or None, newest provisional
+    (plan, objective, gap) or None, whether a solve was requested, solver error message or None).
+    """
+    sim = session.simulation
+    section = session.section_code
+    job = session.plan_job
+    recorder = session.recorder
+    applied, provisional, error = None, None, None
+
+    # a request the state has moved past since it was queued: cancel it (once a solver has it, let
+    # it finish and re-validate the result instead)
+    if job is not None and job.version != sim.state_version and job.cancel():
+        print(f"🗑️ [{section}] Dropped queued plan request for state v{job.version} (now v{sim.state_version}).")
+        if recorder is not None:
+            recorder.cancel(job.step)
+        session.plan_job = job = None
+        sim.plan_needed = True
+
+    if job is not None and job.done():
+        session.plan_job = None
+        try:
+            result = job.task.result()
+            plan = result.plan
+            stats = result.stats or {}
+            cached = stats.get('methods', {}).get('cached', 0)
+            reuse = f" ({cached} group(s) from the plan cache, hit rate {stats['plan_cache']['hit_rate']})" if cached else ""
+            print(f"🧠 [{section}] Plan for state v{result.version} solved in {result.solve_seconds:.2f}s{reuse}.")
+        except Exception as e:
+            print("❌ Exception during optimizer.generate_plan():")
+            traceback.print_exception(type(e), e, e.__traceback__)
+            error, plan = str(e), []
+        if recorder is not None:
+            recorder.plan(plan, requested=job.step, version=job.version)
+        try:
+            applied = apply_solved_plan(sim, session.signals, plan, job.version)
+            if not plan:
+                print(f"⚠️ [{section}] Optimizer returned no plan.")
+        except Exception:
+            print("❌ Exception while applying plan:")
+            traceback.print_exc()
+            error = error or 'Apply plan error'
+    elif job is not None and job.poll_progress() is not None:
+        plan, objective, gap, elapsed = job.provisional
+        provisional = (plan, objective, gap)
+        first = not job.provisional_applied
+        good_enough = job.take_provisional()
+        if good_enough is not None:
+            if recorder is not None:
+                recorder.plan(good_enough, requested=job.step, version=job.version, final=False)
+            try:
+                applied = apply_solved_plan(sim, session.signals, good_enough, job.version)
+                if first:
+                    print(f"⏱️ [{section}] Acting on provisional plan after {elapsed:.2f}s (objective {objective}, gap {gap:.1%}).")
+            except Exception:
+                print("❌ Exception while applying provisional plan:")
+                traceback.print_exc()
+                error = 'Apply plan error'
+
+    trains_needing_plan = sim.trains.in_state('WAITING_PLAN')
+    if session.plan_job is None and trains_needing_plan and sim.plan_needed:
+        sim.plan_needed = False
+        progress = planning.progress_queue() if ANYTIME_PLANS else None
+        context = PlanningContext(sim, trains_needing_plan, session.ai_priorities, num_workers=scheduler.solver_threads,
+                                  progress=progress)
+        job = session.plan_job = PlanJob(context.version, recorder.step if recorder is not None else None, progress)
+        job.task = asyncio.create_task(scheduler.solve(section, planning.solve, context, on_start=job.mark_started))
+        if recorder is not None:
+            recorder.request(context.version)
+        return applied, provisional, True, error
+    return applied, provisional, False, error
+
+
+def _stop_session(session):
+    if session.task:
+        session.task.cancel()
+        session.task = None
+    _cancel_plan_job(session)
+    if session.recorder is not None:
+        session.recorder.close()
+        session.recorder = None
+    session.simulation = None
+    session.stream = None
+    sessions.stopped(session)
 
 
 @sio.event
 async def connect(sid, environ):
     print(f"✅ Client connected: {sid}")
+    client_codecs[sid] = 'json'
+    await _join_feed(sid, FULL_STATE_ROOM)
+    session = sessions.for_client(sid)
     # Send authoritative AI control state immediately to the connecting client so frontends stay in sync
     try:
-        await sio.emit('ai:control_state_changed', {'enabled': ai_control_enabled}, to=sid)
+        await sio.emit('ai:control_state_changed', {'section': session.section_code, 'enabled': session.signals.ai_control_enabled}, to=sid)
     except Exception:
         pass
 
-    if current_simulation:
-        print(f"   -> Active simulation found. Syncing client {sid}.")
-        await sio.emit('initial-state', current_simulation.get_state(), to=sid)
+    if session.running:
+        print(f"   -> Active simulation found for {session.section_code}. Syncing client {sid}.")
+        await emit_state('initial-state', session.simulation.get_state(), to=sid)
 
 
 @sio.event
 async def disconnect(sid):
     print(f"🔌 Client disconnected: {sid}")
+    client_codecs.pop(sid, None)
+    client_feeds.pop(sid, None)
+    client_rooms.pop(sid, None)
+    sessions.drop_client(sid)
+
+
+@sio.event
+async def client_negotiate_codec(sid, data=None):
+    """
+    Client offers codecs, e.g. { codecs: ['msgpack', 'json'] }. Clients that never ask keep JSON.
+    Replies with 'codec:selected' (and the key dictionary when binary was chosen).
+    """
+    offered = data.get('codecs') if isinstance(data, dict) else data
+    chosen = codec.negotiate(offered)
+    client_codecs[sid] = chosen
+    if chosen == 'msgpack':
+        await sio.enter_room(sid, BINARY_ROOM)
+        reply = codec.describe()
+    else:
+        await sio.leave_room(sid, BINARY_ROOM)
+        reply = {'codec': 'json'}
+    await _join_feed(sid, client_feeds.get(sid, FULL_STATE_ROOM))
+    print(f"🗜️ Client {sid} negotiated codec: {chosen}")
+    await sio.emit('codec:selected', reply, to=sid)
+
+
+@sio.event
+async def client_subscribe_deltas(sid, data=None):
+    """Switch a client from full 'network-update' payloads to sequenced 'network-delta' patches."""
+    await _join_feed(sid, DELTA_ROOM)
+    print(f"📡 Client {sid} subscribed to delta updates.")
+    session = sessions.for_client(sid)
+    if session.stream:
+        await emit_state('state:snapshot', session.stream.snapshot(), to=sid)
+
+
+@sio.event
+async def client_request_resync(sid, data=None):
+    """A delta client that detected a seq gap asks for a fresh snapshot."""
+    session = sessions.for_client(sid)
+    if session.stream:
+        await emit_state('state:snapshot', session.stream.snapshot(), to=sid)
+
+
+@sio.event
+async def client_join_section(sid, data):
+    """
+    Follow another section: { section: 'GZB' }. The client moves to that section's rooms and,
+    when it is running, gets its current state straight away.
+    """
+    code = (data.get('section') or data.get('station_code')) if isinstance(data, dict) else data
+    if not isinstance(code, str) or not code.strip():
+        print(f"⚠️ client_join_section got invalid payload: {data}")
+        return
+    sessions.follow(sid, code.strip())
+    await _enter_rooms(sid)
+    session = sessions.for_client(sid)
+    print(f"🧭 Client {sid} now follows section {session.section_code}.")
+    await sio.emit('ai:control_state_changed', {'section': session.section_code, 'enabled': session.signals.ai_control_enabled}, to=sid)
+    if session.running:
+        await emit_state('initial-state', session.simulation.get_state(), to=sid)
+        if client_feeds.get(sid) == DELTA_ROOM and session.stream:
+            await emit_state('state:snapshot', session.stream.snapshot(), to=sid)
+
+
+@sio.event
+async def controller_list_sections(sid, data=None):
+    """Running sections with their clock and train counts, plus the scheduler's fairness counters."""
+    running = [{
+        'section': s.section_code,
+        'time': s.simulation.current_time_seconds,
+        'trains': len(s.simulation.trains),
+        'isPlaying': s.pause_event.is_set(),
+        'isOptimizing': s.is_optimizing,
+    } for s in sessions.running()]
+    await sio.emit('sections:list', {'sections': running, 'scheduler': scheduler.stats()}, to=sid)
 
 
 @sio.event
 async def controller_start_simulation(sid, data):
-    global simulation_task, current_simulation, pending_faulty_tracks, manual_override_timestamps, pending_signal_overrides
-    station_code = data.get('station_code', 'DLI')
-    if simulation_task and not simulation_task.done():
-        simulation_task.cancel()
+    station_code = (data.get('station_code') or 'DLI').upper()
+    session = sessions.get(station_code)
+    # restarting a section replaces only that section's run; other sections keep going
+    if session.task and not session.task.done():
+        session.task.cancel()
+    sessions.follow(sid, station_code)
 
     try:
-        simulation_instance = Simulation(section_code=station_code)
+        # a recorded run needs a known seed; otherwise the payload may still pin one
+        record = bool(data.get('record')) or bool(RECORD_DIR)
+        resume = bool(data.get('resume', os.environ.get('FLOWSTATE_RESUME') == '1'))
+        resume_path = checkpoint.latest_path(CHECKPOINT_DIR, station_code)
+        seed = data.get('seed')
+        if record and seed is None:
+            seed = new_seed()
+        restored = None
+        if resume and os.path.exists(resume_path):
+            snapshot = checkpoint.read(resume_path)
+            simulation_instance = checkpoint.restore(snapshot)
+            restored = snapshot['extra']
+            print(f"♻️ Resumed {station_code} from checkpoint {resume_path} at t={simulation_instance.current_time_seconds}")
+        else:
+            simulation_instance = Simulation(section_code=station_code, seed=seed)
+        session.simulation = simulation_instance
+        signal_control = session.signals
+        if session.recorder is not None:
+            session.recorder.close()
+            session.recorder = None
+        if record:
+            path = os.path.join(RECORD_DIR or 'recordings', f"{station_code.lower()}_{time.strftime('%Y%m%d-%H%M%S')}.jsonl")
+            base = None
+            if restored is not None:
+                # the periodic checkpoint file is overwritten later; the journal keeps its own copy
+                base = path + '.ckpt'
+                shutil.copyfile(resume_path, base)
+            session.recorder = RunRecorder(path, simulation_instance, checkpoint_path=base)
+            print(f"⏺️ Recording run journal to {path} (seed {simulation_instance.seed})")
+
+        if restored is not None:
+            signal_control.ai_control_enabled = restored.get('ai_control_enabled', True)
+            # checkpoints keep the stamps on simulation time
+            signal_control.restore_stamps(restored.get('manual_override_timestamps', {}),
+                                          simulation_instance.current_time_seconds)
+            session.ai_priorities = dict(simulation_instance.current_ai_priorities)
+        else:
+            # a new run starts without overrides; queued ones are stamped again below as they are applied
+            signal_control.manual_override_timestamps.clear()
+        # start-up state goes through the same (journaled) input path as live controller commands
+        session.record_input('ai_control', enabled=signal_control.ai_control_enabled)
 
         # Force server-side always-on flags into simulation
-        simulation_instance.set_ai_priorities(current_ai_priorities)
+        simulation_instance.set_ai_priorities(session.ai_priorities)
+        session.record_input('priorities', priorities=dict(session.ai_priorities), apply_weather=False)
 
         # apply pending signal overrides (if any) - these come from UI actions performed while sim wasn't running
+        pending_signal_overrides = session.pending_signal_overrides
         if pending_signal_overrides:
             for sig_id, state in list(pending_signal_overrides.items()):
-                simulation_instance.set_signal_state(sig_id, state)
-                # also stamp manual override time so AI respects them briefly
-                manual_override_timestamps[sig_id] = time.time()
+                if sig_id == '_ALL_SIGNALS_RED_':
+                    continue
+                # manual application also stamps the override time so AI respects them briefly
+                signal_control.apply(simulation_instance, sig_id, state, by='manual')
+                session.record_input('signal', signal=sig_id, state=state)
+            if pending_signal_overrides.get('_ALL_SIGNALS_RED_'):
+                for node in simulation_instance.network.get('nodes', []):
+                    if node.get('type') == 'SIGNAL':
+                        signal_control.apply(simulation_instance, node['id'], 'RED', by='manual')
+                session.record_input('all_signals_red')
             pending_signal_overrides.clear()
 
         # apply any pending faulty tracks
-        if pending_faulty_tracks:
-            for trackid in list(pending_faulty_tracks):
+        if session.pending_faulty_tracks:
+            for trackid in list(session.pending_faulty_tracks):
                 apply_track_status_to_sim(simulation_instance, trackid, 'FAULTY')
-            pending_faulty_tracks.clear()
+                session.record_input('track_status', track=trackid, status='FAULTY')
+            session.pending_faulty_tracks.clear()
 
-        # apply pending manual signal overrides recorded in timestamps (if any)
-        for sid_id, ts_or_state in list(manual_override_timestamps.items()):
-            # we only have timestamps here; pending_signal_overrides handles explicit state-to-apply
-            # if signal exists in sim.nodes_map, don't overwrite its state here (it will be applied above if pending)
-            if sid_id in simulation_instance.nodes_map:
-                # leave node's existing state; timestamp is only for preserving manual preference
-                pass
+        session.stream = StateStream(simulation_instance)
+        if session.checkpoint_writer is None:
+            session.checkpoint_writer = CheckpointWriter(CHECKPOINT_DIR, interval=CHECKPOINT_INTERVAL)
+        sessions.started(session)
 
-        optimizer_instance = Optimizer(simulation_instance=simulation_instance)
-        current_simulation = simulation_instance
+        # clients that never picked a section follow the one started last
+        for other_sid in list(client_codecs):
+            if other_sid == sid or other_sid not in sessions.client_sections:
+                await _enter_rooms(other_sid)
 
-        pause_event.set()
-        simulation_task = asyncio.create_task(simulation_loop(simulation_instance, optimizer_instance))
+        session.pause_event.set()
+        session.task = asyncio.create_task(simulation_loop(session))
 
-        await sio.emit('simulation:started')
-        await sio.emit('initial-state', current_simulation.get_state())
+        await sio.emit('simulation:started', {'section': station_code}, room=session.room)
+        await emit_state('initial-state', simulation_instance.get_state(), room=session.state_room)
+        await emit_state('state:snapshot', session.stream.snapshot(), room=session.feed_room(DELTA_ROOM))
 
         # Inform clients of AI control state as well (ensure UI shows correct toggle)
         try:
-            await sio.emit('ai:control_state_changed', {'enabled': ai_control_enabled})
+            await sio.emit('ai:control_state_changed', {'section': station_code, 'enabled': signal_control.ai_control_enabled}, room=session.room)
         except Exception:
             pass
 
     except ValueError as e:
-        await sio.emit('simulation:error', {'message': str(e)})
+        await sio.emit('simulation:error', {'section': station_code, 'message': str(e)}, to=sid)
 
 
 # unified manual signal setter (single implementation)
@@ -507,11 +571,9 @@ async def controller_start_simulation(sid, data):
 async def controller_set_signal(sid, data):
     """
     UI sends { signalId: 'S-PF-3', state: 'GREEN' } to manually set a signal.
-    If simulation is running, apply immediately; otherwise queue in pending_signal_overrides.
+    If simulation is running, apply immediately; otherwise queue in the section's pending overrides.
     Records manual override timestamp so AI will adapt.
     """
-    global manual_override_timestamps, pending_signal_overrides, current_simulation
-
     if not isinstance(data, dict):
         print("⚠️ controller_set_signal invalid payload:", data)
         return
@@ -527,21 +589,24 @@ async def controller_set_signal(sid, data):
     if desired:
         desired = desired.strip().upper()
 
+    session = sessions.for_client(sid, data)
     # if sim active, toggle if no desired state provided
-    if current_simulation:
-        current_state = current_simulation.nodes_map.get(sid_id, {}).get('state', 'RED')
+    if session.running:
+        sim = session.simulation
+        current_state = sim.nodes_map.get(sid_id, {}).get('state', 'RED')
         if not desired:
             desired = 'GREEN' if current_state != 'GREEN' else 'RED'
         # apply as manual
-        apply_signal_state(current_simulation, sid_id, desired, by='manual')
+        session.signals.apply(sim, sid_id, desired, by='manual')
+        session.record_input('signal', signal=sid_id, state=desired)
         # broadcast immediate update
-        await sio.emit('network-update', current_simulation.get_state())
+        await broadcast_state(sim)
     else:
         # simulation not running: queue override to apply on start
         desired = desired or 'GREEN'
-        pending_signal_overrides[sid_id] = desired
-        manual_override_timestamps[sid_id] = time.time()
-        print(f"🕓 Queued manual signal override {sid_id} => {desired} (simulation not running).")
+        session.pending_signal_overrides[sid_id] = desired
+        session.signals.record_manual_override(sid_id)
+        print(f"🕓 Queued manual signal override {sid_id} => {desired} for {session.section_code} (simulation not running).")
 
 
 @sio.event
@@ -550,46 +615,62 @@ async def controller_toggle_ai_control(sid, data):
     UI sends { enabled: true/false } to toggle whether the server AI should
     control signals automatically.
     """
-    global ai_control_enabled
+    session = sessions.for_client(sid, data)
+    signal_control = session.signals
     enable = data.get('enabled') if isinstance(data, dict) else None
     if isinstance(enable, bool):
-        ai_control_enabled = enable
+        signal_control.ai_control_enabled = enable
     else:
-        ai_control_enabled = not ai_control_enabled
+        signal_control.ai_control_enabled = not signal_control.ai_control_enabled
+    session.record_input('ai_control', enabled=signal_control.ai_control_enabled)
 
-    print(f"⚖️ AI control set to: {ai_control_enabled}")
-    await sio.emit('ai:control_state_changed', {'enabled': ai_control_enabled})
+    print(f"⚖️ [{session.section_code}] AI control set to: {signal_control.ai_control_enabled}")
+    await sio.emit('ai:control_state_changed', {'section': session.section_code, 'enabled': signal_control.ai_control_enabled}, room=session.room)
 
 
 @sio.event
 async def controller_toggle_pause_simulation(sid, data):
+    session = sessions.for_client(sid, data)
     is_playing = data.get('isPlaying', False)
     if is_playing:
-        pause_event.set()
-        print("▶️ Simulation Resumed")
+        session.pause_event.set()
+        print(f"▶️ Simulation {session.section_code} Resumed")
     else:
-        pause_event.clear()
-        print("⏸️ Simulation Paused")
-    await sio.emit('simulation:state_changed', {'isPlaying': is_playing})
+        session.pause_event.clear()
+        print(f"⏸️ Simulation {session.section_code} Paused")
+    await sio.emit('simulation:state_changed', {'section': session.section_code, 'isPlaying': is_playing}, room=session.room)
 
 
 @sio.event
 async def controller_stop_simulation(sid, data):
-    global simulation_task, current_simulation
-    if simulation_task:
-        simulation_task.cancel()
-        simulation_task = None
-    current_simulation = None
-    print("⏹️ Simulation Stopped and Reset by Controller.")
-    await sio.emit('simulation:stopped')
+    session = sessions.for_client(sid, data)
+    _stop_session(session)
+    print(f"⏹️ Simulation {session.section_code} Stopped and Reset by Controller.")
+    await sio.emit('simulation:stopped', {'section': session.section_code}, room=session.room)
 
 
 @sio.event
 async def controller_set_sim_speed(sid, data):
-    if current_simulation:
+    session = sessions.for_client(sid, data)
+    if session.running:
         speed = data.get('speed', 1)
-        current_simulation.sim_speed = speed
-        print(f"⚙️ Simulation speed set to: {speed}x")
+        session.simulation.sim_speed = speed
+        session.record_input('sim_speed', speed=speed)
+        print(f"⚙️ Simulation {session.section_code} speed set to: {speed}x")
+
+
+@sio.event
+async def controller_set_log_level(sid, data):
+    """Change the event log level at runtime: {'level': 'debug' | 'info' | 'warning' | 'off'}."""
+    level = (data or {}).get('level') if isinstance(data, dict) else data
+    if not isinstance(level, str) or level.lower() not in LEVELS:
+        print(f"⚠️ controller_set_log_level got invalid level: {data}")
+        return
+    session = sessions.for_client(sid, data)
+    log = session.simulation.log if session.running else get_default_log()
+    name = log.set_level(level)
+    print(f"📝 Event log level set to: {name}")
+    await sio.emit('log:level', {'level': name}, to=sid)
 
 
 @sio.event
@@ -599,33 +680,34 @@ async def controller_set_priorities(sid, data):
      - 'congestion' and 'trackCondition' are ALWAYS true.
      - 'weather' if toggled to True => simulation assigns random bad-weather segments (2-3).
     """
-    global current_ai_priorities, current_simulation
     if not isinstance(data, dict):
         print("⚠️ controller_set_priorities got invalid payload:", data)
         return
+    session = sessions.for_client(sid, data)
 
     # persist user choices but enforce always-on ones
-    user_priorities = dict(data)
+    user_priorities = {k: v for k, v in data.items() if k not in ('section', 'station_code')}
     user_priorities['congestion'] = True
     user_priorities['trackCondition'] = True
-    current_ai_priorities = user_priorities
+    session.ai_priorities = user_priorities
 
-    print("🎛️ Updated AI priorities (server authoritative):", current_ai_priorities)
+    print(f"🎛️ [{session.section_code}] Updated AI priorities (server authoritative):", session.ai_priorities)
 
-    if current_simulation:
-        current_simulation.set_ai_priorities(current_ai_priorities)
+    if session.running:
+        sim = session.simulation
+        sim.set_ai_priorities(session.ai_priorities)
         # handle weather toggle: when enabled assign random bad-weather segments,
         # when disabled clear weather.
-        if current_ai_priorities.get('weather'):
-            current_simulation.assign_random_weather(choose_count=3)
+        if session.ai_priorities.get('weather'):
+            sim.assign_random_weather(choose_count=3)
         else:
-            current_simulation.clear_weather()
-        await sio.emit('network-update', current_simulation.get_state())
+            sim.clear_weather()
+        session.record_input('priorities', priorities=dict(session.ai_priorities), apply_weather=True)
+        await broadcast_state(sim)
 
 
 @sio.event
 async def controller_set_track_status(sid, data):
-    global pending_faulty_tracks, current_simulation
     track_id = data.get('trackId') or data.get('track_id') or data.get('track')
     status = data.get('status')
 
@@ -634,25 +716,64 @@ async def controller_set_track_status(sid, data):
         return
 
     track_id = track_id.strip().upper()
+    session = sessions.for_client(sid, data)
 
-    if current_simulation:
-        apply_track_status_to_sim(current_simulation, track_id, status)
-        await sio.emit('network-update', current_simulation.get_state())
+    if session.running:
+        apply_track_status_to_sim(session.simulation, track_id, status)
+        session.record_input('track_status', track=track_id, status=status)
+        await broadcast_state(session.simulation)
     else:
         if status == 'FAULTY':
-            pending_faulty_tracks.add(track_id)
-            print(f"🕓 Queued pending faulty track {track_id} (simulation not running).")
+            session.pending_faulty_tracks.add(track_id)
+            print(f"🕓 Queued pending faulty track {track_id} for {session.section_code} (simulation not running).")
         else:
-            if track_id in pending_faulty_tracks:
-                pending_faulty_tracks.discard(track_id)
-                print(f"🧾 Removed {track_id} from pending faulty list.")
+            if track_id in session.pending_faulty_tracks:
+                session.pending_faulty_tracks.discard(track_id)
+                print(f"🧾 Removed {track_id} from {session.section_code} pending faulty list.")
 
 
 @sio.event
 async def controller_get_plan(sid, data):
-    if current_simulation:
-        current_simulation.plan_needed = True
-        print("👨‍💻 Controller manually requested a new AI plan.")
+    session = sessions.for_client(sid, data)
+    if session.running:
+        session.simulation.plan_needed = True
+        session.record_input('request_plan')
+        print(f"👨‍💻 Controller manually requested a new AI plan for {session.section_code}.")
+
+
+@sio.event
+async def controller_what_if(sid, data):
+    """
+    Evaluate what-if scenarios on forks of the running simulation, e.g.
+    {'minutes': 10, 'scenarios': [{'name': 'hold 12951', 'actions': [{'type': 'hold', 'train': '12951', 'seconds': 300}]}]}.
+    Forks run in the what-if process pool; the result (baseline + per-scenario deltas) goes back to the caller only.
+    """
+    session = sessions.for_client(sid, data)
+    if not session.running:
+        await sio.emit('what-if:error', {'message': 'No simulation is running.'}, to=sid)
+        return
+    scenarios = (data or {}).get('scenarios') if isinstance(data, dict) else None
+    if not scenarios or not isinstance(scenarios, list):
+        print(f"⚠️ controller_what_if got invalid payload: {data}")
+        await sio.emit('what-if:error', {'message': 'Expected a non-empty scenarios list.'}, to=sid)
+        return
+    sim = session.simulation
+    minutes = float(data.get('minutes', whatif.DEFAULT_MINUTES))
+    print(f"🔮 Evaluating {len(scenarios)} what-if scenario(s) {minutes:g} min ahead of {sim.section_code} at {sim.current_time_seconds}s.")
+    futures = whatif.submit(sim, scenarios, minutes=minutes, priorities=dict(session.ai_priorities),
+                            ai_signals=session.signals.ai_control_enabled,
+                            override_stamps=session.signals.stamps_at(sim.current_time_seconds))
+    try:
+        results = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+    except Exception as e:
+        print("❌ Exception while evaluating what-if scenarios:")
+        traceback.print_exc()
+        await sio.emit('what-if:error', {'message': 'What-if evaluation failed: ' + str(e)}, to=sid)
+        return
+    report = whatif.compare(list(results))
+    report['section'] = session.section_code
+    print(whatif.format_report(report))
+    await sio.emit('what-if:result', report, to=sid)
 
 
 # New: set all lights red (manual override)
@@ -661,22 +782,36 @@ async def controller_set_all_signals_red(sid, data):
     """
     Force all signals to RED and mark them as manual overrides.
     """
-    global manual_override_timestamps, current_simulation, pending_signal_overrides
-    if current_simulation:
+    session = sessions.for_client(sid, data)
+    if session.running:
+        sim = session.simulation
         count = 0
-        for node in current_simulation.network.get('nodes', []):
+        for node in sim.network.get('nodes', []):
             if node.get('type') == 'SIGNAL':
-                apply_signal_state(current_simulation, node['id'], 'RED', by='manual')
+                session.signals.apply(sim, node['id'], 'RED', by='manual')
                 count += 1
-        await sio.emit('network-update', current_simulation.get_state())
-        print(f"🔴 Set all signals RED (count={count})")
+        session.record_input('all_signals_red')
+        await broadcast_state(sim)
+        print(f"🔴 Set all signals RED in {session.section_code} (count={count})")
     else:
         # If sim not running, queue marker for "set-all-red" — we can't enumerate signals before a layout is loaded.
         # Keep a small marker in pending_signal_overrides; frontend should re-request or toggle signals after load.
-        pending_signal_overrides['_ALL_SIGNALS_RED_'] = True
-        print("🕓 Received set-all-signals-red while simulation not running. Will apply after start.")
+        session.pending_signal_overrides['_ALL_SIGNALS_RED_'] = True
+        print(f"🕓 Received set-all-signals-red for {session.section_code} while simulation not running. Will apply after start.")
 
 
 @app.on_event("startup")
 async def startup_event():
     print("🚀 Server starting up... waiting for client to start simulation.")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # a deploy mid-shift resumes every section from here with {'resume': true}
+    for session in sessions.running():
+        session.checkpoint_writer.checkpoint(session.simulation, session.checkpoint_extra())
+        session.checkpoint_writer.flush()
+        print(f"💾 Final checkpoint written for {session.section_code}.")
+        if session.recorder is not None:
+            session.recorder.close()
+    scheduler.shutdown()
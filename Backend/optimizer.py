@@ -1,9 +1,94 @@
 from ortools.sat.python import cp_model
+from concurrent.futures import ThreadPoolExecutor
 import math
+import os
+import threading
+import time
+
+import greedy
+from plan_cache import PlanCache, signature
+
+# groups of at most this many trains are planned by the greedy dispatcher alone (greedy.py)
+GREEDY_MAX_TRAINS = int(os.environ.get('FLOWSTATE_GREEDY_MAX_TRAINS', '2'))
+# worst first: the merged status of a decomposed solve is the worst component status
+STATUS_ORDER = ('MODEL_INVALID', 'INFEASIBLE', 'UNKNOWN', 'FEASIBLE', 'OPTIMAL')
+
+
+class SolveProgress(cp_model.CpSolverSolutionCallback):
+    """
+    Times the solutions CP-SAT reports while searching (each one improves on the last) and hands
+    each one to `on_solution(callback)` when given (anytime plans).
+    """
+
+    def __init__(self, on_solution=None):
+        super().__init__()
+        self.on_solution = on_solution
+        self.solutions = 0
+        self.first_feasible = None
+        self.last_improvement = None
+
+    def on_solution_callback(self):
+        self.solutions += 1
+        if self.first_feasible is None:
+            self.first_feasible = self.WallTime()
+        self.last_improvement = self.WallTime()
+        if self.on_solution is not None:
+            self.on_solution(self)
+
+
+def relative_gap(objective, bound):
+    return round(abs(objective - bound) / max(1.0, abs(objective)), 4)
+
+
+def conflict_components(train_resources):
+    """
+    Union-find over trains that could use a common segment or junction.
+    train_resources: train_id -> set of resource ids. Returns lists of train ids, in first-seen order.
+    """
+    parent = {tid: tid for tid in train_resources}
+
+    def find(tid):
+        while parent[tid] != tid:
+            parent[tid] = parent[parent[tid]]
+            tid = parent[tid]
+        return tid
+
+    owner = {}  # resource -> a train that may use it
+    for tid, resources in train_resources.items():
+        for resource in resources:
+            other = owner.setdefault(resource, tid)
+            if other != tid:
+                root_a, root_b = find(tid), find(other)
+                if root_a != root_b:
+                    parent[root_b] = root_a
+    components = {}
+    for tid in train_resources:
+        components.setdefault(find(tid), []).append(tid)
+    return list(components.values())
+
+
+def merged_reservations(intervals):
+    """[(start, duration, name)] -> sorted, disjoint [(start, end)] covering the same time."""
+    merged = []
+    for start, duration, _ in sorted(intervals):
+        end = start + duration
+        if merged and start < merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(span) for span in merged]
+
 
 class Optimizer:
-    def __init__(self, simulation_instance):
+    def __init__(self, simulation_instance, num_workers=None):
         self.simulation = simulation_instance
+        # CP-SAT search threads; None lets OR-tools use every core (live server), sweeps pin it per process
+        self.num_workers = num_workers
+        self.last_stats = None  # timings of the last solve (see _merge_stats)
+        # time a presolve-only pass before each CP-SAT solve (benchmark.py); off in live planning, it costs a presolve
+        self.measure_presolve = False
+        # proven optima of recurring groups (plan_cache.py); kept across solves and sections
+        self.plan_cache = PlanCache()
         self.priorities = {
             'Shatabdi':   10,
             'Rajdhani':   9,
@@ -16,23 +101,105 @@ class Optimizer:
         }
         print("✅ Definitive Optimizer initialized with Dynamic Priority Logic.")
 
-    def generate_plan(self, trains_to_plan, current_state, current_priorities):
+    def generate_plan(self, trains_to_plan, current_state, current_priorities, on_progress=None):
+        """
+        Plan `trains_to_plan` (WAITING_PLAN). on_progress(plan, objective, gap), when given, is called
+        from the solver threads with every improving solution, before the final plan is returned.
+        """
         print(f"🧠 Optimizer: Planning for {len(trains_to_plan)} train(s) with priorities: {current_priorities}")
         if not trains_to_plan:
             return []
-
-        model = cp_model.CpModel()
         current_time = current_state['timestamp']
-        all_active_trains = current_state['trains']
-
-        horizon = 7200
-        max_time = int(current_time + horizon)
-
-        tasks = {}
-        route_choices = {}
-        resource_intervals = {}
 
         # --- Step 1: Account for running trains as fixed reservations ---
+        fixed = self._fixed_reservations(current_state['trains'], current_time)
+
+        # candidate routes per train are solver scratch; kept off the train dicts, which are simulation state
+        possible_routes = {}
+        train_resources = {}
+        for train in trains_to_plan:
+            routes = self.simulation.find_all_possible_routes(train['start_node'], train['end_node'])
+            if not routes:
+                print(f"⚠️ No routes found for train {train['id']}. It will remain waiting.")
+                continue
+            possible_routes[train['id']] = routes
+            resources = train_resources[train['id']] = set()
+            for route in routes:
+                resources.update(route)
+                resources.update(self.simulation.graph.node_path(route)[1:])
+
+        # trains that can never meet on a segment or junction are independent sub-problems
+        by_id = {t['id']: t for t in trains_to_plan}
+        components = [[by_id[tid] for tid in component] for component in conflict_components(train_resources)]
+        if len(components) > 1:
+            print(f"🧩 Optimizer: {len(components)} independent groups, sizes {sorted((len(c) for c in components), reverse=True)}")
+
+        reporters = self._progress_reporters(len(components), trains_to_plan, on_progress)
+        if len(components) <= 1:
+            results = [self._plan_component(c, possible_routes, fixed, current_time, current_priorities,
+                                            self.num_workers, report) for c, report in zip(components, reporters)]
+        else:
+            # CP-SAT releases the GIL while it searches; the component solves share the search threads
+            workers = max(1, (self.num_workers or os.cpu_count() or 1) // len(components))
+            with ThreadPoolExecutor(max_workers=len(components), thread_name_prefix='cpsat') as pool:
+                results = list(pool.map(lambda args: self._plan_component(args[0], possible_routes, fixed, current_time,
+                                                                          current_priorities, workers, args[1]),
+                                        zip(components, reporters)))
+
+        # --- Step 6: Merge the component plans, in the order the trains were given ---
+        chosen = {}
+        for component_plan, _, _ in results:
+            for instruction in component_plan:
+                chosen[instruction['trainId']] = instruction
+        self._merge_stats([stats for _, _, stats in results], len(trains_to_plan))
+        return [chosen[t['id']] for t in trains_to_plan if t['id'] in chosen]
+
+    def train_priority(self, train, current_time, current_priorities):
+        """Objective weight of a waiting train (CP-SAT model and greedy order)."""
+        # determine dynamic priority value
+        # 1) base type priority
+        base_priority = self.priorities.get(train.get('type'), 1) if current_priorities.get('trainType') else 1
+        # 2) traineruntime boost if present (the simulation may pass it in 'dynamic_priority')
+        runtime_boost = int(train.get('dynamic_priority', 0))
+        # 3) punctuality boost if enabled
+        punctuality_boost = 0
+        if current_priorities.get('punctuality'):
+            scheduled = train.get('scheduled_arrival')
+            if scheduled is not None:
+                lateness = int(current_time - scheduled)
+                if lateness > 0:
+                    punctuality_boost = int(lateness / 60)
+
+        priority = base_priority + runtime_boost + punctuality_boost
+
+        # safety clamp
+        if priority < 1: priority = 1
+        return priority
+
+    def _progress_reporters(self, count, trains_to_plan, on_progress):
+        """
+        One report(plan, objective, bound) per component; each merges the newest solution of every
+        component that has one and passes the result on as on_progress(plan, objective, gap).
+        """
+        if on_progress is None:
+            return [None] * count
+        order = {t['id']: i for i, t in enumerate(trains_to_plan)}
+        latest = {}
+        lock = threading.Lock()
+
+        def reporter(index):
+            def report(plan, objective, bound):
+                with lock:
+                    latest[index] = (plan, objective, bound)
+                    merged = sorted((ins for p, _, _ in latest.values() for ins in p), key=lambda ins: order[ins['trainId']])
+                    total = sum(o for _, o, _ in latest.values())
+                    on_progress(merged, total, relative_gap(total, sum(b for _, _, b in latest.values())))
+            return report
+        return [reporter(i) for i in range(count)]
+
+    def _fixed_reservations(self, all_active_trains, current_time):
+        """resource id -> [(start, duration, name)] of RUNNING trains over the rest of their routes."""
+        fixed = {}
         for train in all_active_trains:
             if train['state'] != 'RUNNING' or not train.get('route'):
                 continue
@@ -45,74 +212,215 @@ class Optimizer:
 
             start_time = int(current_time)
             end_time = start_time + remaining_time_on_segment
-            interval = model.NewIntervalVar(start_time, remaining_time_on_segment, end_time, f"fixed_i_{train['id']}_{train['currentSegmentId']}")
-            if train['currentSegmentId'] not in resource_intervals: resource_intervals[train['currentSegmentId']] = []
-            resource_intervals[train['currentSegmentId']].append(interval)
+            fixed.setdefault(train['currentSegmentId'], []).append(
+                (start_time, remaining_time_on_segment, f"fixed_i_{train['id']}_{train['currentSegmentId']}"))
 
             previous_end_time = end_time
             current_route_index = train['route'].index(train['currentSegmentId'])
             future_segments = train['route'][current_route_index + 1:]
-            node_path = self.simulation._convert_segment_path_to_node_path(train['route'])
+            node_path = self.simulation.graph.node_path(train['route'])
 
             for i, segment_id in enumerate(future_segments):
                 junction_occupancy_time = 10
                 j_start = previous_end_time
-                j_end = j_start + junction_occupancy_time
                 junction_node_id = node_path[current_route_index + i + 1]
-                j_interval = model.NewIntervalVar(j_start, junction_occupancy_time, j_end, f"fixed_ji_{train['id']}_{junction_node_id}")
-                if junction_node_id not in resource_intervals: resource_intervals[junction_node_id] = []
-                resource_intervals[junction_node_id].append(j_interval)
+                fixed.setdefault(junction_node_id, []).append((j_start, junction_occupancy_time, f"fixed_ji_{train['id']}_{junction_node_id}"))
+
+                start = j_start + junction_occupancy_time
+                fixed.setdefault(segment_id, []).append((start, travel_time_per_segment, f"fixed_i_{train['id']}_{segment_id}"))
+                previous_end_time = start + travel_time_per_segment
+        return fixed
+
+    def _plan_component(self, trains_to_plan, possible_routes, fixed, current_time, current_priorities,
+                        num_workers, report=None):
+        """
+        Plan one group of conflicting trains: the greedy dispatcher alone when the group is small or
+        its plan is provably optimal, else the plan cache's answer for the same situation, else CP-SAT
+        with the greedy plan as the fallback.
+        """
+        started = time.perf_counter()
+        fast = greedy.plan(trains_to_plan, possible_routes, self.simulation.graph.node_path, fixed, current_time,
+                           lambda t: self.train_priority(t, current_time, current_priorities))
+        greedy_seconds = time.perf_counter() - started
+        plan, solution, objective, bound = fast
+        if len(trains_to_plan) <= GREEDY_MAX_TRAINS or objective == bound:
+            stats = self._greedy_stats(fast, len(trains_to_plan), greedy_seconds, 'greedy')
+            self._print_plan(plan, trains_to_plan, f"greedy, {stats['status']}")
+            return plan, solution, stats
+
+        weights = {t['id']: self.train_priority(t, current_time, current_priorities) for t in trains_to_plan}
+        key, order = signature(self.simulation.section_code, trains_to_plan, possible_routes,
+                               self.simulation.graph.node_path, weights, fixed, self.simulation.segments_map,
+                               current_priorities, current_time)
+        cached = self.plan_cache.lookup(key, trains_to_plan, order, possible_routes, self.simulation.graph.node_path,
+                                        fixed, current_time)
+        if cached is not None:
+            return self._cached_result(cached, trains_to_plan, weights, current_time, time.perf_counter() - started)
+
+        if report is not None:
+            # something to act on while CP-SAT builds and presolves; the gap is against the greedy bound
+            report(plan, objective, bound)
+        # CP-SAT starts from the greedy plan, so it begins at least that good
+        result = self._solve_component(trains_to_plan, possible_routes, fixed, current_time, current_priorities,
+                                       num_workers, report, seed=solution)
+        if result[0] and result[2]['objective'] <= objective:
+            if result[2]['status'] == 'OPTIMAL':
+                self.plan_cache.store(key, 'OPTIMAL', trains_to_plan, order, result[1], current_time)
+            return result
+        # CP-SAT found nothing (infeasible model, time limit) or worse: dispatch by priority rules instead
+        stats = self._greedy_stats(fast, len(trains_to_plan), greedy_seconds, 'greedy-fallback', result[2])
+        self._print_plan(plan, trains_to_plan, f"greedy fallback after CP-SAT {result[2]['status']}")
+        return plan, solution, stats
+
+    def _cached_result(self, cached, trains_to_plan, weights, current_time, seconds):
+        """(plan, solution, stats) of a group answered from the plan cache."""
+        status, solution = cached
+        current_time = int(current_time)
+        plan = [{
+            "trainId": t['id'],
+            "action": "PROCEED" if solution[t['id']]['starts'][0] <= current_time else "HOLD",
+            "route": solution[t['id']]['route'],
+            "startTime": solution[t['id']]['starts'][0],
+        } for t in trains_to_plan]
+        objective = sum(weights[tid] * (planned['starts'][-1] + 40) for tid, planned in solution.items())
+        stats = {
+            'method': 'cached',
+            'status': status,
+            'trains': len(trains_to_plan),
+            'hinted': 0,
+            'variables': 0,
+            'constraints': 0,
+            'horizon': None,
+            'build_seconds': 0.0,
+            'presolve_seconds': None,
+            'solve_seconds': round(seconds, 4),
+            'first_feasible_seconds': round(seconds, 4),
+            'optimal_seconds': round(seconds, 4) if status == 'OPTIMAL' else None,
+            'best_found_seconds': round(seconds, 4),
+            'solutions': 1,
+            'objective': float(objective),
+        }
+        self._print_plan(plan, trains_to_plan, f"plan cache, {status}")
+        return plan, solution, stats
+
+    def _greedy_stats(self, fast, trains, seconds, method, cp_stats=None):
+        plan, _, objective, bound = fast
+        stats = {
+            'method': method,
+            'status': 'OPTIMAL' if objective == bound else 'FEASIBLE',
+            'trains': trains,
+            'hinted': 0,
+            'variables': 0,
+            'constraints': 0,
+            'horizon': None,
+            'build_seconds': 0.0,
+            'presolve_seconds': None,
+            'solve_seconds': round(seconds, 4),
+            'first_feasible_seconds': round(seconds, 4),
+            'optimal_seconds': round(seconds, 4) if objective == bound else None,
+            'best_found_seconds': round(seconds, 4),
+            'solutions': 1,
+            'objective': float(objective),
+        }
+        if cp_stats is not None:
+            # the CP-SAT attempt's time counts; its status is kept for the record
+            stats['cp_sat_status'] = cp_stats['status']
+            for key in ('build_seconds', 'solve_seconds'):
+                stats[key] = round(stats[key] + cp_stats[key], 4)
+            stats['first_feasible_seconds'] = stats['best_found_seconds'] = stats['solve_seconds']
+            stats['optimal_seconds'] = None
+            for key in ('hinted', 'variables', 'constraints', 'horizon', 'presolve_seconds'):
+                stats[key] = cp_stats[key]
+        return stats
+
+    def _print_plan(self, plan, trains_to_plan, how):
+        types = {t['id']: t.get('type') for t in trains_to_plan}
+        for instruction in plan:
+            print(f"  -> Plan for {instruction['trainId']}: {instruction['action']} starting {instruction['route'][0]} "
+                  f"@ {instruction['startTime']} (priority approx {self.priorities.get(types[instruction['trainId']], 1)}, {how})")
+
+    def _solve_component(self, trains_to_plan, possible_routes, fixed, current_time, current_priorities,
+                         num_workers, report=None, seed=None):
+        """Build and solve the model of one group of conflicting trains. Returns (plan, solution, stats)."""
+        build_started = time.perf_counter()
+        model = cp_model.CpModel()
+
+        current_time = int(current_time)
+        max_time = current_time + self._horizon(trains_to_plan, possible_routes, fixed, current_time)
+        # a train alone among the running trains' reservations: no plan can run any of its segments earlier
+        alone = greedy.Timetable(fixed)
 
-                start = j_end
-                end = start + travel_time_per_segment
-                interval = model.NewIntervalVar(start, travel_time_per_segment, end, f"fixed_i_{train['id']}_{segment_id}")
-                if segment_id not in resource_intervals: resource_intervals[segment_id] = []
-                resource_intervals[segment_id].append(interval)
-                previous_end_time = end
+        tasks = {}
+        route_choices = {}
+        resource_intervals = {}
+        segment_starts = {}  # (train_id, route index) -> start vars of its segments
+        route_ends = {}      # train_id -> [(choice var, end expr of the route's last junction)]
+        hinted = {}  # train_id -> hinted completion time (from the greedy plan, if given)
 
         # --- Step 2: Decision variables for trains WAITING_PLAN ---
+        # one start variable per segment; segment and junction ends are affine in it (30 s segment, then
+        # the junction for 10 s), and every start is bounded by route position and the running trains
         for train in trains_to_plan:
-            train['possible_routes'] = self.simulation.find_all_possible_routes(train['start_node'], train['end_node'])
-            if not train['possible_routes']:
-                print(f"⚠️ No routes found for train {train['id']}. It will remain waiting.")
-                continue
-
             train_id = train['id']
             route_choices[train_id] = []
+            route_ends[train_id] = []
+            hint = self._hint_for(seed.get(train_id), possible_routes[train_id]) if seed is not None else None
 
-            for i, route in enumerate(train['possible_routes']):
+            for i, route in enumerate(possible_routes[train['id']]):
                 choice_var = model.NewBoolVar(f'{train_id}_chooses_route_{i}')
                 route_choices[train_id].append(choice_var)
-
-                previous_end = model.NewIntVar(current_time, max_time, f'{train_id}_r{i}_start')
-
-                node_path = self.simulation._convert_segment_path_to_node_path(route)
+                segment_starts[(train_id, i)] = []
+
+                node_path = self.simulation.graph.node_path(route)
+                earliest = greedy.route_timing(alone, route, node_path, current_time)
+                if earliest[-1] + 40 > max_time:
+                    # cannot finish inside the horizon even alone
+                    model.Add(choice_var == 0)
+                previous_end = None
                 for seg_idx, segment_id in enumerate(route):
                     travel_time = 30
-                    start = model.NewIntVar(current_time, max_time, f's_{train_id}_{i}_{seg_idx}')
-                    end = model.NewIntVar(current_time, max_time, f'e_{train_id}_{i}_{seg_idx}')
-                    interval = model.NewOptionalIntervalVar(start, travel_time, end, choice_var, f'i_{train_id}_{i}_{seg_idx}')
+                    latest = max(earliest[seg_idx], max_time - 40 * (len(route) - seg_idx))
+                    start = model.NewIntVar(earliest[seg_idx], latest, f's_{train_id}_{i}_{seg_idx}')
+                    interval = model.NewOptionalIntervalVar(start, travel_time, start + travel_time, choice_var, f'i_{train_id}_{i}_{seg_idx}')
+                    segment_starts[(train_id, i)].append(start)
 
                     if segment_id not in resource_intervals: resource_intervals[segment_id] = []
                     resource_intervals[segment_id].append(interval)
 
                     tasks[(train_id, segment_id, i)] = interval
-                    model.Add(start >= previous_end)
+                    if previous_end is not None:
+                        model.Add(start >= previous_end)
 
                     junction_node = node_path[seg_idx + 1]
-                    j_start = end
                     j_duration = 10
-                    j_end = model.NewIntVar(current_time, max_time, f'je_{train_id}_{i}_{seg_idx}')
-                    j_interval = model.NewOptionalIntervalVar(j_start, j_duration, j_end, choice_var, f'ji_{train_id}_{i}_{seg_idx}')
+                    j_interval = model.NewOptionalIntervalVar(start + travel_time, j_duration, start + travel_time + j_duration,
+                                                              choice_var, f'ji_{train_id}_{i}_{seg_idx}')
 
                     if junction_node not in resource_intervals: resource_intervals[junction_node] = []
                     resource_intervals[junction_node].append(j_interval)
 
                     tasks[(train_id, junction_node, i)] = j_interval
-                    previous_end = j_end
-
-            if route_choices.get(train_id):
-                model.Add(sum(route_choices[train_id]) == 1)
+                    previous_end = start + travel_time + j_duration
+                route_ends[train_id].append((choice_var, previous_end, earliest[-1] + 40))
+
+                if hint is not None:
+                    chosen = i == hint['index']
+                    model.AddHint(choice_var, chosen)
+                    if chosen:
+                        # a complete assignment, so CP-SAT can take it as its first solution
+                        for start, value in zip(segment_starts[(train_id, i)], hint['starts']):
+                            model.AddHint(start, value)
+
+            model.Add(sum(route_choices[train_id]) == 1)
+            if hint is not None:
+                hinted[train_id] = hint['starts'][-1] + 40
+
+        # running trains' reservations on the resources this group can use; projections of two running
+        # trains may overlap each other (the simulation does not keep to this timing), so each resource
+        # gets the union of its reservations, else NoOverlap would make the whole group infeasible
+        for resource_id in resource_intervals:
+            for k, (start, end) in enumerate(merged_reservations(fixed.get(resource_id, ()))):
+                resource_intervals[resource_id].append(model.NewIntervalVar(start, end - start, end, f'fixed_{resource_id}_{k}'))
 
         # --- Step 3: No-overlap constraints ---
         for resource_id, intervals in resource_intervals.items():
@@ -122,38 +430,16 @@ class Optimizer:
         # --- Step 4: Objective - Minimize weighted completion times using dynamic priorities ---
         total_weighted_completion = []
         for train in trains_to_plan:
-            if train['id'] not in route_choices: continue
-
-            train_end_times = []
-            for i, route in enumerate(train['possible_routes']):
-                last_node = self.simulation._convert_segment_path_to_node_path(route)[-1]
-                if (train['id'], last_node, i) in tasks:
-                    train_end_times.append(tasks[(train['id'], last_node, i)].EndExpr())
-
-            if train_end_times:
-                train_end = model.NewIntVar(current_time, max_time, f"{train['id']}_end")
-                model.AddMaxEquality(train_end, train_end_times)
-
-                # determine dynamic priority value
-                # 1) base type priority
-                base_priority = self.priorities.get(train.get('type'), 1) if current_priorities.get('trainType') else 1
-                # 2) traineruntime boost if present (the simulation may pass it in 'dynamic_priority')
-                runtime_boost = int(train.get('dynamic_priority', 0))
-                # 3) punctuality boost if enabled
-                punctuality_boost = 0
-                if current_priorities.get('punctuality'):
-                    scheduled = train.get('scheduled_arrival')
-                    if scheduled is not None:
-                        lateness = int(current_time - scheduled)
-                        if lateness > 0:
-                            punctuality_boost = int(lateness / 60)
-
-                priority = base_priority + runtime_boost + punctuality_boost
-
-                # safety clamp
-                if priority < 1: priority = 1
-
-                total_weighted_completion.append(train_end * priority)
+            ends = route_ends[train['id']]
+            # completion is the chosen route's last junction end (minimisation makes the bound tight)
+            train_end = model.NewIntVar(min(lo for _, _, lo in ends), max_time, f"{train['id']}_end")
+            for choice_var, end, _ in ends:
+                model.Add(train_end >= end).OnlyEnforceIf(choice_var)
+            if train['id'] in hinted:
+                model.AddHint(train_end, hinted[train['id']])
+
+            priority = self.train_priority(train, current_time, current_priorities)
+            total_weighted_completion.append(train_end * priority)
 
         if total_weighted_completion:
             model.Minimize(sum(total_weighted_completion))
@@ -161,29 +447,133 @@ class Optimizer:
         # --- Step 5: Solve ---
         solver = cp_model.CpSolver()
         solver.parameters.max_time_in_seconds = 10.0
-        status = solver.Solve(model)
-        print(f"🧠 Optimizer: Solver finished with status: {solver.StatusName(status)}")
-
-        # --- Step 6: Extract plan ---
+        if num_workers:
+            solver.parameters.num_workers = num_workers
+        extract = lambda value: self._extract_plan(value, trains_to_plan, route_choices, possible_routes, tasks,
+                                                   segment_starts, current_time)
+        progress = SolveProgress(None if report is None else
+                                 lambda cb: report(extract(cb.Value)[0], cb.ObjectiveValue(), cb.BestObjectiveBound()))
+        build_seconds = time.perf_counter() - build_started
+        presolve_seconds = self._presolve_seconds(model, num_workers) if self.measure_presolve else None
+        status = solver.Solve(model, progress)
+        stats = self._component_stats(solver, status, progress, build_seconds, len(route_choices), len(hinted), model,
+                                      max_time - current_time, presolve_seconds)
+        print(f"🧠 Optimizer: Solver finished with status: {stats['status']} "
+              f"(first feasible {stats['first_feasible_seconds']}s, optimal {stats['optimal_seconds']}s)")
+
+        # --- Extract the group's plan ---
+        plan, solution = [], {}
         if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
-            plan = []
-            for train in trains_to_plan:
-                if train['id'] not in route_choices: continue
-                for i, choice_var in enumerate(route_choices[train['id']]):
-                    if solver.Value(choice_var) == 1:
-                        chosen_route = train['possible_routes'][i]
-                        first_segment = chosen_route[0]
-                        start_time = solver.Value(tasks[(train['id'], first_segment, i)].StartExpr())
-
-                        action = "PROCEED" if start_time <= current_time else "HOLD"
-
-                        plan.append({
-                            "trainId": train['id'],
-                            "action": action,
-                            "route": chosen_route,
-                            "startTime": start_time
-                        })
-                        print(f"  -> Plan for {train['id']}: {action} starting {first_segment} @ {start_time} (priority approx {self.priorities.get(train['type'], 1)})")
-                        break
-            return plan
-        return []
+            plan, solution = extract(solver.Value)
+            self._print_plan(plan, trains_to_plan, 'CP-SAT')
+        return plan, solution, stats
+
+    def _extract_plan(self, value, trains_to_plan, route_choices, possible_routes, tasks, segment_starts, current_time):
+        """Plan instructions and solution (route, segment starts) from a solver assignment (`value` is Solver.Value or a callback's)."""
+        plan, solution = [], {}
+        for train in trains_to_plan:
+            for i, choice_var in enumerate(route_choices[train['id']]):
+                if value(choice_var) == 1:
+                    chosen_route = possible_routes[train['id']][i]
+                    first_segment = chosen_route[0]
+                    start_time = value(tasks[(train['id'], first_segment, i)].StartExpr())
+                    solution[train['id']] = {
+                        'route': list(chosen_route),
+                        'starts': [value(v) for v in segment_starts[(train['id'], i)]],
+                    }
+
+                    action = "PROCEED" if start_time <= current_time else "HOLD"
+
+                    plan.append({
+                        "trainId": train['id'],
+                        "action": action,
+                        "route": chosen_route,
+                        "startTime": start_time
+                    })
+                    break
+        return plan, solution
+
+    def _horizon(self, trains_to_plan, possible_routes, fixed, current_time):
+        """
+        Seconds past now the model has to cover: the running trains' last reservation, then every
+        waiting train one after another on its longest candidate route. Some optimal plan always
+        fits (a train finishing later could be moved behind all the others and finish earlier), so
+        this only cuts dead search space; capped at the old fixed two hours.
+        """
+        fixed_end = max((start + duration for intervals in fixed.values() for start, duration, _ in intervals),
+                        default=current_time)
+        serial = max(fixed_end, current_time) - current_time
+        serial += sum(40 * max(len(route) for route in possible_routes[t['id']]) for t in trains_to_plan)
+        return min(7200, serial)
+
+    @staticmethod
+    def _hint_for(planned, routes):
+        """A train's greedy plan mapped onto this model's route indices."""
+        if planned is None or planned['route'] not in routes:
+            return None
+        return {'index': routes.index(planned['route']), 'starts': planned['starts']}
+
+    def _presolve_seconds(self, model, num_workers):
+        """Wall time CP-SAT spends presolving `model` (a separate solve that stops after presolve)."""
+        probe = cp_model.CpSolver()
+        probe.parameters.stop_after_presolve = True
+        if num_workers:
+            probe.parameters.num_workers = num_workers
+        probe.Solve(model)
+        return round(probe.WallTime(), 4)
+
+    def _component_stats(self, solver, status, progress, build_seconds, trains, hinted, model, horizon,
+                         presolve_seconds=None):
+        proto = model.Proto()
+        return {
+            'method': 'cp-sat',
+            'status': solver.StatusName(status),
+            'trains': trains,
+            'hinted': hinted,
+            'variables': len(proto.variables),
+            'constraints': len(proto.constraints),
+            'horizon': horizon,
+            'build_seconds': round(build_seconds, 4),
+            'presolve_seconds': presolve_seconds,
+            'solve_seconds': round(solver.WallTime(), 4),
+            'first_feasible_seconds': None if progress.first_feasible is None else round(progress.first_feasible, 4),
+            # CP-SAT proves optimality at the end of the search; the last improvement is when it had the optimum
+            'optimal_seconds': round(solver.WallTime(), 4) if status == cp_model.OPTIMAL else None,
+            'best_found_seconds': None if progress.last_improvement is None else round(progress.last_improvement, 4),
+            'solutions': progress.solutions,
+            'objective': solver.ObjectiveValue() if status in (cp_model.OPTIMAL, cp_model.FEASIBLE) else None,
+        }
+
+    def _merge_stats(self, component_stats, requested):
+        """last_stats of a (possibly decomposed) solve: components ran side by side, so times are maxima."""
+        if not component_stats:
+            self.last_stats = None
+            return
+        status = min((s['status'] for s in component_stats), key=STATUS_ORDER.index)
+        latest = lambda key: None if any(s[key] is None for s in component_stats) else max(s[key] for s in component_stats)
+        self.last_stats = {
+            'status': status,
+            'requested': requested,
+            'trains': sum(s['trains'] for s in component_stats),
+            'hinted': sum(s['hinted'] for s in component_stats),
+            'components': len(component_stats),
+            'variables': sum(s['variables'] for s in component_stats),
+            'constraints': sum(s['constraints'] for s in component_stats),
+            'largest_component': max(s['trains'] for s in component_stats),
+            'build_seconds': round(sum(s['build_seconds'] for s in component_stats), 4),
+            # only components CP-SAT ran for have one, and only when measure_presolve is on
+            'presolve_seconds': max((s['presolve_seconds'] for s in component_stats if s['presolve_seconds'] is not None),
+                                    default=None),
+            'solve_seconds': max(s['solve_seconds'] for s in component_stats),
+            'first_feasible_seconds': latest('first_feasible_seconds'),
+            'optimal_seconds': latest('optimal_seconds'),
+            'best_found_seconds': latest('best_found_seconds'),
+            'solutions': sum(s['solutions'] for s in component_stats),
+            'objective': None if any(s['objective'] is None for s in component_stats) else sum(s['objective'] for s in component_stats),
+            'methods': {m: sum(1 for s in component_stats if s['method'] == m) for m in sorted({s['method'] for s in component_stats})},
+            # worst status CP-SAT itself returned (a greedy fallback's own status hides it); None if it never ran
+            'cp_sat_status': min((s['status'] if s['method'] == 'cp-sat' else s['cp_sat_status'] for s in component_stats
+                                  if s['method'] == 'cp-sat' or 'cp_sat_status' in s), key=STATUS_ORDER.index, default=None),
+            'by_component': [{k: s[k] for k in ('method', 'status', 'trains', 'solve_seconds', 'objective')} for s in component_stats],
+            'plan_cache': self.plan_cache.stats(),
+        }
@@ -0,0 +1,89 @@
+import heapq
+import math
+
+
+def astar(graph, start, goal, heuristic, allowed, banned_nodes=(), banned_edges=()):
+    """
+    A* over a CompiledGraph using int node / segment indices. heuristic is a per-node list,
+    allowed a per-segment mask. Returns (cost, node_path, segment_path) or None.
+    banned_nodes / banned_edges are Yen's spur restrictions.
+    """
+    if start == goal:
+        return (0.0, [start], [])
+    adjacency = graph.adjacency
+    cost = graph.cost
+    seq = 0
+    open_heap = [(heuristic[start], seq, 0.0, start)]
+    best = {start: 0.0}
+    came_from = {}  # node -> (prev_node, segment)
+    closed = set()
+    while open_heap:
+        _, _, g, node = heapq.heappop(open_heap)
+        if node in closed:
+            continue
+        if node == goal:
+            nodes, segs = [goal], []
+            while nodes[-1] != start:
+                prev, seg = came_from[nodes[-1]]
+                nodes.append(prev)
+                segs.append(seg)
+            nodes.reverse()
+            segs.reverse()
+            return (g, nodes, segs)
+        closed.add(node)
+        for nxt, seg in adjacency[node]:
+            if nxt in closed or not allowed[seg] or nxt in banned_nodes or seg in banned_edges:
+                continue
+            ng = g + cost[seg]
+            if ng < best.get(nxt, math.inf):
+                best[nxt] = ng
+                came_from[nxt] = (node, seg)
+                seq += 1
+                heapq.heappush(open_heap, (ng + heuristic[nxt], seq, ng, nxt))
+    return None
+
+
+def k_shortest_paths(graph, start, goal, k, allowed):
+    """
+    Yen's algorithm: up to k loopless paths from start to goal in increasing cost order.
+    Returns a list of (cost, node_path, segment_path) in int indices.
+    """
+    heuristic = graph.heuristic_to(goal)
+    first = astar(graph, start, goal, heuristic, allowed)
+    if first is None:
+        return []
+    cost = graph.cost
+    accepted = [first]
+    seen = {tuple(first[2])}
+    candidates = []
+    seq = 0
+
+    while len(accepted) < k:
+        _, prev_nodes, prev_segs = accepted[-1]
+        root_cost = 0.0
+        for i in range(len(prev_nodes) - 1):
+            spur_node = prev_nodes[i]
+            root_nodes = prev_nodes[:i + 1]
+            root_segs = prev_segs[:i]
+
+            banned_edges = {
+                segs[i] for _, nodes, segs in accepted
+                if len(segs) > i and nodes[:i + 1] == root_nodes
+            }
+            banned_nodes = set(root_nodes[:-1])
+            spur = astar(graph, spur_node, goal, heuristic, allowed, banned_nodes, banned_edges)
+            if spur is not None:
+                spur_cost, spur_nodes, spur_segs = spur
+                total_segs = root_segs + spur_segs
+                key = tuple(total_segs)
+                if key not in seen:
+                    seen.add(key)
+                    seq += 1
+                    heapq.heappush(candidates, (root_cost + spur_cost, seq, root_nodes[:-1] + spur_nodes, total_segs))
+            root_cost += cost[prev_segs[i]]
+
+        if not candidates:
+            break
+        total, _, nodes, segs = heapq.heappop(candidates)
+        accepted.append((total, nodes, segs))
+    return accepted
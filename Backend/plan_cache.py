@@ -0,0 +1,150 @@
+"""
+Memo of solved planning groups, keyed by a normalised conflict signature.
+
+The same situation recurs all day (two trains on approach to the same platforms behind the same
+running trains) and CP-SAT would prove the same optimum every time. A group's signature is
+everything its model depends on, with times taken relative to now:
+- each waiting train's type, start, end, objective weight and candidate routes
+- the running trains' reservations on the resources the group can use
+- the FAULTY / BAD-weather segments among those resources
+- the AI priority flags
+
+Trains are listed in a canonical order, so an entry does not depend on train ids. An entry keeps
+each slot's route and segment start offsets. lookup() re-times them to the current clock and checks
+them against the reservations again before handing the plan out. Only plans CP-SAT proved optimal
+are stored: a time-limited result or a greedy fallback would stop the situation from ever being
+solved properly again.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import greedy
+
+PLAN_CACHE_ENTRIES = int(os.environ.get('FLOWSTATE_PLAN_CACHE', '256'))  # 0 disables the cache
+
+
+def signature(section, trains, possible_routes, node_path, weights, fixed, segments_map, priorities, current_time):
+    """(key, order): the group's signature and the indices of `trains` in the key's slot order."""
+    current_time = int(current_time)
+    slots = sorted(((t.get('type') or '', t['start_node'], t['end_node'], weights[t['id']],
+                     tuple(tuple(route) for route in possible_routes[t['id']])), k) for k, t in enumerate(trains))
+    resources = set()
+    for train in trains:
+        for route in possible_routes[train['id']]:
+            resources.update(route)
+            resources.update(node_path(route)[1:])
+    occupied = tuple(sorted((resource, start - current_time, duration)
+                            for resource in resources for start, duration, _ in fixed.get(resource, ())))
+    faulty = tuple(sorted(r for r in resources if segments_map.get(r, {}).get('status') == 'FAULTY'))
+    bad_weather = tuple(sorted(r for r in resources if segments_map.get(r, {}).get('weather') == 'BAD'))
+    flags = tuple(sorted((name, bool(on)) for name, on in priorities.items()))
+    key = (section, tuple(slot for slot, _ in slots), occupied, faulty, bad_weather, flags)
+    return key, [k for _, k in slots]
+
+
+class PlanCache:
+    """
+    LRU of signature -> (status, [(route, start offsets)] per slot), with hit-rate counters. Locked:
+    the Optimizer plans independent groups on parallel threads.
+    """
+
+    def __init__(self, max_entries=PLAN_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.stored = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, key, trains, order, possible_routes, node_path, fixed, current_time):
+        """
+        The cached solution for `key` re-timed to current_time, as (status, solution) with solution
+        train_id -> {'route', 'starts'}; None on a miss or when it no longer fits the reservations.
+        """
+        if not self.max_entries:
+            return None
+        with self._lock:
+            return self._lookup(key, trains, order, possible_routes, node_path, fixed, current_time)
+
+    def _lookup(self, key, trains, order, possible_routes, node_path, fixed, current_time):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        status, slots = entry
+        current_time = int(current_time)
+        timetable = greedy.Timetable(fixed)
+        solution = {}
+        for k, (route, offsets) in zip(order, slots):
+            train = trains[k]
+            starts = [current_time + offset for offset in offsets]
+            if list(route) not in [list(r) for r in possible_routes[train['id']]] or \
+                    not _fits(timetable, route, node_path(list(route)), starts, current_time):
+                del self._entries[key]
+                self.rejected += 1
+                self.misses += 1
+                return None
+            solution[train['id']] = {'route': list(route), 'starts': starts}
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return status, solution
+
+    def store(self, key, status, trains, order, solution, current_time):
+        if not self.max_entries:
+            return
+        current_time = int(current_time)
+        slots = []
+        for k in order:
+            planned = solution.get(trains[k]['id'])
+            if planned is None:
+                return  # a partial solution is not worth remembering
+            slots.append((tuple(planned['route']), tuple(t - current_time for t in planned['starts'])))
+        with self._lock:
+            self._entries[key] = (status, tuple(slots))
+            self._entries.move_to_end(key)
+            self.stored += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'entries': len(self._entries),
+            'stored': self.stored,
+            'rejected': self.rejected,
+            'evictions': self.evictions,
+        }
+
+
+def _fits(timetable, route, node_path, starts, current_time):
+    """Check a re-timed route against the timetable and reserve it if it fits (CP-SAT's timing model)."""
+    if len(starts) != len(route):
+        return False
+    ready = current_time
+    for segment_id, junction, start in zip(route, node_path[1:], starts):
+        if start < ready:
+            return False
+        if timetable.earliest(segment_id, start, greedy.SEGMENT_SECONDS) != start:
+            return False
+        j_start = start + greedy.SEGMENT_SECONDS
+        if timetable.earliest(junction, j_start, greedy.JUNCTION_SECONDS) != j_start:
+            return False
+        ready = j_start + greedy.JUNCTION_SECONDS
+    for segment_id, junction, start in zip(route, node_path[1:], starts):
+        timetable.reserve(segment_id, start, greedy.SEGMENT_SECONDS)
+        timetable.reserve(junction, start + greedy.SEGMENT_SECONDS, greedy.JUNCTION_SECONDS)
+    return True
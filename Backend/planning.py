@@ -0,0 +1,175 @@
+"""
+Off-loop planning: the live server solves in worker processes while the section keeps ticking.
+
+A PlanningContext is everything a solve needs, in picklable form: a Simulation.fork() of the
+section, the ids of the trains to plan, the AI priorities and the Simulation.state_version it was
+taken at. solve() runs in a worker and returns a PlanResult carrying that version. When the result
+comes back, apply_solved_plan() fits it to the current state: a plan solved against the current
+version is applied as is; an older one is re-validated instruction by instruction (train still
+waiting, route still clear of FAULTY / closed BAD-weather segments) and the section re-plans for
+whatever was dropped. A request superseded before a solver slot picked it up is cancelled instead
+(PlanJob.cancel).
+
+Anytime plans: a context with a `progress` queue (a multiprocessing.Manager queue, so it crosses the
+process boundary) gets every improving CP-SAT solution as (plan, objective, gap, elapsed) while the
+solve runs. The loop applies the first good-enough one provisionally (PlanJob.take_provisional);
+later ones, and the final plan, may still re-route trains that have not departed.
+"""
+import multiprocessing
+import os
+import time
+
+from optimizer import Optimizer
+
+# a provisional plan is good enough once its optimality gap is this small, or the solve has run this long
+PROVISIONAL_GAP = float(os.environ.get('FLOWSTATE_PROVISIONAL_GAP', '0.25'))
+PROVISIONAL_AFTER = float(os.environ.get('FLOWSTATE_PROVISIONAL_AFTER', '1.0'))
+
+_optimizers = {}  # per worker process: num_workers -> Optimizer (re-pointed at each context's fork)
+_manager = None
+
+
+def progress_queue():
+    """A queue solver workers can put provisional plans on (one Manager process, started on first use)."""
+    global _manager
+    if _manager is None:
+        _manager = multiprocessing.Manager()
+    return _manager.Queue()
+
+
+class PlanningContext:
+    """Picklable input of one solve."""
+
+    def __init__(self, sim, trains, priorities, num_workers=None, progress=None):
+        self.section = sim.section_code
+        self.version = sim.state_version
+        self.sim = sim.fork()
+        self.train_ids = [t['id'] for t in trains]
+        self.priorities = dict(priorities)
+        self.num_workers = num_workers
+        self.progress = progress
+
+
+class PlanResult:
+    def __init__(self, version, plan, solve_seconds, stats=None):
+        self.version = version
+        self.plan = plan
+        self.solve_seconds = solve_seconds
+        self.stats = stats
+
+
+def solve(context):
+    """Worker entry point: plan the context's trains on its fork."""
+    optimizer = _optimizers.get(context.num_workers)
+    if optimizer is None:
+        optimizer = _optimizers[context.num_workers] = Optimizer(context.sim, num_workers=context.num_workers)
+    optimizer.simulation = context.sim
+    trains = [context.sim.trains.get(tid) for tid in context.train_ids if tid in context.sim.trains]
+    started = time.perf_counter()
+    on_progress = None
+    if context.progress is not None:
+        on_progress = lambda plan, objective, gap: context.progress.put((plan, objective, gap, time.perf_counter() - started))
+    plan = optimizer.generate_plan(trains, context.sim.get_state(), context.priorities, on_progress=on_progress)
+    return PlanResult(context.version, plan, time.perf_counter() - started, optimizer.last_stats)
+
+
+class PlanJob:
+    """One in-flight solve of a live section: the version and loop step it was requested at, and its task."""
+
+    def __init__(self, version, step=None, progress=None):
+        self.version = version
+        self.step = step
+        self.task = None
+        self.started = False  # set once a solver slot picked the job up; after that it runs to completion
+        self.progress = progress
+        self.provisional = None  # newest (plan, objective, gap, elapsed) received
+        self.provisional_applied = False
+
+    def mark_started(self):
+        self.started = True
+
+    def done(self):
+        return self.task is not None and self.task.done()
+
+    def poll_progress(self):
+        """Drain the progress queue; returns the newest provisional update, or None if nothing new arrived."""
+        newest = None
+        while self.progress is not None:
+            try:
+                newest = self.progress.get_nowait()
+            except Exception:  # queue.Empty, or the manager went away at shutdown
+                break
+        if newest is not None:
+            self.provisional = newest
+        return newest
+
+    def take_provisional(self):
+        """The newest provisional plan if it is good enough to act on, else None."""
+        if self.provisional is None:
+            return None
+        plan, _, gap, elapsed = self.provisional
+        if self.provisional_applied or gap <= PROVISIONAL_GAP or elapsed >= PROVISIONAL_AFTER:
+            self.provisional_applied = True
+            return plan
+        return None
+
+    def cancel(self):
+        """Cancel if no solver has started on it yet. Returns True when cancelled."""
+        if self.started or self.task is None:
+            return False
+        self.task.cancel()
+        return True
+
+
+def route_still_valid(sim, train, route):
+    if not route:
+        return False
+    node_path = sim.graph.node_path(route)
+    if not node_path or node_path[0] != train.get('start_node'):
+        return False
+    weather_on = sim.current_ai_priorities.get('weather')
+    for seg_id in route:
+        seg = sim.segments_map.get(seg_id)
+        if seg is None or seg.get('status') == 'FAULTY':
+            return False
+        if weather_on and seg.get('weather') == 'BAD':
+            return False
+    return True
+
+
+def reconcile(sim, plan, version):
+    """
+    The part of `plan` (solved against state `version`) that still holds now. Stale instructions
+    are dropped and the simulation is asked to re-plan. Returns (plan, dropped train ids).
+    """
+    if version == sim.state_version:
+        return plan, []
+    kept, dropped = [], []
+    for instruction in plan:
+        train = sim.trains.get(instruction['trainId'])
+        if train is None:
+            continue  # gone meanwhile (cannot happen to a waiting train today, but nothing to plan either)
+        if train['state'] != 'WAITING_PLAN' and not sim.plan_revisable(train):
+            continue  # departed on an earlier (provisional) plan meanwhile
+        if route_still_valid(sim, train, instruction.get('route')):
+            kept.append(instruction)
+        elif train['state'] == 'WAITING_PLAN':
+            dropped.append(instruction['trainId'])
+        # a planned train keeps its current route; dispatch reroutes it around faults
+    if dropped:
+        sim.plan_needed = True
+    return kept, dropped
+
+
+def apply_solved_plan(sim, signals, plan, version):
+    """
+    Reconcile a solver result (final or provisional) with the current state, then preset departure
+    signals and apply it; trains a provisional plan already routed are re-routed if still at their start.
+    """
+    plan, dropped = reconcile(sim, plan or [], version)
+    if dropped:
+        print(f"♻️ [{sim.section_code}] Plan from state v{version} (now v{sim.state_version}) is stale for {dropped}; re-planning them.")
+    if plan:
+        signals.preset_plan_signals(sim, plan)
+        sim.apply_plan(plan, revise=True)
+    return plan
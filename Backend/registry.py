@@ -0,0 +1,102 @@
+TRAIN_STATES = (
+    'WAITING_PLAN',
+    'READY_TO_PROCEED',
+    'RUNNING',
+    'STOPPED_AWAITING_CLEARANCE',
+    'BOARDING_PASSENGERS',
+    'EXITED',
+)
+
+
+class TrainRegistry:
+    """
+    Active trains indexed by id plus one bucket per state. Buckets are insertion-ordered
+    dicts used as ordered sets, so lookups, state queries, transitions and removals are O(1).
+    All state changes must go through set_state() to keep the buckets consistent.
+    """
+
+    def __init__(self):
+        self._by_id = {}                               # train_id -> train dict (spawn order)
+        self._buckets = {s: {} for s in TRAIN_STATES}  # state -> {train_id: train}
+        self._order = {}                               # train_id -> spawn sequence
+        self._seq = 0
+        self._list_cache = None
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def __contains__(self, train_id):
+        return train_id in self._by_id
+
+    def _bucket(self, state):
+        bucket = self._buckets.get(state)
+        if bucket is None:
+            bucket = self._buckets[state] = {}
+        return bucket
+
+    def add(self, train):
+        train_id = train['id']
+        if train_id in self._by_id:
+            self.remove(train_id)
+        self._by_id[train_id] = train
+        self._bucket(train.get('state'))[train_id] = train
+        self._order[train_id] = self._seq
+        self._seq += 1
+        self._list_cache = None
+
+    def remove(self, train_id):
+        train = self._by_id.pop(train_id, None)
+        if train is None:
+            return None
+        self._bucket(train.get('state')).pop(train_id, None)
+        self._order.pop(train_id, None)
+        self._list_cache = None
+        return train
+
+    def get(self, train_id):
+        return self._by_id.get(train_id)
+
+    def set_state(self, train, state):
+        train_id = train['id']
+        old = train.get('state')
+        if old != state and train_id in self._by_id:
+            self._bucket(old).pop(train_id, None)
+            self._bucket(state)[train_id] = train
+        train['state'] = state
+
+    def in_state(self, *states):
+        if len(states) == 1:
+            return list(self._bucket(states[0]).values())
+        result = []
+        for state in states:
+            result.extend(self._bucket(state).values())
+        return result
+
+    def count(self, state):
+        return len(self._bucket(state))
+
+    def counts(self):
+        return {s: len(self._bucket(s)) for s in TRAIN_STATES}
+
+    def order_of(self, train_id):
+        return self._order.get(train_id, 0)
+
+    def as_list(self):
+        """Trains in spawn order, as get_state() has always returned them. Treat as read-only."""
+        if self._list_cache is None:
+            self._list_cache = list(self._by_id.values())
+        return self._list_cache
+
+    def state_order(self):
+        """{state: [train_id, ...]} in bucket order (checkpoints keep it so restored queries iterate identically)."""
+        return {state: list(bucket) for state, bucket in self._buckets.items() if bucket}
+
+    def restore_state_order(self, state_order):
+        for state, ids in state_order.items():
+            bucket = self._bucket(state)
+            ordered = {tid: bucket[tid] for tid in ids if tid in bucket}
+            ordered.update(bucket)  # anything the checkpoint did not list keeps its place at the end
+            self._buckets[state] = ordered
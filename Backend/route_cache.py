@@ -0,0 +1,85 @@
+from collections import OrderedDict
+
+
+class RouteCache:
+    """
+    LRU memo for Simulation.find_all_possible_routes.
+
+    Keys are (start, end, faulty_segments, bad_weather_segments) with the two sets as
+    frozensets, so an entry is never wrong for its own key. When the network changes by
+    blocking segments only, entries computed for the previous state that avoid every newly
+    blocked segment are still exact for the new state and are re-keyed instead of recomputed;
+    the rest are dropped. Unblocking can open new paths, so nothing carries over in that case.
+    """
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> tuple of route tuples
+        self.hits = 0
+        self.misses = 0
+        self.carried = 0
+        self.invalidated = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        routes = self._entries.get(key)
+        if routes is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return routes
+
+    def put(self, key, routes):
+        self._entries[key] = tuple(tuple(r) for r in routes)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def network_changed(self, old_state, new_state):
+        """old_state/new_state are (faulty_frozenset, bad_weather_frozenset) pairs."""
+        if old_state == new_state:
+            return
+        old_faulty, old_bad = old_state
+        new_faulty, new_bad = new_state
+        if (old_faulty - new_faulty) or (old_bad - new_bad):
+            # something was unblocked: new paths may exist, previous-state entries stay under their own key
+            return
+
+        newly_blocked = (new_faulty - old_faulty) | (new_bad - old_bad)
+        affected = [k for k in self._entries if (k[2], k[3]) == old_state]
+        for key in affected:
+            routes = self._entries.pop(key)
+            if any(seg in newly_blocked for route in routes for seg in route):
+                self.invalidated += 1
+                continue
+            new_key = (key[0], key[1], new_faulty, new_bad)
+            if new_key not in self._entries:
+                self._entries[new_key] = routes
+                self.carried += 1
+
+    def copy(self):
+        """Independent cache with the same entries (stats start at zero); entries are immutable tuples."""
+        clone = RouteCache(self.max_entries)
+        clone._entries = OrderedDict(self._entries)
+        return clone
+
+    def clear(self):
+        self.invalidated += len(self._entries)
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'entries': len(self._entries),
+            'carried': self.carried,
+            'invalidated': self.invalidated,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,245 @@
+"""
+Per-section simulation sessions for the live server.
+
+A Session owns everything that used to be process-global in main.py: the Simulation, its
+in-flight plan job, delta stream, run recorder, loop task, pause flag, signal arbitration (AI flag and
+manual-override stamps), AI priorities, the signal / fault changes queued before the section was
+started, and its Socket.IO room. SessionManager maps section codes to sessions and remembers
+which section each client follows, so several sections run side by side in one server.
+
+FairScheduler shares the server between running sections. Loop iterations (tick, state sync, AI
+signal pass) take turns on the event loop, and optimizer solves run in a worker process pool
+with a bounded number of concurrent solves; in both cases the section that has used the least
+time so far goes next, so a section with a busy optimizer cannot starve another section's ticks.
+"""
+import asyncio
+import contextlib
+import heapq
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from signal_control import SignalController
+
+DEFAULT_SECTION = 'DLI'
+
+# Server-side authoritative priorities — network congestion & trackCondition are ALWAYS True.
+DEFAULT_AI_PRIORITIES = {
+    'congestion': True,       # forced ON
+    'trainType': True,
+    'punctuality': True,
+    'trackCondition': True,   # forced ON
+    'weather': False
+}
+
+
+class FairGate:
+    """
+    Admits at most `slots` holders at a time. Waiters are admitted lowest accumulated usage
+    first (ties in arrival order); a key seen for the first time starts level with the least
+    used key, so a newly started section neither jumps the queue nor waits for the others to catch up.
+    """
+
+    def __init__(self, slots=1):
+        self.slots = slots
+        self.usage = {}  # key -> seconds held so far
+        self._holders = 0
+        self._waiters = []  # heap of (usage, seq, future)
+        self._seq = itertools.count()
+
+    def _usage_of(self, key):
+        if key not in self.usage:
+            self.usage[key] = min(self.usage.values(), default=0.0)
+        return self.usage[key]
+
+    async def acquire(self, key):
+        usage = self._usage_of(key)
+        if self._holders < self.slots and not self._waiters:
+            self._holders += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (usage, next(self._seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the slot was handed over just as we were cancelled; pass it on
+                self._holders -= 1
+                self._admit()
+            raise
+
+    def release(self, key, used):
+        self.usage[key] = self._usage_of(key) + used
+        self._holders -= 1
+        self._admit()
+
+    def _admit(self):
+        while self._waiters and self._holders < self.slots:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.cancelled():
+                continue
+            self._holders += 1
+            future.set_result(None)
+
+    def forget(self, key):
+        self.usage.pop(key, None)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        await self.acquire(key)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(key, time.perf_counter() - started)
+
+
+class FairScheduler:
+    """Loop turns (one section at a time on the event loop) and solver slots (worker processes), both fair by usage."""
+
+    def __init__(self, solver_slots=None):
+        cores = os.cpu_count() or 1
+        self.solver_slots = solver_slots or int(os.environ.get('FLOWSTATE_SOLVER_SLOTS', '0')) or max(1, min(4, cores // 4))
+        # CP-SAT threads per solve, so concurrent solves never oversubscribe the machine
+        self.solver_threads = max(1, cores // self.solver_slots)
+        self.turns = FairGate(1)
+        self.solves = FairGate(self.solver_slots)
+        self._executor = None  # started on the first solve
+
+    def turn(self, section_code):
+        return self.turns.hold(section_code)
+
+    async def solve(self, section_code, fn, *args, on_start=None):
+        """
+        Run `fn(*args)` (picklable) in a worker process once this section gets a slot.
+        `on_start` is called when the slot is granted, i.e. once the job can no longer be cancelled cleanly.
+        """
+        async with self.solves.hold(section_code):
+            if on_start is not None:
+                on_start()
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.solver_slots)
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def forget(self, section_code):
+        self.turns.forget(section_code)
+        self.solves.forget(section_code)
+
+    def stats(self):
+        return {
+            'solver_slots': self.solver_slots,
+            'solver_threads': self.solver_threads,
+            'loop_seconds': {k: round(v, 3) for k, v in self.turns.usage.items()},
+            'solver_seconds': {k: round(v, 3) for k, v in self.solves.usage.items()},
+        }
+
+
+class Session:
+    """Live state of one section."""
+
+    def __init__(self, section_code, on_signal_change=None):
+        self.section_code = section_code.upper()
+        self.room = f'section:{self.section_code}'
+        self.simulation = None
+        self.plan_job = None  # planning.PlanJob while a solve is requested or running
+        self.stream = None
+        self.recorder = None  # RunRecorder while a recorded run is active
+        self.checkpoint_writer = None
+        self.task = None
+        self.pause_event = asyncio.Event()
+        self.ai_priorities = dict(DEFAULT_AI_PRIORITIES)
+        # signals set while the section is not running: signal_id -> state
+        self.pending_signal_overrides = {}
+        # tracks the UI marked FAULTY while the section is not running; applied when it starts
+        self.pending_faulty_tracks = set()
+        self.signals = SignalController(clock=self.clock, on_change=on_signal_change)
+
+    @property
+    def running(self):
+        return self.simulation is not None
+
+    @property
+    def is_optimizing(self):
+        return self.plan_job is not None
+
+    def clock(self):
+        # the manual-override grace window: real seconds whatever the sim speed, except that a recorded
+        # run stamps overrides on simulation time so its journal replays deterministically
+        if self.recorder is not None and self.simulation is not None:
+            return self.simulation.current_time_seconds
+        return time.monotonic()
+
+    @property
+    def state_room(self):
+        # initial-state / plan payloads for every follower; binary clients use the '#msgpack' variant
+        return f'{self.room}/state'
+
+    def feed_room(self, feed):
+        return f'{self.room}/{feed}'
+
+    def record_input(self, action, **fields):
+        """Journal an external input applied to the running simulation (no-op unless recording)."""
+        if self.recorder is not None:
+            self.recorder.input(action, **fields)
+
+    def checkpoint_extra(self):
+        # server-side state a restored run needs besides the simulation itself
+        return {
+            'ai_control_enabled': self.signals.ai_control_enabled,
+            # on simulation time, whichever clock this run stamps with
+            'manual_override_timestamps': self.signals.stamps_at(self.simulation.current_time_seconds),
+            'plan_in_flight': self.plan_job is not None,
+        }
+
+
+class SessionManager:
+    """Section code -> Session, plus which section each connected client follows."""
+
+    def __init__(self, on_signal_change=None, scheduler=None):
+        self.on_signal_change = on_signal_change
+        self.scheduler = scheduler or FairScheduler()
+        self.sessions = {}
+        self.client_sections = {}  # sid -> section code
+        self.last_started = None
+
+    def get(self, section_code=None, create=True):
+        code = (section_code or self.last_started or DEFAULT_SECTION).upper()
+        session = self.sessions.get(code)
+        if session is None and create:
+            session = self.sessions[code] = Session(code, on_signal_change=self.on_signal_change)
+        return session
+
+    def for_simulation(self, sim):
+        session = self.sessions.get(sim.section_code)
+        return session if session is not None and session.simulation is sim else None
+
+    def for_client(self, sid, data=None):
+        """The section a controller command targets: an explicit 'section' / 'station_code', else the client's own."""
+        code = None
+        if isinstance(data, dict):
+            code = data.get('section') or data.get('station_code')
+        return self.get(code or self.client_sections.get(sid))
+
+    def follow(self, sid, section_code):
+        self.client_sections[sid] = section_code.upper()
+
+    def drop_client(self, sid):
+        self.client_sections.pop(sid, None)
+
+    def running(self):
+        return [s for s in self.sessions.values() if s.running]
+
+    def started(self, session):
+        self.last_started = session.section_code
+
+    def stopped(self, session):
+        self.scheduler.forget(session.section_code)
+        if self.last_started == session.section_code:
+            others = self.running()
+            self.last_started = others[-1].section_code if others else None
@@ -0,0 +1,239 @@
+import time
+from eventlog import DEBUG, INFO
+
+MANUAL_OVERRIDE_GRACE_SECONDS = 15  # AI will not override a signal that was manually toggled within this window
+
+
+class SignalController:
+    """
+    AI / manual signal arbitration for one simulation, free of any socket code so the live
+    server and headless runs share it. `clock` supplies the time used for the manual-override
+    grace window (a monotonic clock live, simulation time for recorded and headless runs).
+    `on_change(sim, signal_id, state, by)` is called after every applied change; the server uses
+    it to broadcast.
+    """
+
+    def __init__(self, clock=time.monotonic, grace_seconds=MANUAL_OVERRIDE_GRACE_SECONDS, on_change=None):
+        self.clock = clock
+        self.grace_seconds = grace_seconds
+        self.on_change = on_change
+        # when True AI can set signals automatically; when False UI/manual control is authoritative
+        self.ai_control_enabled = True
+        # timestamps of last manual override: signal_id -> clock()
+        self.manual_override_timestamps = {}
+
+    def record_manual_override(self, signal_id):
+        self.manual_override_timestamps[signal_id] = self.clock()
+
+    def overridden_recently(self, signal_id):
+        ts = self.manual_override_timestamps.get(signal_id)
+        if ts is None:  # a stamp of 0 is an override at simulation start
+            return False
+        return (self.clock() - ts) < self.grace_seconds
+
+    def stamps_at(self, now):
+        """The override stamps on another clock that reads `now` at this moment (checkpoints, forks)."""
+        offset = now - self.clock()
+        return {signal_id: ts + offset for signal_id, ts in self.manual_override_timestamps.items()}
+
+    def restore_stamps(self, stamps, now):
+        """Take over `stamps` from another clock that reads `now` at this moment."""
+        offset = self.clock() - now
+        self.manual_override_timestamps = {signal_id: ts + offset for signal_id, ts in stamps.items()}
+
+    def apply(self, sim, signal_id, state, by='ai'):
+        """
+        Set signal state on a simulation instance.
+        - If by=='manual': record manual override timestamp (so AI will avoid overriding for grace window)
+        - If by=='ai': apply only if allowed (no recent manual override AND ai_control_enabled)
+        Returns True if state applied, False if skipped.
+        """
+        state = (state or 'RED').upper()
+        signal_id = signal_id.strip().upper()
+
+        if by == 'manual':
+            self.record_manual_override(signal_id)
+            sim.set_signal_state(signal_id, state, announce=False)
+            sim.plan_needed = True
+            self._log(sim, INFO, signal_id, state, by)
+        else:
+            if not self.ai_control_enabled:
+                self._log(sim, DEBUG, signal_id, state, by, skipped='AI control disabled')
+                return False
+            if self.overridden_recently(signal_id):
+                self._log(sim, DEBUG, signal_id, state, by, skipped='recent manual override')
+                return False
+            # the AI's own aspect changes do not make a queued plan request stale (Simulation.state_version)
+            sim.set_signal_state(signal_id, state, announce=False, bump_version=False)
+            sim.plan_needed = True
+            self._log(sim, INFO, signal_id, state, by)
+        if self.on_change:
+            self.on_change(sim, signal_id, state, by)
+        return True
+
+    @staticmethod
+    def _log(sim, level, signal_id, state, by, **fields):
+        kind = 'signal_skipped' if 'skipped' in fields else 'signal'
+        sim.log.emit(level, kind, sim.section_code, sim.current_time_seconds, node=signal_id, state=state, by=by, **fields)
+
+    def preset_plan_signals(self, sim, plan):
+        """AI attempts to set departure signals to GREEN for PROCEED instructions (won't override recent manual)."""
+        if not self.ai_control_enabled:
+            return
+        for p in plan:
+            if p.get('action') == 'PROCEED' and p.get('route'):
+                node_path = sim.graph.node_path(p['route'])
+                if node_path:
+                    self.apply(sim, node_path[0], 'GREEN', by='ai')
+
+    def clear_waiting_trains(self, sim):
+        """
+        Proactively try to set departure signals GREEN for trains that are READY_TO_PROCEED
+        or STOPPED_AWAITING_CLEARANCE when their next segment/node appears free.
+        Additionally: set signals RED when AI decides they are not needed (idle/unused),
+        while respecting manual overrides and safety checks.
+
+        Returns a tuple (greens_applied, reds_applied).
+        """
+        # Fast guard
+        if not self.ai_control_enabled:
+            return (0, 0)
+
+        greens_applied = 0
+        # set of signal node IDs AI intends to keep GREEN for imminent departures
+        desired_green_signals = set()
+
+        # FIRST PASS: determine which signals should be GREEN (for trains that can proceed)
+        for train in sim.trains.in_state('READY_TO_PROCEED', 'STOPPED_AWAITING_CLEARANCE'):
+            state = train.get('state')
+            route = train.get('route') or []
+            node_path = train.get('node_path') or []
+            if not route or not node_path:
+                continue
+
+            # Decide departure node and next segment
+            if state == 'READY_TO_PROCEED':
+                departure_node = node_path[0]
+                next_segment = route[0]
+            else:
+                # STOPPED_AWAITING_CLEARANCE
+                try:
+                    idx = route.index(train.get('currentSegmentId'))
+                    if (idx + 1) < len(node_path):
+                        departure_node = node_path[idx + 1]
+                    else:
+                        departure_node = node_path[0]
+                    next_segment = route[idx + 1] if (idx + 1) < len(route) else None
+                except Exception:
+                    departure_node = node_path[0]
+                    next_segment = route[0]
+            if not next_segment:
+                continue
+
+            # safety checks: segment not faulty, weather priorities, resources not locked
+            seg = sim.segments_map.get(next_segment, {})
+            if seg.get('status') == 'FAULTY':
+                continue
+            if sim.current_ai_priorities.get('weather') and seg.get('weather') == 'BAD':
+                continue
+            if next_segment in sim.locked_resources:
+                continue
+            # check node after segment if possible
+            try:
+                np_node_path = sim.graph.node_path([next_segment])
+                next_node_after = np_node_path[1] if len(np_node_path) > 1 else None
+            except Exception:
+                next_node_after = None
+            if next_node_after and next_node_after in sim.locked_resources:
+                continue
+
+            # Respect manual override recency
+            if self.overridden_recently(departure_node):
+                continue
+
+            # Mark as desired green
+            desired_green_signals.add(departure_node.upper())
+
+        # SECOND PASS: apply GREEN to desired signals (attempt)
+        for sig in desired_green_signals:
+            applied_ok = self.apply(sim, sig, 'GREEN', by='ai')
+            if applied_ok:
+                greens_applied += 1
+
+        # THIRD PASS: decide which GREEN signals should be set RED.
+        # We will turn RED any signal currently GREEN that is NOT in desired_green_signals,
+        # is safe to change, and wasn't manually overridden recently.
+        reds_applied = 0
+
+        # Build a map of node_id -> node object for quick lookup (normalized)
+        node_map = {nid.upper(): n for nid, n in sim.nodes_map.items()}
+
+        for node_id, node in node_map.items():
+            if node.get('type') != 'SIGNAL':
+                continue
+            current_state = (node.get('state') or '').upper()
+            if current_state != 'GREEN':
+                continue  # only consider currently green signals for red'ing
+
+            # If AI wants this green, skip
+            if node_id in desired_green_signals:
+                continue
+
+            # Respect manual override
+            if self.overridden_recently(node_id):
+                continue
+
+            # Safety: avoid setting RED if doing so would block a RUNNING train that expects this signal
+            # Heuristic: if there's a RUNNING train whose next segment or node depends on this signal, don't flip.
+            # We'll conservatively check running trains' currentSegmentId and node_path.
+            block_safe = True
+            for t in sim.trains.in_state('RUNNING'):
+                # If this signal node appears in the node_path of a running train and is
+                # the immediate departure node for next segment, avoid changing it.
+                t_node_path = t.get('node_path') or []
+                if node_id in [n.upper() for n in t_node_path]:
+                    # Determine if signal node is the departure node for upcoming movement — if so, avoid toggling
+                    # Conservative: if node is in node_path near the train's currentSegmentId, skip.
+                    try:
+                        idx = t_node_path.index(node_id)
+                        # if this node is the next node after currentSegmentId, it's important
+                        current_seg = t.get('currentSegmentId')
+                        if current_seg:
+                            # find index of current segment in route and compare
+                            t_route = t.get('route') or []
+                            # convert route to node_path to be safe
+                            # If node appears after a segment in route, it's relevant -> skip toggling
+                            node_after_segments = sim.graph.node_path(t_route)
+                            if node_id in node_after_segments:
+                                block_safe = False
+                                break
+                    except Exception:
+                        pass
+
+            if not block_safe:
+                continue
+
+            # Additional safety: if the node controls entry into a locked resource, don't flip it red
+            # We'll check segments adjacent to this signal's node: if any adjacent segment is locked and
+            # would be needed for a train to exit, avoid flipping red.
+            # Build adjacency check via the compiled graph if possible
+            try:
+                neighbors = sim.graph.neighbors_of(node_id)
+                # if any adjacent segment is locked AND that segment's other node is occupied/locked, be conservative
+                unsafe = False
+                for _, seg_id in neighbors:
+                    if seg_id and seg_id in sim.locked_resources:
+                        unsafe = True
+                        break
+                if unsafe:
+                    continue
+            except Exception:
+                # if adjacency not available, continue with caution (don't flip)
+                continue
+
+            # If we reached here, it's considered safe to set this signal RED
+            applied_ok = self.apply(sim, node_id, 'RED', by='ai')
+            if applied_ok:
+                reds_applied += 1
+
+        return (greens_applied, reds_applied)
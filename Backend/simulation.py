@@ -1,18 +1,60 @@
-import time, json, pandas as pd, random
+import time, json, math, pandas as pd, random, heapq, itertools, copy
 from collections import deque
+from kinematics import TrainKinematics, SEGMENT_TRAVEL_TIME
+from registry import TrainRegistry
+from route_cache import RouteCache
+from pathfinding import k_shortest_paths
+from graph import CompiledGraph
+from eventlog import DEBUG, INFO, WARNING, OFF, EventLog, get_default_log
+
+BOARDING_DWELL_SECONDS = 100  # platform stop ('S-PF-*' nodes)
 
 class Simulation:
-    def __init__(self, section_code='DLI'):
+    ENGINE_MODES = ('tick', 'event')
+    # section codes the UI / CLI use -> data file prefix in ./data (default: the lower-cased code)
+    SECTION_DATA_PREFIX = {
+        'GZB': 'ghaziabad', 'GHAZIABAD': 'ghaziabad',
+        'ANVR': 'anand_vihar', 'ANAND_VIHAR': 'anand_vihar',
+        'SBB': 'shahibabad', 'SHAHIBABAD': 'shahibabad',
+    }
+
+    def __init__(self, section_code='DLI', engine_mode='tick', event_log=None, layout_path=None, schedule_path=None, seed=None):
         self.section_code = section_code.upper()
+        # every random choice the simulation makes goes through self.rng, so a seed makes runs reproducible
+        self.seed = seed
+        self.rng = random.Random(seed)
+        data_prefix = self.SECTION_DATA_PREFIX.get(self.section_code, self.section_code.lower())
+        self.layout_path = layout_path or f'./data/{data_prefix}_layout.json'
+        self.schedule_path = schedule_path or f'./data/{data_prefix}_schedule.csv'
+        # structured event log; hot-path events go through _emit instead of print
+        self.log = event_log or get_default_log()
         self.tick_rate = 1
         self.sim_speed = 1
+        if engine_mode not in self.ENGINE_MODES:
+            raise ValueError(f"Unknown engine mode {engine_mode!r}; expected one of {self.ENGINE_MODES}.")
+        # 'tick' advances a fixed step per call (live server); 'event' jumps between timed events (headless runs)
+        self.engine_mode = engine_mode
 
         self.network = self._load_network_layout()
         if not self.network: raise ValueError(f"Failed to load layout for {self.section_code}.")
 
         self.nodes_map = {n['id']: dict(n) for n in self.network['nodes']}
         self.segments_map = {s['id']: dict(s) for s in self.network['trackSegments']}
-        self.adjacency_list = self._build_adjacency_list()
+        self.graph = self._build_graph()
+        # the network dicts the UI receives, by id; only entries marked dirty are re-synced in get_state
+        self._network_nodes_by_id = {n['id']: n for n in self.network['nodes']}
+        self._network_segments_by_id = {s['id']: s for s in self.network['trackSegments']}
+        self._dirty_nodes = set(self._network_nodes_by_id)
+        self._dirty_segments = set(self._network_segments_by_id)
+        self._segment_occupancy = {}  # segment_id -> number of trains whose currentSegmentId it is
+        # change journal drained by collect_changes() for delta broadcasts
+        self._changed_nodes = set()
+        self._changed_segments = set()
+        self._changed_trains = set()
+        self._removed_trains = set()
+        self.route_cache = RouteCache()
+        self._faulty_segments = {sid for sid, seg in self.segments_map.items() if seg.get('status') == 'FAULTY'}
+        self._bad_weather_segments = {sid for sid, seg in self.segments_map.items() if seg.get('weather') == 'BAD'}
         self.master_schedule = self._load_master_schedule()
 
         self.priorities = {
@@ -27,11 +69,23 @@ class Simulation:
         }
 
         # runtime state
-        self.active_trains = []
+        self.trains = TrainRegistry()
+        self.kinematics = TrainKinematics(self.graph.segment_ids)
         self.processed_train_ids = set()
+        # master_schedule is sorted by arrival; rows before the cursor are due,
+        # due rows that did not fit under the per-tick cap wait in the backlog
+        self._spawn_cursor = 0
+        self._spawn_backlog = deque()
         self.locked_resources = set()
         self.plan_needed = True
+        # bumped by every change a plan can be stale against (spawns, signals, faults, weather,
+        # priorities, holds); off-loop solvers stamp their result with the version they saw
+        self.state_version = 0
         self.current_time_seconds = 0
+        # journey record per exited train, for KPI reports: id, type, scheduled/spawned/departed/exited times
+        self.exit_log = []
+        self._spawned_at = {}
+        self._departed_at = {}
 
         # AI control flags (server will set). defaults: congestion & trackCondition enforced.
         self.current_ai_priorities = {
@@ -44,6 +98,14 @@ class Simulation:
 
         # dynamic per-train boost (increases when lower priority trains are deferred)
         self.train_boosts = {}  # train_id -> int
+        # trains held at their current node until a given time (what-if lookahead, controller holds)
+        self.train_holds = {}  # train_id -> release time
+
+        # discrete-event queue: (time, seq, kind, train_id). Entries are wake-up points;
+        # a stale entry just causes one harmless extra evaluation.
+        self._event_queue = []
+        self._event_seq = itertools.count()
+        self._schedule_next_spawn()
 
         start_time_str = time.strftime('%H:%M:%S', time.gmtime(self.current_time_seconds % 86400))
         print(f"🚀 Simulation for [{self.section_code}] ready at {start_time_str}.")
@@ -52,21 +114,27 @@ class Simulation:
 
 
 
-    def set_signal_state(self, node_id, state):
+    def set_signal_state(self, node_id, state, announce=True, bump_version=True):
         """
-        Set a node (signal) state in nodes_map & network copy so UI sees it.
+        Set a node (signal) state in nodes_map; the network copy the UI sees is patched on the next get_state.
         Valid states are strings like 'GREEN', 'RED', 'NORMAL' (switch), etc.
+        bump_version=False leaves state_version alone: the AI signal pass flips aspects every tick,
+        and a queued solve must not be dropped for the loop's own changes.
         """
         node_id = node_id.strip().upper()
         if node_id in self.nodes_map:
+            changed = self.nodes_map[node_id].get('state') != state
             self.nodes_map[node_id]['state'] = state
-            # reflect into network nodes list for get_state / UI
-            for n in self.network.get('nodes', []):
-                if n.get('id') == node_id:
-                    n['state'] = state
-            print(f"🔔 Signal {node_id} set to {state} in simulation.")
+            self._dirty_nodes.add(node_id)
+            if announce:
+                self._emit(INFO, 'signal', node=node_id, state=state)
             # changing signals can require replanning
             self.plan_needed = True
+            if changed:
+                # re-asserting the same aspect must not wake the event engine, or it would spin in place
+                self._schedule_event(self.current_time_seconds, 'signal')
+                if bump_version:
+                    self.state_version += 1
             return True
         else:
             print(f"⚠️ Attempted to set unknown node {node_id} to {state}.")
@@ -77,18 +145,50 @@ class Simulation:
 
     def set_ai_priorities(self, priorities: dict):
         # server-side authoritative set
+        old_route_state = self._route_network_state()
         self.current_ai_priorities.update(priorities)
         # ensure required flags are always on
         self.current_ai_priorities['congestion'] = True
         self.current_ai_priorities['trackCondition'] = True
+        self.route_cache.network_changed(old_route_state, self._route_network_state())
+        self.state_version += 1
         print("Simulation: AI priorities set:", self.current_ai_priorities)
 
+    def set_track_status(self, track_id, status):
+        """Apply an operational status (e.g. 'FAULTY', 'OPERATIONAL') to a segment. Returns True if it exists."""
+        old_route_state = self._route_network_state()
+        updated = track_id in self._network_segments_by_id
+        if updated:
+            self._network_segments_by_id[track_id]['status'] = status
+            if track_id in self.segments_map:
+                self.segments_map[track_id]['status'] = status
+            self._dirty_segments.add(track_id)
+        if status == 'FAULTY':
+            self.locked_resources.add(track_id)
+            if updated:
+                self._faulty_segments.add(track_id)
+        else:
+            self.locked_resources.discard(track_id)
+            self._faulty_segments.discard(track_id)
+
+        self.route_cache.network_changed(old_route_state, self._route_network_state())
+        if updated:
+            self.plan_needed = True
+            self.state_version += 1
+            self._schedule_event(self.current_time_seconds, 'resource')
+        return updated
+
+    @property
+    def active_trains(self):
+        return self.trains.as_list()
+
     def get_state(self):
+        self.kinematics.materialise()
         self._update_network_state()
         return {"timestamp": self.current_time_seconds, "network": self.network, "trains": self.active_trains}
 
     def _load_network_layout(self):
-        layout_path = f'./data/{self.section_code.lower()}_layout.json'
+        layout_path = self.layout_path
         print(f"Attempting to load layout from: {layout_path}")
         try:
             with open(layout_path, 'r') as f:
@@ -100,18 +200,15 @@ class Simulation:
             print(f"❌ FATAL ERROR: Could not parse layout file {layout_path}: {e}")
             return None
 
-    def _build_adjacency_list(self):
-        adj = {n['id']: [] for n in self.network['nodes']}
+    def _build_graph(self):
         for seg in self.network['trackSegments']:
-            adj[seg['startNodeId']].append({'node': seg['endNodeId'], 'segment_id': seg['id']})
-            adj[seg['endNodeId']].append({'node': seg['startNodeId'], 'segment_id': seg['id']})
             self.segments_map[seg['id']] = dict(seg)
             self.segments_map[seg['id']].setdefault('status', seg.get('status'))
             self.segments_map[seg['id']].setdefault('weather', seg.get('weather', 'GOOD'))
-        return adj
+        return CompiledGraph(self.network['nodes'], self.network['trackSegments'])
 
     def _load_master_schedule(self):
-        csv_path = f'./data/{self.section_code.lower()}_schedule.csv'
+        csv_path = self.schedule_path
         print(f"Attempting to load schedule from: {csv_path}")
         try:
             df = pd.read_csv(csv_path)
@@ -125,6 +222,7 @@ class Simulation:
                 df['arrival_seconds'] = df.get('arrival_seconds', pd.Series([0]*len(df)))
 
             df.dropna(subset=['arrival_seconds'], inplace=True)
+            df.sort_values('arrival_seconds', kind='stable', inplace=True)
             print(f"✅ Loaded {len(df)} schedule entries from {csv_path}")
             return df.to_dict('records')
         except FileNotFoundError:
@@ -133,63 +231,62 @@ class Simulation:
         except Exception as e:
             print(f"❌ FATAL ERROR: Could not load schedule from CSV {csv_path}: {e}"); return []
 
+    def _route_network_state(self):
+        # the inputs pathfinding depends on; bad weather only matters when the weather priority is on
+        bad = frozenset(self._bad_weather_segments) if self.current_ai_priorities.get('weather') else frozenset()
+        return (frozenset(self._faulty_segments), bad)
+
     def find_all_possible_routes(self, start_node, end_node):
-        node_paths = self._find_all_paths_bfs(start_node, end_node)
-        return [self._convert_node_path_to_segment_path(p) for p in node_paths if p]
-
-    def _find_all_paths_bfs(self, start, end, max_paths=6):
-        paths, queue = [], deque([[start]])
-        while queue and len(paths) < max_paths:
-            path = queue.popleft()
-            if path[-1] == end:
-                paths.append(path); continue
-            if len(path) > 30: continue
-            for neighbor in self.adjacency_list.get(path[-1], []):
-                seg_id = neighbor['segment_id']
-                seg = self.segments_map.get(seg_id, {})
-                if seg.get('status') == 'FAULTY': continue
-                if self.current_ai_priorities.get('weather') and seg.get('weather') == 'BAD':
-                    continue
-                if neighbor['node'] not in path:
-                    new_path = list(path); new_path.append(neighbor['node']); queue.append(new_path)
-        return paths
+        faulty, bad = self._route_network_state()
+        key = (start_node, end_node, faulty, bad)
+        routes = self.route_cache.get(key)
+        if routes is None:
+            routes = [segs for _, _, segs in self._find_k_shortest_paths(start_node, end_node) if segs]
+            self.route_cache.put(key, routes)
+        return [list(r) for r in routes]
+
+    def _find_k_shortest_paths(self, start, end, max_paths=6):
+        """Yen's K loopless shortest paths over an A* core, cost = segment length, in cost order."""
+        graph = self.graph
+        if start not in graph.node_index or end not in graph.node_index:
+            return []
+        faulty, bad = self._route_network_state()
+        allowed = graph.allowed_mask(faulty | bad)
+        paths = k_shortest_paths(graph, graph.node_index[start], graph.node_index[end], max_paths, allowed)
+        return [
+            (cost, [graph.node_ids[n] for n in nodes], [graph.segment_ids[e] for e in segs])
+            for cost, nodes, segs in paths
+        ]
 
     def _convert_node_path_to_segment_path(self, node_path):
-        path = []
-        for i in range(len(node_path) - 1):
-            for neighbor in self.adjacency_list[node_path[i]]:
-                if neighbor['node'] == node_path[i+1]:
-                    path.append(neighbor['segment_id']); break
-        return path
+        return self.graph.segment_path(node_path)
 
     def _convert_segment_path_to_node_path(self, segment_path):
-        if not segment_path: return []
-        node_path = [self.segments_map[segment_path[0]]['startNodeId']]
-        for seg_id in segment_path:
-            segment = self.segments_map[seg_id]
-            last_node = node_path[-1]
-            if segment['startNodeId'] == last_node:
-                node_path.append(segment['endNodeId'])
-            else:
-                node_path.append(segment['startNodeId'])
-        return node_path
+        return self.graph.node_path(segment_path)
+
+    def _schedule_next_spawn(self):
+        if self._spawn_cursor < len(self.master_schedule):
+            arrival = self.master_schedule[self._spawn_cursor].get('arrival_seconds', 0)
+            self._schedule_event(int(math.ceil(arrival)), 'spawn')
 
     def _spawn_trains(self):
         max_spawn_per_tick = 3
-        eligible = []
-        for train_data in self.master_schedule:
+        schedule = self.master_schedule
+        cursor = self._spawn_cursor
+        while cursor < len(schedule) and schedule[cursor].get('arrival_seconds', 0) <= self.current_time_seconds:
+            self._spawn_backlog.append(schedule[cursor])
+            cursor += 1
+        if cursor != self._spawn_cursor:
+            self._spawn_cursor = cursor
+            self._schedule_next_spawn()
+
+        spawned = 0
+        while self._spawn_backlog and spawned < max_spawn_per_tick:
+            train_data = self._spawn_backlog.popleft()
             train_id = str(train_data.get('Train No'))
             if train_id in self.processed_train_ids:
                 continue
-            arrival = train_data.get('arrival_seconds', 0)
-            if arrival <= self.current_time_seconds:
-                eligible.append(train_data)
-
-        if not eligible:
-            return
-
-        for train_data in eligible[:max_spawn_per_tick]:
-            train_id = str(train_data['Train No'])
+            spawned += 1
             new_train = {
                 "id": train_id,
                 "type": train_data.get('Type', 'Passenger'),
@@ -202,51 +299,91 @@ class Simulation:
                 "boarding_timer_ends_at": None,
                 "scheduled_arrival": int(train_data.get('arrival_seconds', 0))
             }
-            self.active_trains.append(new_train)
+            self.trains.add(new_train)
+            self._changed_trains.add(train_id)
+            self.kinematics.add(new_train)
             self.train_boosts[new_train['id']] = 0
             self.processed_train_ids.add(train_id)
+            self._spawned_at[train_id] = self.current_time_seconds
             self.plan_needed = True
-            print(f"📅 Train {new_train['id']} ({new_train['type']}) needs plan. Scheduled arrival: {new_train['scheduled_arrival']}")
+            self.state_version += 1
+            self._emit(INFO, 'spawn', train=train_id, type=new_train['type'], scheduled=new_train['scheduled_arrival'])
 
-    def apply_plan(self, plan):
-        for instruction in plan:
-            train = next((t for t in self.active_trains if t['id'] == instruction['trainId']), None)
-            if not train or train['state'] != 'WAITING_PLAN': continue
-
-            train['route'] = instruction['route']
-            train['node_path'] = self._convert_segment_path_to_node_path(train['route'])
-            train['state'] = 'READY_TO_PROCEED'
-            print(f"  -> ✅ Plan for {train['id']} received. Is READY_TO_PROCEED.")
-
-    def _update_train_positions(self):
-        moved = []
-        for train in list(self.active_trains):
-            if train.get('state') != "RUNNING": continue
-
-            travel_time = 30
-            increment = 1.0 / travel_time
-            prev_pos = train['positionOnSegment']
-            train['positionOnSegment'] += increment * self.tick_rate * self.sim_speed
-
-            if train['positionOnSegment'] >= 1.0:
-                train['positionOnSegment'] = 1.0
-                self._handle_train_at_node(train)
-                moved.append((train['id'], train.get('currentSegmentId'), train['positionOnSegment']))
-            else:
-                # report small progress
-                moved.append((train['id'], train.get('currentSegmentId'), round(train['positionOnSegment'], 3)))
+        if self._spawn_backlog:
+            # overflow carries over to the next tick
+            self._schedule_event(self.current_time_seconds + self.tick_rate, 'spawn')
 
-        if moved:
-            s = ", ".join([f"{tid}:{seg}@{pos}" for (tid, seg, pos) in moved])
-            print(f"[tick {self.current_time_seconds}] RUNNING progress -> {s}")
+    def apply_plan(self, plan, revise=False):
+        """
+        Route WAITING_PLAN trains as planned. revise=True also re-routes trains already planned that
+        have not left their start node (anytime plans: a later, better solution replaces a provisional one).
+        """
+        for instruction in plan:
+            train = self.trains.get(instruction['trainId'])
+            if not train: continue
+            if train['state'] == 'WAITING_PLAN':
+                train['route'] = instruction['route']
+                train['node_path'] = self._convert_segment_path_to_node_path(train['route'])
+                self._set_train_state(train, 'READY_TO_PROCEED')
+                self._schedule_event(self.current_time_seconds, 'plan')
+                self._emit(INFO, 'plan', train=train['id'])
+            elif revise and self.plan_revisable(train) and train['route'] != instruction['route']:
+                train['route'] = instruction['route']
+                train['node_path'] = self._convert_segment_path_to_node_path(train['route'])
+                self._changed_trains.add(train['id'])
+                self._schedule_event(self.current_time_seconds, 'plan')
+                self._emit(INFO, 'replan', train=train['id'])
+
+    def plan_revisable(self, train):
+        """Planned but still standing at its start node, so its route can still change."""
+        return (train['state'] == 'READY_TO_PROCEED' and not train.get('currentSegmentId')
+                and train['id'] not in self._departed_at)
+
+    def _emit(self, level, kind, **fields):
+        if level >= self.log.level:
+            self.log.emit(level, kind, self.section_code, self.current_time_seconds, **fields)
+
+    def _set_train_state(self, train, state):
+        self.trains.set_state(train, state)
+        self._changed_trains.add(train['id'])
+        self.kinematics.set_state(train['id'], state)
+
+    def _set_current_segment(self, train, segment_id):
+        old = train.get('currentSegmentId')
+        if old == segment_id:
+            return
+        if old:
+            self._segment_occupancy[old] -= 1
+            self._dirty_segments.add(old)
+        if segment_id:
+            self._segment_occupancy[segment_id] = self._segment_occupancy.get(segment_id, 0) + 1
+            self._dirty_segments.add(segment_id)
+        train['currentSegmentId'] = segment_id
+
+    def _start_running(self, train, segment_id):
+        train['speed_kph'] = 60
+        self._set_current_segment(train, segment_id)
+        train['positionOnSegment'] = 0.0
+        train['waiting_since'] = None
+        self.trains.set_state(train, 'RUNNING')
+        self._changed_trains.add(train['id'])
+        self.kinematics.enter_segment(train['id'], segment_id, train['speed_kph'], SEGMENT_TRAVEL_TIME)
+        self._departed_at.setdefault(train['id'], self.current_time_seconds)
+        self._schedule_event(self.current_time_seconds + SEGMENT_TRAVEL_TIME, 'segment_exit', train['id'])
+
+    def _update_train_positions(self, dt=None):
+        if dt is None:
+            dt = self.tick_rate * self.sim_speed
+        for train in self.kinematics.step(dt):
+            self._handle_train_at_node(train)
 
     def _handle_train_at_node(self, train):
         completed_segment_id = train['currentSegmentId']
         try:
             current_route_index = train['route'].index(completed_segment_id)
         except ValueError:
-            print(f"  -> ⚠️ Train {train['id']} had malformed route.")
-            train['state'] = 'STOPPED_AWAITING_CLEARANCE'
+            self._emit(WARNING, 'malformed', train=train['id'], reason=f"segment {completed_segment_id} not on route")
+            self._set_train_state(train, 'STOPPED_AWAITING_CLEARANCE')
             return
 
         cleared_node_id = train['node_path'][current_route_index]
@@ -256,22 +393,33 @@ class Simulation:
         self.locked_resources.discard(cleared_node_id)
         self.plan_needed = True
 
-        print(f"  -> ➡️ Train {train['id']} cleared {cleared_node_id} & {completed_segment_id}, arrived at {arrived_at_node_id}.")
+        self._emit(INFO, 'arrive', train=train['id'], cleared=cleared_node_id, segment=completed_segment_id, node=arrived_at_node_id)
 
         if current_route_index + 1 >= len(train['route']):
             final_node = train['node_path'][-1]
             self.locked_resources.discard(final_node)
-            print(f"✅ Train {train['id']} has EXITED. Final node {final_node} released.")
-            train['state'] = 'EXITED'
+            self._emit(INFO, 'exit', train=train['id'], node=final_node)
+            self.exit_log.append({
+                'id': train['id'], 'type': train['type'],
+                'scheduled_arrival': train.get('scheduled_arrival'),
+                'spawned_at': self._spawned_at.pop(train['id'], None),
+                'departed_at': self._departed_at.pop(train['id'], None),
+                'exited_at': self.current_time_seconds,
+                # unimpeded journey: every segment at line speed plus the platform dwells on the route
+                'ideal_seconds': len(train['route']) * SEGMENT_TRAVEL_TIME
+                + BOARDING_DWELL_SECONDS * sum(1 for n in train['node_path'][1:-1] if n.startswith("S-PF-")),
+            })
+            self._set_train_state(train, 'EXITED')
             return
 
         if arrived_at_node_id.startswith("S-PF-"):
-            train['state'] = 'BOARDING_PASSENGERS'
+            self._set_train_state(train, 'BOARDING_PASSENGERS')
             train['speed_kph'] = 0
-            train['boarding_timer_ends_at'] = self.current_time_seconds + 100
-            print(f"  -> boarding Train {train['id']} at {arrived_at_node_id}. Waiting for 100s.")
+            train['boarding_timer_ends_at'] = self.current_time_seconds + BOARDING_DWELL_SECONDS
+            self._schedule_event(train['boarding_timer_ends_at'], 'boarding_end', train['id'])
+            self._emit(INFO, 'boarding', train=train['id'], node=arrived_at_node_id, seconds=BOARDING_DWELL_SECONDS)
         else:
-            train['state'] = 'STOPPED_AWAITING_CLEARANCE'
+            self._set_train_state(train, 'STOPPED_AWAITING_CLEARANCE')
             train['speed_kph'] = 0
             train['waiting_since'] = self.current_time_seconds
 
@@ -331,19 +479,20 @@ class Simulation:
             self.locked_resources.add(first_segment)
             self.locked_resources.add(first_node_after)
 
-            train['state'] = 'RUNNING'
-            train['speed_kph'] = 60
-            train['currentSegmentId'] = first_segment
-            train['positionOnSegment'] = 0.0
-            train['waiting_since'] = None
-            print(f"  -> 🔁 REROUTED & DISPATCHED Train {train['id']} onto alternate route starting with {first_segment}.")
-            if self.current_ai_priorities.get('trainType') and self.current_ai_priorities.get('punctuality'):
-                for other in self.active_trains:
-                    if other['id'] != train['id'] and other['state'] in ['READY_TO_PROCEED', 'STOPPED_AWAITING_CLEARANCE']:
-                        self.train_boosts[other['id']] = self.train_boosts.get(other['id'], 0) + 1
+            self._start_running(train, first_segment)
+            self._emit(INFO, 'reroute', train=train['id'], segment=first_segment)
+            self._boost_deferred_trains(train)
             return True
         return False
 
+    def _boost_deferred_trains(self, dispatched_train):
+        # every train left waiting while another was dispatched gains priority
+        if not (self.current_ai_priorities.get('trainType') and self.current_ai_priorities.get('punctuality')):
+            return
+        for other in self.trains.in_state('READY_TO_PROCEED', 'STOPPED_AWAITING_CLEARANCE'):
+            if other['id'] != dispatched_train['id']:
+                self.train_boosts[other['id']] = self.train_boosts.get(other['id'], 0) + 1
+
     def _dispatch_sort_key(self, train):
         waiting_since = train.get('waiting_since')
         if waiting_since is None:
@@ -378,26 +527,25 @@ class Simulation:
             priority_value = base + boost + punctuality_boost
             priority_component = -priority_value
 
-        return (group_rank, priority_component, waiting_since)
+        return (group_rank, priority_component, waiting_since, self.trains.order_of(train['id']))
 
     def _check_and_dispatch_trains(self):
-        # --- DEBUG: snapshot before dispatch ---
-        counts = {}
-        for s in ['WAITING_PLAN','READY_TO_PROCEED','RUNNING','STOPPED_AWAITING_CLEARANCE','BOARDING_PASSENGERS','EXITED']:
-            counts[s] = sum(1 for t in self.active_trains if t.get('state')==s)
-        running_info = [(t['id'], t.get('currentSegmentId'), round(t.get('positionOnSegment',0),3)) for t in self.active_trains if t.get('state')=='RUNNING']
-        print(f"[tick {self.current_time_seconds}] snapshot -> locked:{sorted(list(self.locked_resources))[:8]} | counts:{counts} | running:{running_info[:6]}")
-
-        dispatchable_trains = [
-            t for t in self.active_trains if t['state'] in ['READY_TO_PROCEED', 'STOPPED_AWAITING_CLEARANCE', 'BOARDING_PASSENGERS']
-        ]
+        debug = self.log.level <= DEBUG
+        if debug:
+            running_info = [(t['id'], t.get('currentSegmentId'), round(self.kinematics.position_of(t['id']),3)) for t in self.trains.in_state('RUNNING')[:6]]
+            self._emit(DEBUG, 'snapshot', locked=sorted(self.locked_resources)[:8], counts=self.trains.counts(), running=running_info)
+
+        dispatchable_trains = self.trains.in_state('READY_TO_PROCEED', 'STOPPED_AWAITING_CLEARANCE', 'BOARDING_PASSENGERS')
         dispatchable_trains.sort(key=self._dispatch_sort_key)
 
+        holds = self.train_holds
         for train in dispatchable_trains:
+            if holds and train['state'] != 'BOARDING_PASSENGERS' and self._is_held(train['id']):
+                continue
             # show debug info for READY trains
-            if train['state'] == 'READY_TO_PROCEED':
+            if debug and train['state'] == 'READY_TO_PROCEED':
                 if not train['route']:
-                    print(f"  -> Debug: {train['id']} READY with no route; skipping.")
+                    self._emit(WARNING, 'malformed', train=train['id'], reason='READY with no route')
                     continue
                 next_segment_id = train['route'][0]
                 next_node_id = train['node_path'][1]
@@ -411,7 +559,8 @@ class Simulation:
                 seg_status = self.segments_map.get(next_segment_id, {}).get('status', None)
                 seg_locked = next_segment_id in self.locked_resources
                 node_locked = next_node_id in self.locked_resources
-                print(f"  -> Consider {train['id']} -> next_seg:{next_segment_id} next_node:{next_node_id} dep_node:{departure_node} dep_type:{dep_type} dep_state:{dep_state} seg_status:{seg_status} seg_locked:{seg_locked} node_locked:{node_locked}")
+                self._emit(DEBUG, 'consider', train=train['id'], segment=next_segment_id, node=next_node_id, dep_node=departure_node,
+                           dep_state=dep_state, seg_status=seg_status, seg_locked=seg_locked, node_locked=node_locked)
 
             if train['state'] == 'READY_TO_PROCEED':
                 if not train['route']:
@@ -424,14 +573,14 @@ class Simulation:
                     start_node = train['start_node']
                     rerouted = self._attempt_reroute_and_dispatch(train, start_node)
                     if not rerouted:
-                        print(f"  -> ⛔ {train['id']} READY_TO_PROCEED: planned next segment {next_segment_id} is FAULTY; no alternate found.")
+                        self._emit(DEBUG, 'block', train=train['id'], node=train['node_path'][0], segment=next_segment_id, reason='segment FAULTY, no alternate')
                     continue
 
                 if self.current_ai_priorities.get('weather') and seg.get('weather') == 'BAD':
                     start_node = train['start_node']
                     rerouted = self._attempt_reroute_and_dispatch(train, start_node)
                     if not rerouted:
-                        print(f"  -> ⛔ {train['id']} READY_TO_PROCEED: planned next segment {next_segment_id} has BAD weather; no alternate found.")
+                        self._emit(DEBUG, 'block', train=train['id'], node=train['node_path'][0], segment=next_segment_id, reason='BAD weather, no alternate')
                     continue
 
                 departure_node = train['node_path'][0]
@@ -440,35 +589,28 @@ class Simulation:
                 if dep_node_obj.get('type') == 'SIGNAL':
                     departure_node_state = dep_node_obj.get('state', 'RED')
                     if departure_node_state != 'GREEN':
-                        print(f"  -> ⛔ {train['id']} blocked: departure SIGNAL {departure_node} is {departure_node_state}.")
+                        self._emit(DEBUG, 'block', train=train['id'], node=departure_node, segment=next_segment_id, reason=f"SIGNAL is {departure_node_state}")
                         continue
                 # non-signal nodes are allowed to proceed
 
                 if next_segment_id not in self.locked_resources and next_node_id not in self.locked_resources:
                     self.locked_resources.add(next_segment_id)
                     self.locked_resources.add(next_node_id)
-                    train['state'] = 'RUNNING'
-                    train['speed_kph'] = 60
-                    train['currentSegmentId'] = next_segment_id
-                    train['positionOnSegment'] = 0.0
-                    train['waiting_since'] = None
-                    print(f"  -> 🟢 DISPATCHED Train {train['id']} ({train['type']}) onto {next_segment_id}.")
-                    if self.current_ai_priorities.get('trainType') and self.current_ai_priorities.get('punctuality'):
-                        for other in self.active_trains:
-                            if other['id'] != train['id'] and other['state'] in ['READY_TO_PROCEED', 'STOPPED_AWAITING_CLEARANCE']:
-                                self.train_boosts[other['id']] = self.train_boosts.get(other['id'], 0) + 1
+                    self._start_running(train, next_segment_id)
+                    self._emit(INFO, 'dispatch', train=train['id'], type=train['type'], segment=next_segment_id)
+                    self._boost_deferred_trains(train)
                 else:
                     start_node = train['start_node']
                     rerouted = self._attempt_reroute_and_dispatch(train, start_node)
                     if not rerouted:
-                        print(f"  -> ⛔ {train['id']} READY_TO_PROCEED blocked on {next_segment_id}. No immediate alternate route found.")
+                        self._emit(DEBUG, 'block', train=train['id'], node=departure_node, segment=next_segment_id, reason='resources locked, no alternate')
 
             elif train['state'] == 'BOARDING_PASSENGERS':
                 if self.current_time_seconds >= train['boarding_timer_ends_at']:
-                    train['state'] = 'STOPPED_AWAITING_CLEARANCE'
+                    self._set_train_state(train, 'STOPPED_AWAITING_CLEARANCE')
                     train['boarding_timer_ends_at'] = None
                     train['waiting_since'] = self.current_time_seconds
-                    print(f"  -> ✅ Boarding complete for {train['id']}. Now awaiting clearance.")
+                    self._emit(INFO, 'boarded', train=train['id'])
 
             elif train['state'] == 'STOPPED_AWAITING_CLEARANCE':
                 try:
@@ -477,7 +619,7 @@ class Simulation:
                     current_node = train['node_path'][-1] if train['node_path'] else train.get('start_node')
                     rerouted = self._attempt_reroute_and_dispatch(train, current_node)
                     if not rerouted:
-                        print(f"  -> ⚠️ STOPPED train {train['id']} has inconsistent route and couldn't reroute.")
+                        self._emit(WARNING, 'malformed', train=train['id'], reason="inconsistent route, couldn't reroute")
                     continue
 
                 if current_route_index + 1 >= len(train['route']):
@@ -488,7 +630,7 @@ class Simulation:
                     current_node = train['node_path'][current_route_index + 1]
                     rerouted = self._attempt_reroute_and_dispatch(train, current_node)
                     if not rerouted:
-                        print(f"  -> ⚠️ STOPPED {train['id']} has a malformed node_path and couldn't reroute.")
+                        self._emit(WARNING, 'malformed', train=train['id'], reason="malformed node_path, couldn't reroute")
                     continue
 
                 next_node_id = train['node_path'][current_route_index + 2]
@@ -498,14 +640,14 @@ class Simulation:
                     current_node = train['node_path'][current_route_index + 1]
                     rerouted = self._attempt_reroute_and_dispatch(train, current_node)
                     if not rerouted:
-                        print(f"  -> ⛔ STOPPED {train['id']} blocked at {current_node} because next segment {next_segment_id} is FAULTY.")
+                        self._emit(DEBUG, 'block', train=train['id'], node=current_node, segment=next_segment_id, reason='segment FAULTY, no alternate')
                     continue
 
                 if self.current_ai_priorities.get('weather') and seg.get('weather') == 'BAD':
                     current_node = train['node_path'][current_route_index + 1]
                     rerouted = self._attempt_reroute_and_dispatch(train, current_node)
                     if not rerouted:
-                        print(f"  -> ⛔ STOPPED {train['id']} blocked at {current_node} because next segment {next_segment_id} has BAD weather.")
+                        self._emit(DEBUG, 'block', train=train['id'], node=current_node, segment=next_segment_id, reason='BAD weather, no alternate')
                     continue
 
                 current_node_id = train['node_path'][current_route_index + 1]
@@ -514,73 +656,281 @@ class Simulation:
                 if current_node_obj.get('type') == 'SIGNAL':
                     current_node_state = current_node_obj.get('state', 'RED')
                     if current_node_state != 'GREEN':
-                        print(f"  -> ⛔ STOPPED {train['id']} blocked at {current_node_id} because SIGNAL is {current_node_state}.")
+                        self._emit(DEBUG, 'block', train=train['id'], node=current_node_id, segment=next_segment_id, reason=f"SIGNAL is {current_node_state}")
                         continue
                 # else non-signal node -> proceed if resources free
 
                 if next_segment_id not in self.locked_resources and next_node_id not in self.locked_resources:
                     self.locked_resources.add(next_segment_id)
                     self.locked_resources.add(next_node_id)
-                    train['state'] = 'RUNNING'
-                    train['speed_kph'] = 60
-                    train['currentSegmentId'] = next_segment_id
-                    train['positionOnSegment'] = 0.0
-                    train['waiting_since'] = None
-                    print(f"  -> 🟢 CLEARED Train {train['id']} ({train['type']}) to proceed onto {next_segment_id}.")
-                    if self.current_ai_priorities.get('trainType') and self.current_ai_priorities.get('punctuality'):
-                        for other in self.active_trains:
-                            if other['id'] != train['id'] and other['state'] in ['READY_TO_PROCEED', 'STOPPED_AWAITING_CLEARANCE']:
-                                self.train_boosts[other['id']] = self.train_boosts.get(other['id'], 0) + 1
+                    self._start_running(train, next_segment_id)
+                    self._emit(INFO, 'clear', train=train['id'], type=train['type'], segment=next_segment_id)
+                    self._boost_deferred_trains(train)
                 else:
                     current_node = train['node_path'][current_route_index + 1]
                     rerouted = self._attempt_reroute_and_dispatch(train, current_node)
                     if not rerouted:
-                        print(f"  -> ⛔ STOPPED {train['id']} blocked at {current_node}. No alternate found currently.")
+                        self._emit(DEBUG, 'block', train=train['id'], node=current_node, segment=next_segment_id, reason='resources locked, no alternate')
+
+    def hold_train(self, train_id, seconds):
+        """Keep a train where it is (no dispatch, no clearance) for `seconds` of simulation time."""
+        if train_id not in self.trains:
+            return False
+        release_at = self.current_time_seconds + seconds
+        self.train_holds[train_id] = release_at
+        self.plan_needed = True
+        self.state_version += 1
+        self._schedule_event(release_at, 'hold_end', train_id)
+        return True
+
+    def release_train(self, train_id):
+        if self.train_holds.pop(train_id, None) is None:
+            return False
+        self.state_version += 1
+        self._schedule_event(self.current_time_seconds, 'hold_end', train_id)
+        return True
+
+    def _is_held(self, train_id):
+        release_at = self.train_holds.get(train_id)
+        if release_at is None:
+            return False
+        if self.current_time_seconds >= release_at:
+            del self.train_holds[train_id]
+            return False
+        return True
 
     def assign_random_weather(self, choose_count=3):
         segment_ids = [sid for sid in self.segments_map.keys() if self.segments_map[sid].get('status') != 'FAULTY']
         if not segment_ids:
             return
         choose_count = min(choose_count, len(segment_ids))
-        chosen = random.sample(segment_ids, choose_count)
-        for sid in self.segments_map:
+        self.set_bad_weather(self.rng.sample(segment_ids, choose_count))
+
+    def set_bad_weather(self, segment_ids):
+        """Make exactly these segments BAD weather (the rest GOOD); used directly by scenario sweeps."""
+        old_route_state = self._route_network_state()
+        chosen = [sid for sid in segment_ids if sid in self.segments_map]
+        for sid in self._bad_weather_segments:
             self.segments_map[sid]['weather'] = 'GOOD'
         for sid in chosen:
             self.segments_map[sid]['weather'] = 'BAD'
             self.locked_resources.add(sid)
-        for seg in self.network['trackSegments']:
-            seg['weather'] = self.segments_map[seg['id']].get('weather', 'GOOD')
+        self._dirty_segments.update(self._bad_weather_segments)
+        self._dirty_segments.update(chosen)
+        self._bad_weather_segments = set(chosen)
+        self.route_cache.network_changed(old_route_state, self._route_network_state())
         print(f"🌧️ Weather assigned BAD on segments: {chosen}")
         self.plan_needed = True
+        self.state_version += 1
+        self._schedule_event(self.current_time_seconds, 'resource')
 
     def clear_weather(self):
+        old_route_state = self._route_network_state()
         for sid in self.segments_map:
-            self.segments_map[sid]['weather'] = 'GOOD'
             self.locked_resources.discard(sid)
-        for seg in self.network['trackSegments']:
-            seg['weather'] = 'GOOD'
+        for sid in self._bad_weather_segments:
+            self.segments_map[sid]['weather'] = 'GOOD'
+        self._dirty_segments.update(self._bad_weather_segments)
+        self._bad_weather_segments = set()
+        self.route_cache.network_changed(old_route_state, self._route_network_state())
         print("🌤️ Weather cleared on all segments")
         self.plan_needed = True
+        self.state_version += 1
+        self._schedule_event(self.current_time_seconds, 'resource')
 
     def _update_network_state(self):
-        occupied_segments = {
-            t['currentSegmentId'] for t in self.active_trains if t.get('currentSegmentId')
-        }
-        for seg in self.network['trackSegments']:
-            seg['isOccupied'] = seg['id'] in occupied_segments
-            m = self.segments_map.get(seg['id'])
-            if m:
-                seg['status'] = m.get('status', seg.get('status'))
-                seg['weather'] = m.get('weather', seg.get('weather', 'GOOD'))
+        # patch only what changed since the last sync (signals, occupancy, status/weather)
+        if self._dirty_segments:
+            for seg_id in self._dirty_segments:
+                seg = self._network_segments_by_id.get(seg_id)
+                if seg is None:
+                    continue
+                seg['isOccupied'] = self._segment_occupancy.get(seg_id, 0) > 0
+                m = self.segments_map.get(seg_id)
+                if m:
+                    seg['status'] = m.get('status', seg.get('status'))
+                    seg['weather'] = m.get('weather', seg.get('weather', 'GOOD'))
+            self._changed_segments |= self._dirty_segments
+            self._dirty_segments.clear()
+
+        if self._dirty_nodes:
+            for node_id in self._dirty_nodes:
+                node = self._network_nodes_by_id.get(node_id)
+                mapnode = self.nodes_map.get(node_id)
+                if node is not None and mapnode:
+                    node['state'] = mapnode.get('state', node.get('state'))
+            self._changed_nodes |= self._dirty_nodes
+            self._dirty_nodes.clear()
+
+    def collect_changes(self):
+        """
+        Trains, nodes and segments that changed since the previous call, then reset the journal.
+        RUNNING trains are always included because their position moves every step.
+        """
+        self.kinematics.materialise()
+        self._update_network_state()
 
-        for node in self.network['nodes']:
-            mapnode = self.nodes_map.get(node['id'])
-            if mapnode:
-                node['state'] = mapnode.get('state', node.get('state'))
+        changed_ids = self._changed_trains | {t['id'] for t in self.trains.in_state('RUNNING')}
+        trains = sorted((self.trains.get(tid) for tid in changed_ids if tid in self.trains),
+                        key=lambda t: self.trains.order_of(t['id']))
+        nodes = [
+            {'id': nid, 'state': self._network_nodes_by_id[nid].get('state')}
+            for nid in sorted(self._changed_nodes) if nid in self._network_nodes_by_id
+        ]
+        segments = []
+        for sid in sorted(self._changed_segments):
+            seg = self._network_segments_by_id.get(sid)
+            if seg is not None:
+                segments.append({'id': sid, 'isOccupied': seg.get('isOccupied', False),
+                                 'status': seg.get('status'), 'weather': seg.get('weather', 'GOOD')})
+        removed = sorted(self._removed_trains)
+
+        self._changed_trains.clear()
+        self._changed_nodes.clear()
+        self._changed_segments.clear()
+        self._removed_trains.clear()
+        return {'trains': trains, 'removedTrains': removed, 'nodes': nodes, 'segments': segments}
+
+    def _remove_exited_trains(self):
+        for t in self.trains.in_state('EXITED'):
+            self._set_current_segment(t, None)
+            self.kinematics.remove(t['id'])
+            self._changed_trains.discard(t['id'])
+            self._removed_trains.add(t['id'])
+            self.train_holds.pop(t['id'], None)
+            self.trains.remove(t['id'])
+
+    def _schedule_event(self, at_time, kind, train_id=None):
+        heapq.heappush(self._event_queue, (at_time, next(self._event_seq), kind, train_id))
+
+    def request_wakeup(self):
+        """Ask the event engine to re-evaluate dispatch at the current time (external input changed)."""
+        self._schedule_event(self.current_time_seconds, 'external')
+
+    def fork(self, event_log=None, engine_mode=None):
+        """
+        Independent copy for what-if lookahead. The static parts (compiled graph, schedule rows,
+        priority table) are shared read-only; everything a step can mutate (trains, kinematics,
+        locks, node / segment state, event queue, rng, route cache) is copied, so advancing or
+        changing the fork never touches this instance. Forks log nothing unless given a log, and
+        pickle cleanly, so they can be shipped to worker processes.
+        """
+        self.kinematics.materialise()
+        self._update_network_state()
+        clone = copy.copy(self)
+        clone.log = event_log or EventLog(level=OFF)
+        clone.engine_mode = engine_mode or self.engine_mode
+
+        # network: the UI dicts and the working maps are patched in place on every step
+        clone.network = dict(self.network)
+        clone.network['nodes'] = [dict(n) for n in self.network['nodes']]
+        clone.network['trackSegments'] = [dict(s) for s in self.network['trackSegments']]
+        clone._network_nodes_by_id = {n['id']: n for n in clone.network['nodes']}
+        clone._network_segments_by_id = {s['id']: s for s in clone.network['trackSegments']}
+        clone.nodes_map = {nid: dict(n) for nid, n in self.nodes_map.items()}
+        clone.segments_map = {sid: dict(s) for sid, s in self.segments_map.items()}
+        clone._dirty_nodes = set()
+        clone._dirty_segments = set()
+        clone._changed_nodes = set()
+        clone._changed_segments = set()
+        clone._changed_trains = set()
+        clone._removed_trains = set()
+        clone._segment_occupancy = dict(self._segment_occupancy)
+        clone._faulty_segments = set(self._faulty_segments)
+        clone._bad_weather_segments = set(self._bad_weather_segments)
+        clone.route_cache = self.route_cache.copy()
+
+        # trains keep their registry and kinematics slot order so the fork steps exactly like the original
+        trains_by_id = {}
+        clone.trains = TrainRegistry()
+        for train in self.trains:
+            train = dict(train, route=list(train.get('route') or []), node_path=list(train.get('node_path') or []))
+            clone.trains.add(train)
+            trains_by_id[train['id']] = train
+        clone.trains.restore_state_order(self.trains.state_order())
+        clone.kinematics = TrainKinematics(self.graph.segment_ids)
+        clone.kinematics.restore_layout(self.kinematics.slot_layout(), trains_by_id)
+
+        clone.current_ai_priorities = dict(self.current_ai_priorities)
+        clone.train_boosts = dict(self.train_boosts)
+        clone.train_holds = dict(self.train_holds)
+        clone.processed_train_ids = set(self.processed_train_ids)
+        clone._spawn_backlog = deque(self._spawn_backlog)
+        clone.locked_resources = set(self.locked_resources)
+        clone.exit_log = list(self.exit_log)
+        clone._spawned_at = dict(self._spawned_at)
+        clone._departed_at = dict(self._departed_at)
+        clone._event_queue = list(self._event_queue)
+        next_seq = next(self._event_seq)
+        self._event_seq = itertools.count(next_seq)
+        clone._event_seq = itertools.count(next_seq)
+        clone.rng = random.Random()
+        clone.rng.setstate(self.rng.getstate())
+        return clone
+
+    def __getstate__(self):
+        # the event log owns a writer thread and itertools.count does not pickle on every Python
+        state = self.__dict__.copy()
+        state['log'] = None
+        next_seq = next(self._event_seq)
+        self._event_seq = itertools.count(next_seq)
+        state['_event_seq'] = next_seq
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._event_seq = itertools.count(state['_event_seq'])
+        self.log = EventLog(level=OFF)
+
+    def next_event_time(self):
+        q = self._event_queue
+        while q and q[0][0] < self.current_time_seconds:
+            heapq.heappop(q)
+        return q[0][0] if q else None
+
+    def advance_to_next_event(self, until=None):
+        """
+        Event mode: jump straight to the next timed event (segment exit, boarding expiry,
+        scheduled spawn, resource release), then move, spawn and dispatch once at that instant.
+        Returns the new time, or None when nothing is pending (or the next event is past `until`).
+        """
+        next_time = self.next_event_time()
+        if next_time is None or (until is not None and next_time > until):
+            return None
+        while self._event_queue and self._event_queue[0][0] <= next_time:
+            heapq.heappop(self._event_queue)
+
+        dt = next_time - self.current_time_seconds
+        self.current_time_seconds = next_time
+        if dt > 0:
+            self._update_train_positions(dt)
+        self._spawn_trains()
+        self._check_and_dispatch_trains()
+        self._remove_exited_trains()
+        return next_time
+
+    def run_until(self, end_time):
+        """Event mode driver without external control; returns the number of events processed."""
+        steps = 0
+        while self.advance_to_next_event(until=end_time) is not None:
+            steps += 1
+        if end_time > self.current_time_seconds:
+            # nothing fires before end_time, so moving the remainder cannot complete a segment
+            self._update_train_positions(end_time - self.current_time_seconds)
+            self.current_time_seconds = end_time
+        return steps
+
+    def step(self):
+        if self.engine_mode == 'event':
+            return self.advance_to_next_event()
+        self.tick()
+        return self.current_time_seconds
 
     def tick(self):
         self.current_time_seconds += self.tick_rate * self.sim_speed
         self._spawn_trains()
         self._check_and_dispatch_trains()
         self._update_train_positions()
-        self.active_trains = [t for t in self.active_trains if t.get('state') != 'EXITED']
+        self._remove_exited_trains()
+        # compatibility mode does not consume the event queue; drop what is already in the past
+        self.next_event_time()
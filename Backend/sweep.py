@@ -0,0 +1,167 @@
+"""
+Scenario sweep engine: expands a declarative grid into independent headless runs, fans them out
+over a ProcessPoolExecutor (each worker builds its own Simulation / Optimizer from the layout and
+schedule files) and aggregates the KPI summaries into one table.
+
+A grid is a JSON object. List values are axes of the cartesian product; anything else is shared by
+every scenario. 'priorities' entries are merged over the headless defaults.
+
+    {
+      "section": "DLI",
+      "until": 7200,
+      "schedule": [null, "data/intelligent_schedule.csv"],
+      "priorities": [{}, {"trainType": false}, {"punctuality": false}],
+      "faulty": [[], ["T-WEST-1"]],
+      "weather": [null, ["TS-PF33-PF43"]]
+    }
+
+    python sweep.py grid.json --processes 4 --out results.csv
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from headless import DEFAULT_PRIORITIES, run_headless
+
+# grid key -> run_headless keyword
+GRID_KEYS = {
+    'section': 'section_code',
+    'until': 'until',
+    'layout': 'layout_path',
+    'schedule': 'schedule_path',
+    'priorities': 'priorities',
+    'faulty': 'faulty_tracks',
+    'weather': 'bad_weather',
+    'ai_signals': 'ai_signals',
+}
+# grid keys whose value is itself a list, so an axis is a list of lists
+LIST_VALUED = ('faulty', 'weather')
+
+
+def _is_axis(key, value):
+    if not isinstance(value, list):
+        return False
+    if key in LIST_VALUED:
+        # ["T-1", "T-2"] is one scenario value; [[], ["T-1"]] is an axis
+        return all(v is None or isinstance(v, list) for v in value) and bool(value)
+    return True
+
+
+def expand_grid(grid):
+    """Cartesian product of the grid's axes -> list of scenario dicts (grid keys), each with an 'id'."""
+    unknown = set(grid) - set(GRID_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown grid keys: {sorted(unknown)}; expected {sorted(GRID_KEYS)}")
+    axes = [(k, v) for k, v in grid.items() if _is_axis(k, v)]
+    fixed = {k: v for k, v in grid.items() if not _is_axis(k, v)}
+    scenarios = []
+    for i, combo in enumerate(itertools.product(*[v for _, v in axes])):
+        scenario = dict(fixed)
+        scenario.update(zip([k for k, _ in axes], combo))
+        scenario['id'] = i
+        scenarios.append(scenario)
+    return scenarios
+
+
+def _run_scenario(scenario, solver_threads):
+    """Worker entry point: one headless run with console output swallowed. Never raises."""
+    kwargs = {GRID_KEYS[k]: v for k, v in scenario.items() if k in GRID_KEYS and v is not None}
+    if 'priorities' in kwargs:
+        kwargs['priorities'] = {**DEFAULT_PRIORITIES, **kwargs['priorities']}
+    kwargs.setdefault('section_code', 'DLI')
+    started = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = run_headless(log_level='off', num_workers=solver_threads, **kwargs)
+        return scenario, summary, None
+    except Exception:
+        return scenario, None, traceback.format_exc(limit=3) + f" (after {time.perf_counter() - started:.1f}s)"
+
+
+def _row(scenario, summary, error):
+    row = {
+        'id': scenario['id'],
+        'section': scenario.get('section', 'DLI'),
+        'schedule': scenario.get('schedule') or 'default',
+        'priorities': json.dumps(scenario.get('priorities') or {}, sort_keys=True),
+        'faulty': ' '.join(scenario.get('faulty') or []),
+        'weather': ' '.join(scenario.get('weather') or []),
+        'error': error,
+    }
+    if summary:
+        trains, delay, solver = summary['trains'], summary['delay_seconds'], summary['solver']
+        row.update({
+            'sim_seconds': summary['sim_seconds'],
+            'wall_seconds': summary['wall_seconds'],
+            'ticks_per_second': summary['ticks_per_second'],
+            'scheduled': trains['scheduled'],
+            'exited': trains['exited'],
+            'still_active': trains['still_active'],
+            'throughput_per_hour': summary['throughput_per_hour'],
+            'delay_mean': delay['mean'],
+            'delay_p50': delay['p50'],
+            'delay_p95': delay['p95'],
+            'delay_max': delay['max'],
+            'departure_delay_mean': summary['departure_delay_seconds']['mean'],
+            'solver_calls': solver['calls'],
+            'solver_seconds': solver['total_seconds'],
+            'solver_max_seconds': solver['max_seconds'],
+        })
+    return row
+
+
+def run_sweep(scenarios, processes=None, solver_threads=None, on_result=None):
+    """
+    Run scenarios across a process pool and return a DataFrame with one row per scenario (by id).
+    CP-SAT threads per process default to cores // processes so the pool never oversubscribes the machine.
+    """
+    cores = os.cpu_count() or 1
+    processes = max(1, min(processes or cores, len(scenarios) or 1))
+    solver_threads = solver_threads or max(1, cores // processes)
+    rows = []
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(_run_scenario, s, solver_threads) for s in scenarios]
+        for future in as_completed(futures):
+            row = _row(*future.result())
+            rows.append(row)
+            if on_result:
+                on_result(row, len(rows), len(scenarios))
+    return pd.DataFrame(rows).sort_values('id').reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fan a scenario grid across processes and tabulate the KPIs.")
+    parser.add_argument('grid', help="Grid JSON file")
+    parser.add_argument('--processes', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--solver-threads', type=int, default=None, help="CP-SAT threads per process (default: cores / processes)")
+    parser.add_argument('--out', default='sweep_results.csv', help="CSV file for the aggregated table")
+    args = parser.parse_args(argv)
+
+    with open(args.grid) as f:
+        scenarios = expand_grid(json.load(f))
+    print(f"🧪 Sweep: {len(scenarios)} scenario(s) from {args.grid}")
+
+    def progress(row, done, total):
+        status = f"❌ {row['error'].splitlines()[-1]}" if row['error'] else f"{row['exited']}/{row['scheduled']} exited, delay mean {row['delay_mean']}s"
+        print(f"  [{done}/{total}] scenario {row['id']}: {status}")
+
+    started = time.perf_counter()
+    table = run_sweep(scenarios, processes=args.processes, solver_threads=args.solver_threads, on_result=progress)
+    table.to_csv(args.out, index=False)
+    print(f"✅ Sweep finished in {time.perf_counter() - started:.1f}s; results written to {args.out}")
+    columns = [c for c in ('id', 'schedule', 'priorities', 'faulty', 'weather', 'exited', 'throughput_per_hour',
+                           'delay_mean', 'delay_p95', 'solver_seconds', 'error') if c in table.columns]
+    print(table[columns].to_string(index=False))
+    return table
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import contextlib
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # layouts are read relative to Backend/
+
+from eventlog import EventLog, OFF
+from signal_control import SignalController
+from simulation import Simulation
+
+
+def _sim():
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Simulation('DLI', engine_mode='event', event_log=EventLog(level=OFF), seed=1)
+
+
+def test_override_at_start_survives_next_ai_pass():
+    sim = _sim()
+    assert sim.current_time_seconds == 0
+    signals = SignalController(clock=lambda: sim.current_time_seconds)
+    signal_id = next(n['id'] for n in sim.network['nodes'] if n.get('type') == 'SIGNAL')
+
+    assert signals.apply(sim, signal_id, 'RED', by='manual')
+    assert signals.manual_override_timestamps == {signal_id: 0}
+    assert signals.overridden_recently(signal_id)
+
+    assert not signals.apply(sim, signal_id, 'GREEN', by='ai')
+    signals.clear_waiting_trains(sim)
+    assert sim.nodes_map[signal_id]['state'] == 'RED'
+
+
+def test_stamps_move_between_clocks():
+    now = [1000.0]
+    signals = SignalController(clock=lambda: now[0])
+    signals.record_manual_override('S1')
+    now[0] += 5
+    assert signals.stamps_at(60) == {'S1': 55}
+
+    restored = SignalController(clock=lambda: 7.0)
+    restored.restore_stamps({'S1': 55}, 60)
+    assert restored.manual_override_timestamps == {'S1': 2.0}
+    assert restored.overridden_recently('S1')
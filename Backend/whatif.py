@@ -0,0 +1,204 @@
+"""
+What-if lookahead on simulation forks: "hold the Rajdhani 5 minutes", "fail TS-YI-PF1 now".
+
+Each scenario is a list of actions applied to a fork of the live simulation, which is then run
+ahead `minutes` simulated minutes with the same loop as headless.py (event engine, AI signal pass,
+Optimizer plans). A baseline fork with no actions runs alongside, and every scenario is reported
+with its KPIs and the difference to the baseline. The live instance is only read (Simulation.fork),
+and forks pickle, so evaluate() fans scenarios out over a process pool and the live tick keeps its
+cadence while they run.
+
+    {"name": "hold 12951", "actions": [{"type": "hold", "train": "12951", "seconds": 300}]}
+    {"name": "west failure", "actions": [{"type": "fail_track", "track": "TS-YI-PF1"}]}
+"""
+import contextlib
+import io
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from headless import DEFAULT_PRIORITIES, _distribution
+from optimizer import Optimizer
+from plan_cache import PlanCache
+from signal_control import SignalController
+
+DEFAULT_MINUTES = 10
+# KPIs reported as scenario - baseline
+DELTA_KEYS = ('exited', 'delay_mean', 'waiting', 'waiting_seconds', 'held_back_seconds')
+
+_pool = None
+_pool_size = None
+# per process: scenarios forked from the same moment mostly plan the same groups (plan_cache.py)
+_plan_cache = PlanCache()
+
+
+def apply_action(sim, action):
+    """Apply one scenario action to a fork. Unknown types raise ValueError."""
+    kind = action.get('type')
+    if kind == 'hold':
+        if not sim.hold_train(str(action['train']), int(action.get('seconds', 300))):
+            raise ValueError(f"Train {action['train']} is not active")
+    elif kind == 'release':
+        sim.release_train(str(action['train']))
+    elif kind == 'fail_track':
+        sim.set_track_status(action['track'].strip().upper(), 'FAULTY')
+    elif kind == 'restore_track':
+        sim.set_track_status(action['track'].strip().upper(), 'OPERATIONAL')
+    elif kind == 'signal':
+        sim.set_signal_state(action['signal'], action['state'], announce=False)
+    elif kind == 'weather':
+        sim.set_bad_weather(action.get('segments') or [])
+    else:
+        raise ValueError(f"Unknown what-if action {kind!r}")
+
+
+def run_fork(sim, actions=(), minutes=DEFAULT_MINUTES, priorities=None, ai_signals=True,
+             override_stamps=None, num_workers=1):
+    """
+    Apply `actions` to `sim` (a fork; it is consumed) and run it `minutes` ahead.
+    Returns the KPI dict for the window.
+    """
+    started = time.perf_counter()
+    start_time = sim.current_time_seconds
+    until = start_time + int(minutes * 60)
+    exits_before = len(sim.exit_log)
+    sim.engine_mode = 'event'
+    sim.request_wakeup()
+
+    priorities = dict(priorities or DEFAULT_PRIORITIES)
+    signals = SignalController(clock=lambda: sim.current_time_seconds)
+    signals.ai_control_enabled = ai_signals
+    signals.manual_override_timestamps = dict(override_stamps or {})
+    for action in actions:
+        apply_action(sim, action)
+    optimizer = Optimizer(simulation_instance=sim, num_workers=num_workers)
+    optimizer.plan_cache = _plan_cache
+    cache_hits = _plan_cache.hits
+
+    solver_calls = 0
+    while sim.advance_to_next_event(until=until) is not None:
+        current_state = sim.get_state()
+        if signals.ai_control_enabled:
+            greens, reds = signals.clear_waiting_trains(sim)
+            if greens + reds:
+                sim.plan_needed = True
+        trains_needing_plan = sim.trains.in_state('WAITING_PLAN')
+        if trains_needing_plan and sim.plan_needed:
+            sim.plan_needed = False
+            plan = optimizer.generate_plan(trains_needing_plan, current_state, priorities)
+            solver_calls += 1
+            if plan:
+                signals.preset_plan_signals(sim, plan)
+                sim.apply_plan(plan)
+    sim.run_until(until)
+    kpis = _window_kpis(sim, exits_before, start_time, solver_calls, time.perf_counter() - started)
+    kpis['plan_cache_hits'] = _plan_cache.hits - cache_hits
+    return kpis
+
+
+def _window_kpis(sim, exits_before, start_time, solver_calls, wall_seconds):
+    now = sim.current_time_seconds
+    exits = sim.exit_log[exits_before:]
+    delays = _distribution([e['exited_at'] - e['scheduled_arrival'] - e['ideal_seconds'] for e in exits if e['scheduled_arrival'] is not None])
+    waiting = sim.trains.in_state('WAITING_PLAN', 'READY_TO_PROCEED', 'STOPPED_AWAITING_CLEARANCE')
+    # trains still waiting at the horizon carry their wait so far (capped at the window)
+    waiting_seconds = sum(now - max(t['waiting_since'], start_time) for t in waiting if t.get('waiting_since') is not None)
+    # trains that were due inside the window but have not left their start node
+    held_back = [t for t in sim.trains if not t.get('currentSegmentId') and t.get('scheduled_arrival') is not None]
+    return {
+        'from': start_time,
+        'to': now,
+        'exited': len(exits),
+        'exited_ids': [e['id'] for e in exits],
+        'delay_seconds': delays,
+        'delay_mean': delays['mean'],
+        'active': len(sim.trains),
+        'waiting': len(waiting),
+        'waiting_seconds': int(waiting_seconds),
+        'held_back_seconds': int(sum(now - max(t['scheduled_arrival'], start_time) for t in held_back if t['scheduled_arrival'] < now)),
+        'by_state': sim.trains.counts(),
+        'solver_calls': solver_calls,
+        'wall_seconds': round(wall_seconds, 3),
+    }
+
+
+def _run_scenario(sim, scenario, minutes, priorities, ai_signals, override_stamps, num_workers):
+    """Worker entry point (also used in-process). Never raises; console output is swallowed."""
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            kpis = run_fork(sim, scenario.get('actions') or (), minutes, priorities, ai_signals, override_stamps, num_workers)
+        return {'name': scenario.get('name'), 'actions': scenario.get('actions') or [], 'kpis': kpis, 'error': None}
+    except Exception:
+        return {'name': scenario.get('name'), 'actions': scenario.get('actions') or [], 'kpis': None,
+                'error': traceback.format_exc(limit=3)}
+
+
+def get_pool(processes=None):
+    """Shared worker pool for the server, created on first use (spawning per request costs ~1 s)."""
+    global _pool, _pool_size
+    processes = processes or int(os.environ.get('FLOWSTATE_WHATIF_PROCESSES', '0')) or max(1, min(4, (os.cpu_count() or 2) - 1))
+    if _pool is None or _pool_size != processes:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = ProcessPoolExecutor(max_workers=processes)
+        _pool_size = processes
+    return _pool
+
+
+def submit(sim, scenarios, minutes=DEFAULT_MINUTES, priorities=None, ai_signals=True, override_stamps=None,
+           pool=None, num_workers=1):
+    """
+    Fork `sim` once per scenario plus a baseline and submit each to the pool. Forking is the only
+    work done on the caller's thread; the pool pickles and runs the forks. Returns the futures,
+    baseline first.
+    """
+    pool = pool or get_pool()
+    runs = [{'name': 'baseline', 'actions': []}] + list(scenarios)
+    return [pool.submit(_run_scenario, sim.fork(engine_mode='event'), run, minutes, priorities, ai_signals,
+                        override_stamps, num_workers) for run in runs]
+
+
+def compare(results):
+    """Results from submit() / evaluate() (baseline first) -> report with per-scenario deltas."""
+    baseline, scenarios = results[0], results[1:]
+    base = baseline['kpis']
+    for result in scenarios:
+        kpis = result['kpis']
+        if base is None or kpis is None:
+            result['delta'] = None
+            continue
+        result['delta'] = {key: None if kpis[key] is None or base[key] is None else round(kpis[key] - base[key], 2)
+                           for key in DELTA_KEYS}
+    return {'baseline': baseline, 'scenarios': scenarios}
+
+
+def evaluate(sim, scenarios, minutes=DEFAULT_MINUTES, priorities=None, ai_signals=True, override_stamps=None,
+             processes=None, num_workers=1):
+    """Run scenarios (and a baseline) on forks of `sim`; processes=0 runs them in this process."""
+    if processes == 0:
+        runs = [{'name': 'baseline', 'actions': []}] + list(scenarios)
+        results = [_run_scenario(sim.fork(engine_mode='event'), run, minutes, priorities, ai_signals,
+                                 override_stamps, num_workers) for run in runs]
+    else:
+        with ProcessPoolExecutor(max_workers=processes or max(1, min(len(scenarios) + 1, os.cpu_count() or 1))) as pool:
+            futures = submit(sim, scenarios, minutes, priorities, ai_signals, override_stamps, pool, num_workers)
+            results = [f.result() for f in futures]
+    return compare(results)
+
+
+def format_report(report):
+    lines = []
+    base = report['baseline']['kpis']
+    if base:
+        lines.append(f"🔮 What-if {base['from']}s -> {base['to']}s | baseline: {base['exited']} exited, "
+                     f"delay mean {base['delay_mean']}s, {base['waiting']} waiting ({base['waiting_seconds']}s)")
+    for result in report['scenarios']:
+        if result['error']:
+            lines.append(f"   ❌ {result['name']}: {result['error'].splitlines()[-1]}")
+            continue
+        kpis, delta = result['kpis'], result['delta'] or {}
+        lines.append(f"   {result['name']}: {kpis['exited']} exited ({delta.get('exited')}), "
+                     f"delay mean {kpis['delay_mean']}s ({delta.get('delay_mean')}), "
+                     f"waiting {kpis['waiting_seconds']}s ({delta.get('waiting_seconds')})")
+    return '\n'.join(lines)